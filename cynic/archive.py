@@ -0,0 +1,175 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+"""Append-only archive of recorded HTTP request/response pairs.
+
+The archive file is a sequence of records:
+
+    header (RECORD) | key | raw request | raw response
+
+and a companion index file (archive path + '.idx') holds a fixed-size
+entry per record: the digest of the key and the offset and length of
+the response in the archive. Keys are made of the method, the path and
+a hash of the request body, see make_key.
+
+Both files are only ever appended to, so a torn write at worst leaves
+an incomplete last record that readers ignore. The index can always be
+rebuilt from the archive.
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import os
+import mmap
+import fcntl
+import struct
+import hashlib
+
+MAGIC = 'CYN1'
+# magic, key length, request length, response length
+RECORD = struct.Struct('<4sHII')
+# key digest, response offset, response length
+INDEX_ENTRY = struct.Struct('<8sQI')
+
+
+def make_key(method, path, body=''):
+    return '%s %s %s' % (method, path, hashlib.sha1(body).hexdigest())
+
+
+def get_digest(key):
+    return hashlib.sha1(key).digest()[:8]
+
+
+class Archive(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.data = None
+        self.index = None
+
+    def append(self, key, request, response):
+        """Append a record, safe to call from several processes."""
+        header = RECORD.pack(MAGIC, len(key), len(request), len(response))
+        with open(self.path, 'ab') as archive:
+            # the lock keeps records and index entries in the same order
+            fcntl.flock(archive, fcntl.LOCK_EX)
+            try:
+                offset = os.fstat(archive.fileno()).st_size
+                archive.write(header + key + request + response)
+                archive.flush()
+                response_offset = (
+                    offset + RECORD.size + len(key) + len(request))
+                with open(self.index_path, 'ab') as index:
+                    index.write(INDEX_ENTRY.pack(
+                        get_digest(key), response_offset, len(response)))
+            finally:
+                fcntl.flock(archive, fcntl.LOCK_UN)
+
+    def scan(self):
+        """Yield (key, request, response offset, response length).
+
+        Only complete records are yielded.
+        """
+        data = self._map()
+        offset = 0
+        while offset + RECORD.size <= len(data):
+            magic, key_len, request_len, response_len = RECORD.unpack_from(
+                data, offset)
+            if magic != MAGIC:
+                raise ValueError(
+                    'Corrupt archive %r at offset %d' % (self.path, offset))
+            start = offset + RECORD.size
+            end = start + key_len + request_len + response_len
+            if end > len(data): # incomplete last record
+                break
+            key = data[start:start + key_len]
+            request = data[start + key_len:end - response_len]
+            yield key, request, end - response_len, response_len
+            offset = end
+
+    def rebuild_index(self):
+        """Write the index from scratch out of the archive."""
+        entries = []
+        for key, request, offset, length in self.scan():
+            entries.append(INDEX_ENTRY.pack(get_digest(key), offset, length))
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as index:
+            index.write(''.join(entries))
+        os.rename(tmp_path, self.index_path)
+
+    def load(self):
+        """Map the archive and read the index into memory.
+
+        A missing index is rebuilt. Entries pointing past the end of the
+        archive (their record is still being written) are skipped, the
+        latest recording of a key wins.
+        """
+        data = self._map()
+        if not os.path.exists(self.index_path):
+            self.rebuild_index()
+        with open(self.index_path, 'rb') as f:
+            raw = f.read()
+        index = {}
+        end = len(raw) - len(raw) % INDEX_ENTRY.size
+        for position in xrange(0, end, INDEX_ENTRY.size):
+            digest, offset, length = INDEX_ENTRY.unpack_from(raw, position)
+            if offset + length <= len(data):
+                index[digest] = (offset, length)
+        self.index = index
+        return self
+
+    def lookup(self, key):
+        """Return the recorded response for the key or None."""
+        location = self.index.get(get_digest(key))
+        if location is None:
+            return None
+        offset, length = location
+        return buffer(self.data, offset, length)
+
+    def _map(self):
+        if self.data is None:
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    self.data = ''
+                else:
+                    self.data = mmap.mmap(
+                        f.fileno(), size, mmap.MAP_SHARED, mmap.PROT_READ)
+        return self.data
+
+
+_archives = {}
+
+
+def get_archive(path):
+    """Return the loaded archive, loading it on the first call.
+
+    Call it before forking, so children share the mapping and the index.
+    """
+    archive = _archives.get(path)
+    if archive is None:
+        archive = _archives[path] = Archive(path).load()
+    return archive
@@ -0,0 +1,549 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+"""Benchmark of the Cynic server itself.
+
+Starts a server for every handler of the default configuration (plus
+a stats handler to read the server's own counters) and measures:
+
+* accept rate - connections accepted by the server per second when
+  a burst of clients connect and hang up at once
+* time to first byte of the response
+* hold capacity - how many of the requested concurrent connections the
+  server keeps open and how much memory they take
+
+Results are written as JSON to compare engines and releases.
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import os
+import sys
+import json
+import time
+import errno
+import shlex
+import socket
+import select
+import signal
+import struct
+import urllib2
+import optparse
+import platform
+import resource
+import StringIO
+import tempfile
+import subprocess
+import ConfigParser
+
+from cynic.server import DEFAULT_CONFIG
+
+PORT_BASE = 30000
+CONCURRENCY = 50
+CONNECTIONS = 2000 # in the accept test
+REQUESTS = 200 # in the time to first byte test
+HOLD = 500
+TIMEOUT = 2 # secs
+START_TIMEOUT = 10 # secs
+MAX_NOFILE = 1 << 20 # open files limit to ask for when unlimited
+
+REQUEST = 'GET / HTTP/1.0\r\nHost: localhost\r\n\r\n'
+
+# close without TIME_WAIT, or we'd run out of local ports
+LINGER_RESET = struct.pack('ii', 1, 0)
+
+SERVER_CODE = (
+    'import signal; '
+    'signal.signal(signal.SIGINT, signal.default_int_handler); '
+    'from cynic.server import main; main()'
+    )
+
+
+def _percentile(values, fraction):
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+def summarize(values):
+    """Return min, max and percentiles of the values in milliseconds."""
+    if not values:
+        return None
+    values = sorted(value * 1000 for value in values)
+    return dict(
+        min=values[0],
+        p50=_percentile(values, 0.5),
+        p90=_percentile(values, 0.9),
+        p99=_percentile(values, 0.99),
+        max=values[-1],
+        )
+
+
+class LoadGenerator(object):
+    """Drives many non-blocking client connections from one process.
+
+    Every connection connects, optionally sends a request and waits for
+    the first byte of the response, then it's reset and replaced with
+    a new one until the test is over.
+    """
+
+    def __init__(self, address, concurrency=CONCURRENCY,
+                 wait_response=False, timeout=TIMEOUT):
+        self.address = address
+        self.concurrency = concurrency
+        self.wait_response = wait_response
+        self.timeout = timeout
+        self.poller = select.poll()
+        self.conns = {} # fd -> [sock, started, connected]
+        self.started = 0
+        self.results = dict(
+            connected=0, errors=0, timeouts=0, responses=0, closed=0)
+        self.ttfb = []
+
+    def _open(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, LINGER_RESET)
+        code = sock.connect_ex(self.address)
+        if code not in (0, errno.EINPROGRESS):
+            self.results['errors'] += 1
+            sock.close()
+            return
+        self.started += 1
+        self.conns[sock.fileno()] = [sock, time.time(), False]
+        self.poller.register(sock.fileno(), select.POLLOUT)
+
+    def _close(self, fd):
+        sock = self.conns.pop(fd)[0]
+        self.poller.unregister(fd)
+        sock.close()
+
+    def _handle(self, fd, event):
+        conn = self.conns[fd]
+        sock, started, connected = conn
+        results = self.results
+        if not connected:
+            code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if code:
+                results['errors'] += 1
+                self._close(fd)
+                return
+            results['connected'] += 1
+            if not self.wait_response:
+                self._close(fd)
+                return
+            conn[2] = True
+            try:
+                sock.send(REQUEST)
+            except socket.error:
+                pass
+            self.poller.modify(fd, select.POLLIN)
+            return
+
+        try:
+            data = sock.recv(1)
+        except socket.error:
+            data = ''
+        if data:
+            results['responses'] += 1
+            self.ttfb.append(time.time() - started)
+        else: # closed or reset without a response
+            results['closed'] += 1
+        self._close(fd)
+
+    def _expire(self, now):
+        for fd, (sock, started, connected) in self.conns.items():
+            if now - started >= self.timeout:
+                self.results['timeouts'] += 1
+                self._close(fd)
+
+    def run(self, duration=None, count=None):
+        """Run until duration secs pass or count connections are done."""
+        start = time.time()
+        while True:
+            now = time.time()
+            if duration is not None and now - start >= duration:
+                break
+            while (len(self.conns) < self.concurrency and
+                   (count is None or self.started < count)):
+                self._open()
+            if not self.conns:
+                break
+            for fd, event in self.poller.poll(100):
+                self._handle(fd, event)
+            self._expire(time.time())
+
+        for fd in self.conns.keys():
+            self._close(fd)
+        self.results['elapsed'] = time.time() - start
+        return self.results
+
+
+def hold_connections(address, number, timeout=TIMEOUT):
+    """Open number connections sending a request on each.
+
+    Returns the list of sockets that got connected.
+    """
+    socks = []
+    for _ in xrange(number):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, LINGER_RESET)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+            sock.sendall(REQUEST)
+        except socket.error:
+            sock.close()
+            continue
+        socks.append(sock)
+    return socks
+
+
+def get_process_tree(pid):
+    """Return pid and the pids of all its descendants."""
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name) as f:
+                stat = f.read()
+        except IOError:
+            continue
+        # the command name may contain spaces, skip past it
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(name))
+
+    pids = [pid]
+    for pid in pids:
+        pids.extend(children.get(pid, []))
+    return pids
+
+
+def _read_kb(path, field):
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def get_memory(pid):
+    """Return (processes, RSS, PSS) of the process tree, sizes in bytes.
+
+    PSS splits shared pages between processes, so it doesn't count
+    the memory forked children share with the parent over and over.
+    It's None if the kernel doesn't report it.
+    """
+    pids = get_process_tree(pid)
+    rss = pss = 0
+    for pid in pids:
+        rss += _read_kb('/proc/%d/status' % pid, 'VmRSS:') or 0
+        value = _read_kb('/proc/%d/smaps_rollup' % pid, 'Pss:')
+        if value is None or pss is None:
+            pss = None
+        else:
+            pss += value
+    return len(pids), rss * 1024, pss and pss * 1024
+
+
+class Server(object):
+    """Cynic server in a subprocess."""
+
+    def __init__(self, config, args, log=os.devnull):
+        self.config = config
+        self.args = args
+        self.log = log
+        self.process = None
+
+    def start(self, stats_port):
+        fd, self.config_path = tempfile.mkstemp(suffix='.ini')
+        with os.fdopen(fd, 'w') as f:
+            self.config.write(f)
+        log = open(self.log, 'a')
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', SERVER_CODE, '-c', self.config_path] +
+            self.args, stdout=log, stderr=log)
+        log.close()
+
+        deadline = time.time() + START_TIMEOUT
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(
+                    'Server exited with status %d' % self.process.returncode)
+            try:
+                return get_stats(stats_port)
+            except (IOError, ValueError):
+                time.sleep(0.1)
+        raise RuntimeError('Server did not start in %d secs' % START_TIMEOUT)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+            deadline = time.time() + 5
+            while self.process.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if self.process.poll() is None:
+                for pid in reversed(get_process_tree(self.process.pid)):
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                self.process.wait()
+        os.unlink(self.config_path)
+
+
+def get_stats(port):
+    data = urllib2.urlopen('http://127.0.0.1:%d/' % port, timeout=5).read()
+    return json.loads(data)['handlers']
+
+
+def make_config(section, default, port, stats_port, backlog):
+    """Return a config with the handler on port and a stats handler."""
+    config = ConfigParser.RawConfigParser()
+    config.add_section(section)
+    for name, value in default.items(section):
+        config.set(section, name, value)
+    config.set(section, 'host', '127.0.0.1')
+    config.set(section, 'port', str(port))
+    # the whole burst of the accept test has to fit into the queue
+    config.set(section, 'backlog', str(backlog))
+
+    config.add_section('handler:stats')
+    config.set(
+        'handler:stats', 'class', 'cynic.handlers.stats.HTTPStatsResponse')
+    config.set('handler:stats', 'host', '127.0.0.1')
+    config.set('handler:stats', 'port', str(stats_port))
+    return config
+
+
+def raise_nofile_limit():
+    """Raise the soft limit of open files to the hard one if allowed."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    limit = hard
+    if hard == resource.RLIM_INFINITY:
+        limit = MAX_NOFILE
+    if soft == resource.RLIM_INFINITY or soft >= limit:
+        return
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+    except (ValueError, OSError) as e:
+        print >> sys.stderr, (
+            'Failed to raise the open files limit to %d, keeping %d: %s' %
+            (limit, soft, e))
+
+
+def _wait_accepted(stats_port, name, accepted, timeout=TIMEOUT):
+    """Wait for the server to accept the connections, return the count."""
+    deadline = time.time() + timeout
+    while True:
+        count = get_stats(stats_port)[name]['accepted']
+        if count >= accepted or time.time() >= deadline:
+            return count
+        time.sleep(0.05)
+
+
+def bench_handler(section, default, options):
+    name = section[len('handler:'):]
+    port = options.port_base
+    stats_port = options.port_base + 1
+    address = ('127.0.0.1', port)
+    server = Server(
+        make_config(
+            section, default, port, stats_port, options.connections),
+        options.server_args, options.server_log)
+    result = dict(handler=default.get(section, 'class'))
+    try:
+        server.start(stats_port)
+        processes, rss, pss = get_memory(server.process.pid)
+        result['idle'] = dict(processes=processes, rss=rss, pss=pss)
+
+        # accept rate
+        start = time.time()
+        generator = LoadGenerator(address, options.concurrency)
+        accept = generator.run(count=options.connections)
+        accepted = _wait_accepted(
+            stats_port, name, accept['connected'],
+            max(options.timeout, options.connections / 100.0))
+        elapsed = time.time() - start
+        accept['accepted'] = accepted
+        accept['rate'] = accepted / elapsed
+        result['accept'] = accept
+
+        # time to first byte
+        generator = LoadGenerator(
+            address, options.concurrency, wait_response=True,
+            timeout=options.timeout)
+        ttfb = generator.run(count=options.requests)
+        ttfb['ttfb_ms'] = summarize(generator.ttfb)
+        result['ttfb'] = ttfb
+
+        # hold capacity
+        before = get_stats(stats_port)[name]
+        base_active = before['active']
+        processes, rss, pss = get_memory(server.process.pid)
+        socks = hold_connections(address, options.hold, options.timeout)
+        _wait_accepted(
+            stats_port, name, before['accepted'] + len(socks),
+            options.timeout)
+        # give handlers a moment to settle on their connections
+        time.sleep(0.5)
+        active = max(0, get_stats(stats_port)[name]['active'] - base_active)
+        held_processes, held_rss, held_pss = get_memory(server.process.pid)
+        for sock in socks:
+            sock.close()
+        hold = dict(
+            requested=options.hold,
+            connected=len(socks),
+            active=active,
+            processes=held_processes,
+            rss=held_rss,
+            pss=held_pss,
+            )
+        if active > 0:
+            hold['rss_per_connection'] = (held_rss - rss) / active
+            if pss is not None and held_pss is not None:
+                hold['pss_per_connection'] = (held_pss - pss) / active
+        result['hold'] = hold
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        server.stop()
+    return result
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [options]',
+        description=(
+            'Benchmark Cynic handlers of the default configuration '
+            'and output the results as JSON'
+            )
+        )
+    parser.add_option(
+        '-s', '--server-args', dest='server_args', default='',
+        help=(
+            'Options passed to the cynic server, for example '
+            '"-e async" or "-p -w 4"'
+            )
+        )
+    parser.add_option(
+        '--handlers', dest='handlers',
+        help=(
+            'Comma separated names of the handler sections to benchmark. '
+            'Default is all TCP handlers.'
+            )
+        )
+    parser.add_option(
+        '-c', '--concurrency', dest='concurrency', type='int',
+        default=CONCURRENCY,
+        help='Concurrent client connections. Default is %d.' % CONCURRENCY
+        )
+    parser.add_option(
+        '-n', '--connections', dest='connections', type='int',
+        default=CONNECTIONS,
+        help=(
+            'Number of connections in the accept test. '
+            'Default is %d.' % CONNECTIONS
+            )
+        )
+    parser.add_option(
+        '-r', '--requests', dest='requests', type='int', default=REQUESTS,
+        help=(
+            'Requests in the time to first byte test. Default is %d.'
+            % REQUESTS
+            )
+        )
+    parser.add_option(
+        '--hold', dest='hold', type='int', default=HOLD,
+        help=(
+            'Concurrent connections to hold open. Default is %d.' % HOLD
+            )
+        )
+    parser.add_option(
+        '-t', '--timeout', dest='timeout', type='float', default=TIMEOUT,
+        help=(
+            'Secs to wait for a connection or the first byte of a '
+            'response. Default is %s.' % TIMEOUT
+            )
+        )
+    parser.add_option(
+        '--port-base', dest='port_base', type='int', default=PORT_BASE,
+        help=(
+            'Port of the handler under test, the stats handler listens on '
+            'the next one. Default is %d.' % PORT_BASE
+            )
+        )
+    parser.add_option(
+        '--server-log', dest='server_log', default=os.devnull,
+        help='File to append the output of the servers to'
+        )
+    parser.add_option(
+        '-o', '--output', dest='output',
+        help='File to write the results to. Default is STDOUT.'
+        )
+
+    options, args = parser.parse_args()
+    options.server_args = shlex.split(options.server_args)
+
+    # we need a descriptor per held connection
+    raise_nofile_limit()
+
+    default = ConfigParser.RawConfigParser()
+    default.readfp(StringIO.StringIO(DEFAULT_CONFIG))
+    sections = [
+        section for section in default.sections()
+        if section.startswith('handler:') and
+        not (default.has_option(section, 'family') and
+             default.get(section, 'family') == 'unix')
+        ]
+    if options.handlers:
+        names = options.handlers.split(',')
+        sections = [
+            section for section in sections
+            if section[len('handler:'):] in names
+            ]
+
+    results = dict(
+        date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpus=os.sysconf('SC_NPROCESSORS_ONLN'),
+        server_args=options.server_args,
+        concurrency=options.concurrency,
+        handlers={},
+        )
+    for section in sections:
+        name = section[len('handler:'):]
+        print >> sys.stderr, 'Benchmarking %s' % name
+        results['handlers'][name] = bench_handler(section, default, options)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print output
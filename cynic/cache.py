@@ -0,0 +1,137 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import os
+import mmap
+import time
+import collections
+
+CACHE_SIZE = 256 * 1024 * 1024 # bytes
+CHECK_INTERVAL = 1 # secs between stat() calls for the same file
+
+
+class _Entry(object):
+
+    __slots__ = ('file', 'data', 'mtime', 'size', 'checked')
+
+    def __init__(self, file, data, mtime, size):
+        self.file = file
+        self.data = data
+        self.mtime = mtime
+        self.size = size
+        self.checked = time.time()
+
+
+class PayloadCache(object):
+    """LRU cache of read-only memory-mapped payload files.
+
+    Files are mapped with MAP_SHARED, so the parent, forked children and
+    workers all share the same physical pages instead of reading their
+    own copy for every connection. An entry is reloaded when the file's
+    mtime or size changes, and least recently used entries are dropped
+    once the total mapped size exceeds max_size.
+
+    A mapping of a file that gets truncated while in use faults on
+    access, so payload files should be replaced (renamed over) rather
+    than rewritten in place.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict() # path -> _Entry
+        self.total = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path):
+        """Return the contents of the file as an mmap (or a str if empty)."""
+        return self._lookup(path).data
+
+    def get_file(self, path):
+        """Return (file object, size) of the file for sendfile.
+
+        The file object is kept open by the cache and must not be closed
+        or read from, use explicit offsets instead.
+        """
+        entry = self._lookup(path)
+        return entry.file, entry.size
+
+    def _lookup(self, path):
+        path = os.path.abspath(path)
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            now = time.time()
+            if now - entry.checked < CHECK_INTERVAL:
+                self.entries[path] = entry # most recently used
+                return entry
+            entry.checked = now
+            try:
+                st = os.stat(path)
+            except OSError:
+                # deleted or unreadable, drop it
+                self.total -= entry.size
+                raise
+            if (st.st_mtime, st.st_size) == (entry.mtime, entry.size):
+                self.entries[path] = entry
+                return entry
+            # stale, the mapping is released when the last user is done
+            self.total -= entry.size
+
+        entry = self._load(path)
+        if entry.size > self.max_size:
+            return entry
+
+        self.entries[path] = entry
+        self.total += entry.size
+        while self.total > self.max_size:
+            _, old = self.entries.popitem(last=False)
+            self.total -= old.size
+        return entry
+
+    def refresh(self):
+        """Reload entries whose files have changed."""
+        for path in self.entries.keys():
+            self.entries[path].checked = 0
+            try:
+                self.get(path)
+            except (IOError, OSError):
+                pass # _lookup has dropped the entry
+
+    def _load(self, path):
+        fin = open(path, 'rb')
+        st = os.fstat(fin.fileno())
+        if st.st_size == 0:
+            data = ''
+        else:
+            data = mmap.mmap(
+                fin.fileno(), st.st_size, mmap.MAP_SHARED, mmap.PROT_READ)
+        return _Entry(fin, data, st.st_mtime, st.st_size)
+
+
+# shared by all handlers of the process (and inherited by its children)
+payloads = PayloadCache()
@@ -0,0 +1,144 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+"""Bookkeeping of the children an IO loop forks.
+
+Children are added to the table when forked and removed when reaped, so
+it only ever holds the running ones. Exit statuses and lifetimes of the
+reaped children are counted, the most recent exits are kept as well.
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import os
+import time
+import errno
+import signal
+import collections
+
+EXIT_HISTORY = 1000 # exits of the most recent children kept
+
+_SIGNAL_NAMES = {}
+for _name in sorted(dir(signal)):
+    if _name.startswith('SIG') and not _name.startswith('SIG_'):
+        # aliases like SIGIOT come after the common names
+        _SIGNAL_NAMES.setdefault(getattr(signal, _name), _name)
+del _name
+
+
+def describe_status(status):
+    """Return a readable form of a waitpid status."""
+    if os.WIFSIGNALED(status):
+        signum = os.WTERMSIG(status)
+        return 'killed by %s' % _SIGNAL_NAMES.get(signum, signum)
+    return 'exit %d' % os.WEXITSTATUS(status)
+
+
+class Child(object):
+    """A forked child serving a connection."""
+
+    __slots__ = ('pid', 'config', 'started', 'slot', 'lane', 'timer',
+                 'signalled')
+
+    def __init__(self, pid, config, started, slot=None, lane=None):
+        self.pid = pid
+        self.config = config
+        self.started = started
+        self.slot = slot # slot of the metrics table
+        self.lane = lane # lane of the log ring
+        self.timer = None # max lifetime timer
+        self.signalled = False # terminated or killed by us
+
+
+class ChildTable(object):
+    """Live table of the forked children, pid -> Child."""
+
+    def __init__(self, history=EXIT_HISTORY):
+        self.children = {}
+        # (pid, handler name, status, lifetime) of the recent exits
+        self.exits = collections.deque(maxlen=history)
+        self.statuses = collections.Counter() # status description -> count
+        self.reaped = 0
+        self.crashed = 0 # exited abnormally without being signalled
+        self.expired = 0 # terminated for outliving the max lifetime
+        self.total_lifetime = 0.0
+        self.max_lifetime = 0.0
+
+    def __len__(self):
+        return len(self.children)
+
+    def __iter__(self):
+        return iter(self.children.keys())
+
+    def __contains__(self, pid):
+        return pid in self.children
+
+    def get(self, pid):
+        return self.children.get(pid)
+
+    def add(self, pid, config, slot=None, lane=None, now=None):
+        if now is None:
+            now = time.time()
+        child = self.children[pid] = Child(pid, config, now, slot, lane)
+        return child
+
+    def remove(self, pid, status, now=None):
+        """Record the exit of a reaped child and drop it from the table.
+
+        Returns the Child, None if the pid isn't ours.
+        """
+        child = self.children.pop(pid, None)
+        if child is None:
+            return None
+        if now is None:
+            now = time.time()
+        lifetime = now - child.started
+        description = describe_status(status)
+        self.reaped += 1
+        if status and not child.signalled:
+            self.crashed += 1
+        self.statuses[description] += 1
+        self.total_lifetime += lifetime
+        self.max_lifetime = max(self.max_lifetime, lifetime)
+        self.exits.append((pid, child.config.name, description, lifetime))
+        return child
+
+    def signal(self, pid, signum):
+        """Send the signal to the child, returns False if it's gone."""
+        child = self.children.get(pid)
+        if child is None:
+            return False
+        try:
+            os.kill(pid, signum)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+            return False
+        child.signalled = True
+        return True
+
+    def mean_lifetime(self):
+        if not self.reaped:
+            return 0.0
+        return self.total_lifetime / self.reaped
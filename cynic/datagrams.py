@@ -0,0 +1,320 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+"""Batched datagram IO.
+
+recvmmsg(2) and sendmmsg(2) move a whole batch of datagrams with one
+system call. Python 2 has neither, so they're called through ctypes
+with buffers and message headers set up once per socket. Where they're
+missing the batch is moved with recvfrom and sendto in a loop.
+
+Addresses of received datagrams are opaque, they're only good for
+sending replies through the same socket wrapper.
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import os
+import errno
+import socket
+import struct
+import ctypes
+import ctypes.util
+
+BATCH = 64 # datagrams per system call
+MAX_DATAGRAM = 65535 # bytes
+ADDRESS_SIZE = 128 # sizeof(struct sockaddr_storage)
+# the kernel caps it with net.core.rmem_max
+RECEIVE_BUFFER = 4 * 1024 * 1024
+
+# errors after which the rest of a batch to send is dropped,
+# just like the network would drop it
+_FULL = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS)
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+        ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+        ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', msghdr),
+        ('msg_len', ctypes.c_uint),
+        ]
+
+
+def _libc_mmsg():
+    """Return (recvmmsg, sendmmsg) built with ctypes or (None, None)."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        recvmmsg = libc.recvmmsg
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None, None
+    recvmmsg.argtypes = [
+        ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+        ctypes.c_void_p
+        ]
+    recvmmsg.restype = ctypes.c_int
+    sendmmsg.argtypes = [
+        ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int
+        ]
+    sendmmsg.restype = ctypes.c_int
+    return recvmmsg, sendmmsg
+
+_recvmmsg, _sendmmsg = _libc_mmsg()
+
+_HEADER_SIZE = ctypes.sizeof(mmsghdr)
+_IOVEC_SIZE = ctypes.sizeof(iovec)
+# struct formats of mmsghdr and iovec, size_t is an unsigned long on Linux
+_HEADER = 'PI4xPLPLi4xI4x'
+_IOVEC = 'PL'
+# just the address and data lengths of mmsghdr
+_LENGTHS = '%dxI%dxI%dx' % (
+    msghdr.msg_namelen.offset,
+    mmsghdr.msg_len.offset - msghdr.msg_namelen.offset - 4,
+    _HEADER_SIZE - mmsghdr.msg_len.offset - 4)
+if (struct.calcsize('@' + _HEADER) != _HEADER_SIZE or
+    struct.calcsize('@' + _IOVEC) != _IOVEC_SIZE):
+    # an ABI the formats don't describe
+    _recvmmsg = _sendmmsg = None
+
+_structs = {}
+
+
+def _get_struct(format, count):
+    """Return the Struct of count repeats of the format."""
+    key = format, count
+    result = _structs.get(key)
+    if result is None:
+        result = _structs[key] = struct.Struct('@' + format * count)
+    return result
+
+
+def _write(array, data):
+    ctypes.memmove(ctypes.addressof(array), data, len(data))
+
+
+class DatagramSocket(object):
+    """Non-blocking datagram socket moving datagrams in batches."""
+
+    def __init__(self, sock, batch=BATCH, size=MAX_DATAGRAM):
+        self.socket = sock
+        self.batch = batch
+        self.size = size
+        self.closed = False
+        try:
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        except socket.error:
+            pass
+
+    def close(self):
+        """Close the socket, replies still to be sent are dropped."""
+        self.closed = True
+        self.socket.close()
+
+    def recv(self):
+        """Return (data, address) of up to batch waiting datagrams."""
+        datagrams = []
+        recvfrom = self.socket.recvfrom
+        size = self.size
+        for _ in xrange(self.batch):
+            try:
+                datagrams.append(recvfrom(size))
+            except socket.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                if e.args[0] in _FULL:
+                    break
+                raise
+        return datagrams
+
+    def send(self, datagrams):
+        """Send (data, address) datagrams, return the number sent.
+
+        Datagrams from unnamed senders, e.g. Unix sockets that didn't
+        bind, can't be answered and are skipped.
+        """
+        if self.closed:
+            return 0
+        sent = 0
+        sendto = self.socket.sendto
+        for data, address in datagrams:
+            if not address:
+                continue
+            try:
+                sendto(data, address)
+            except socket.error as e:
+                if e.args[0] in _FULL:
+                    break
+                # e.g. EMSGSIZE, only this one is lost
+                continue
+            sent += 1
+        return sent
+
+
+class MMsgDatagramSocket(DatagramSocket):
+    """DatagramSocket that moves batches with recvmmsg and sendmmsg.
+
+    Message headers are read and written in bulk with struct instead of
+    field by field through ctypes, which would cost more than the
+    system calls saved.
+    """
+
+    def __init__(self, sock, batch=BATCH, size=MAX_DATAGRAM):
+        DatagramSocket.__init__(self, sock, batch, size)
+        self.fd = sock.fileno()
+        # headers point into the buffers, so all of them are kept here
+        self.recv_headers = (mmsghdr * batch)()
+        self.recv_iovecs = (iovec * batch)()
+        self.recv_data = ctypes.create_string_buffer(batch * size)
+        self.recv_names = ctypes.create_string_buffer(batch * ADDRESS_SIZE)
+        data = ctypes.addressof(self.recv_data)
+        names = ctypes.addressof(self.recv_names)
+        iovecs = ctypes.addressof(self.recv_iovecs)
+        header_values = []
+        iovec_values = []
+        for i in xrange(batch):
+            header_values.extend((
+                names + i * ADDRESS_SIZE, ADDRESS_SIZE,
+                iovecs + i * _IOVEC_SIZE, 1, 0, 0, 0, 0))
+            iovec_values.extend((data + i * size, size))
+        # written over the headers the kernel has changed before a recv
+        self.recv_template = _get_struct(_HEADER, batch).pack(*header_values)
+        _write(self.recv_headers, self.recv_template)
+        _write(self.recv_iovecs,
+               _get_struct(_IOVEC, batch).pack(*iovec_values))
+        self.used = 0 # headers the last recv has changed
+        self.send_headers = (mmsghdr * batch)()
+        self.send_iovecs = (iovec * batch)()
+        self.send_data = ctypes.create_string_buffer(batch * size)
+        self.send_names = ctypes.create_string_buffer(batch * ADDRESS_SIZE)
+
+    def recv(self):
+        headers = ctypes.addressof(self.recv_headers)
+        if self.used:
+            ctypes.memmove(
+                headers, self.recv_template, self.used * _HEADER_SIZE)
+        count = _recvmmsg(self.fd, headers, self.batch, 0, None)
+        if count < 0:
+            code = ctypes.get_errno()
+            self.used = 0
+            if code == errno.EINTR or code in _FULL:
+                return []
+            raise socket.error(code, os.strerror(code))
+        self.used = count
+        # (address length, data length) of every message
+        lengths = _get_struct(_LENGTHS, count).unpack_from(
+            buffer(self.recv_headers))
+        data = buffer(self.recv_data)
+        names = buffer(self.recv_names)
+        size = self.size
+        return [
+            (data[i * size:i * size + lengths[2 * i + 1]],
+             names[i * ADDRESS_SIZE:i * ADDRESS_SIZE + lengths[2 * i]])
+            for i in xrange(count)
+            ]
+
+    def send(self, datagrams):
+        if self.closed:
+            return 0
+        datagrams = [
+            (data, address) for data, address in datagrams if address]
+        sent = 0
+        headers = ctypes.addressof(self.send_headers)
+        for start in xrange(0, len(datagrams), self.batch):
+            count = self._fill(datagrams[start:start + self.batch])
+            done = 0
+            while done < count:
+                result = _sendmmsg(
+                    self.fd, headers + done * _HEADER_SIZE, count - done, 0)
+                if result < 0:
+                    code = ctypes.get_errno()
+                    if code == errno.EINTR:
+                        continue
+                    if code in _FULL:
+                        return sent
+                    # e.g. EMSGSIZE of the first one, only it is lost
+                    done += 1
+                    continue
+                done += result
+                sent += result
+        return sent
+
+    def _fill(self, datagrams):
+        """Copy datagrams into the send buffers, return their number."""
+        data_base = ctypes.addressof(self.send_data)
+        names_base = ctypes.addressof(self.send_names)
+        iovecs = ctypes.addressof(self.send_iovecs)
+        size = self.size
+        chunks = []
+        names = []
+        header_values = []
+        iovec_values = []
+        data_offset = name_offset = 0
+        for i, (data, address) in enumerate(datagrams):
+            if len(data) > size:
+                data = data[:size]
+            length = len(data)
+            address_length = len(address)
+            chunks.append(data)
+            names.append(address)
+            header_values.extend((
+                names_base + name_offset, address_length,
+                iovecs + i * _IOVEC_SIZE, 1, 0, 0, 0, 0))
+            iovec_values.extend((data_base + data_offset, length))
+            data_offset += length
+            name_offset += address_length
+        count = len(datagrams)
+        ctypes.memmove(data_base, ''.join(chunks), data_offset)
+        ctypes.memmove(names_base, ''.join(names), name_offset)
+        _write(self.send_iovecs, _get_struct(_IOVEC, count).pack(
+            *iovec_values))
+        _write(self.send_headers, _get_struct(_HEADER, count).pack(
+            *header_values))
+        return count
+
+
+def get_datagram_socket(sock, batch=BATCH):
+    """Return the fastest batching wrapper of the socket there is."""
+    sock.setblocking(0)
+    if _recvmmsg is not None and _sendmmsg is not None:
+        return MMsgDatagramSocket(sock, batch)
+    return DatagramSocket(sock, batch)
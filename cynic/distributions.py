@@ -0,0 +1,215 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+"""Precomputed tables of delays drawn from latency distributions.
+
+A table is filled once, before any fork, with samples of the
+distribution, so drawing a delay for a request is a random index into
+a list no matter how expensive the distribution is to sample.
+
+Distributions are specified as tuples of a name and its parameters,
+all times in seconds:
+
+('constant', value)
+('uniform', low, high)
+('normal', mean, stddev) - negative samples are clipped to 0
+('lognormal', median, sigma) - sigma of the underlying normal
+('pareto', scale, alpha) - scale is the minimum delay
+('empirical', path) - measured latencies, one per line
+
+A plain number is a constant delay.
+
+AliasTable picks one of several choices by weight in O(1).
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import os
+import math
+import random
+
+TABLE_SIZE = 4096
+
+# identifies this process among the server's forks, see set_stream
+_stream = ()
+
+
+def set_stream(*key):
+    """Name the stream of samples seeded tables draw in this process.
+
+    The server calls it right after forking with the worker and child
+    numbers, which unlike pids are the same from run to run, so a seed
+    reproduces a run under the fork engine too.
+    """
+    global _stream
+    _stream = key
+
+
+def _load_latencies(path):
+    values = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                values.append(float(line))
+    if not values:
+        raise ValueError('No latencies in %r' % path)
+    return sorted(values)
+
+
+def _quantiles(values, size):
+    """Return size evenly spaced quantiles of sorted values."""
+    if len(values) == 1:
+        return values * size
+    last = len(values) - 1
+    table = []
+    for i in xrange(size):
+        position = (i + 0.5) / size * last
+        low = int(position)
+        high = min(low + 1, last)
+        fraction = position - low
+        table.append(values[low] + (values[high] - values[low]) * fraction)
+    return table
+
+
+def _draw(rnd, name, params):
+    if name == 'constant':
+        value, = params
+        return lambda: value
+    if name == 'uniform':
+        low, high = params
+        return lambda: rnd.uniform(low, high)
+    if name == 'normal':
+        mean, stddev = params
+        return lambda: max(0.0, rnd.gauss(mean, stddev))
+    if name == 'lognormal':
+        median, sigma = params
+        mu = math.log(median)
+        return lambda: rnd.lognormvariate(mu, sigma)
+    if name == 'pareto':
+        scale, alpha = params
+        return lambda: scale * rnd.paretovariate(alpha)
+    raise ValueError('Unknown distribution %r' % name)
+
+
+class SampleTable(object):
+    """Draws delays from a precomputed table of samples."""
+
+    def __init__(self, samples, seed=None):
+        self.samples = samples
+        self.size = len(samples)
+        self.seed = seed
+        self.random = random.Random()
+        self.pid = None
+
+    def sample(self):
+        if self.pid != os.getpid():
+            # forked children must not repeat the parent's sequence
+            self.pid = os.getpid()
+            if self.seed is None:
+                self.random.seed()
+            else:
+                self.random.seed((self.seed,) + _stream)
+        return self.samples[int(self.random.random() * self.size)]
+
+    def __repr__(self):
+        samples = sorted(self.samples)
+        return '<SampleTable median=%.4f p99=%.4f max=%.4f>' % (
+            samples[self.size // 2], samples[int(self.size * 0.99)],
+            samples[-1])
+
+
+def make_table(spec, size=TABLE_SIZE, seed=None, cap=None):
+    """Return a SampleTable for the distribution spec.
+
+    cap - maximum delay, heavy tails can produce huge samples
+    """
+    if isinstance(spec, (int, float)):
+        spec = ('constant', spec)
+    name, params = spec[0], spec[1:]
+    if name == 'empirical':
+        path, = params
+        samples = _quantiles(_load_latencies(path), size)
+    else:
+        draw = _draw(random.Random(seed), name, params)
+        samples = [draw() for _ in xrange(size)]
+    if cap is not None:
+        samples = [min(cap, sample) for sample in samples]
+    return SampleTable(samples, seed)
+
+
+_tables = {}
+
+
+def get_table(spec, seed=None, cap=None):
+    """Return the table of the spec building it on the first call.
+
+    Call it before forking, so children share the tables.
+    """
+    if isinstance(spec, list):
+        spec = tuple(spec)
+    key = (spec, seed, cap)
+    table = _tables.get(key)
+    if table is None:
+        table = _tables[key] = make_table(spec, seed=seed, cap=cap)
+    return table
+
+
+class AliasTable(object):
+    """Weighted choice in constant time with Vose's alias method.
+
+    Every column of the table holds a choice and its alias, a draw picks
+    a column and one of the two by the column's probability.
+    """
+
+    def __init__(self, weights, seed=None):
+        size = len(weights)
+        total = float(sum(weights))
+        if size == 0 or total <= 0:
+            raise ValueError('Weights must add up to a positive number')
+        scaled = [weight * size / total for weight in weights]
+        self.size = size
+        self.probability = [1.0] * size
+        self.alias = range(size)
+        small = [i for i, value in enumerate(scaled) if value < 1]
+        large = [i for i, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+        self.random = random.Random(seed).random
+
+    def choose(self):
+        """Return the index of a weight."""
+        value = self.random() * self.size
+        column = int(value)
+        if value - column < self.probability[column]:
+            return column
+        return self.alias[column]
@@ -0,0 +1,243 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+"""Cynic embedded in another process, e.g. a test suite.
+
+Handlers are described with dicts holding the options of the INI
+sections and may use port 0 to get a free port from the kernel:
+
+    server = EmbeddedServer({
+        'json': {'class': 'cynic.handlers.httpjson.HTTPJsonResponse'},
+        'reset': {'class': 'cynic.handlers.reset.RSTResponse'},
+        })
+    ports = server.start() # {'json': 41023, 'reset': 41024}
+    ...
+    server.stop()
+
+The server runs in a thread of the calling process (the async engine
+only) or in a forked process. Handler classes given by dotted names are
+imported only when the server starts, in the forked process for the
+latter.
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import os
+import json
+import errno
+import signal
+import threading
+
+from cynic.server import ENGINES, HandlerConfig, logger
+from cynic.throttle import parse_rate
+from cynic.utils import resolve
+
+DEFAULT_HOST = '127.0.0.1'
+OPTIONS = frozenset([
+    'class', 'host', 'port', 'family', 'args', 'kwargs', 'backlog', 'rate',
+    'port_rate', 'max_connections', 'overflow', 'queue_timeout', 'type',
+    ])
+MODES = ('thread', 'process')
+STOP_TIMEOUT = 5 # secs
+
+
+def _get_rate(value):
+    if isinstance(value, basestring):
+        return parse_rate(value)
+    return value
+
+
+def get_handler_configs(handlers):
+    """Return HandlerConfigs of {name: options} where options is a dict.
+
+    The options are those of the INI sections, Python values instead
+    of strings. host defaults to 127.0.0.1 and port to 0 (any free port),
+    class may be a handler class or its fully qualified dotted name.
+    """
+    configs = []
+    for name in sorted(handlers):
+        options = handlers[name]
+        unknown = set(options) - OPTIONS
+        if unknown:
+            raise ValueError('Unknown options of handler %r: %s' % (
+                name, ', '.join(sorted(unknown))))
+        klass = options['class']
+        if isinstance(klass, basestring):
+            klass = resolve(klass)
+        configs.append(HandlerConfig(
+            klass,
+            tuple(options.get('args', ())),
+            options.get('host', DEFAULT_HOST),
+            options.get('port', 0),
+            options.get('family', 'inet'),
+            backlog=options.get('backlog'),
+            kwargs=options.get('kwargs'),
+            rate=_get_rate(options.get('rate')),
+            port_rate=_get_rate(options.get('port_rate')),
+            name=name,
+            max_connections=options.get('max_connections'),
+            overflow=options.get('overflow'),
+            queue_timeout=options.get('queue_timeout'),
+            type=options.get('type', 'stream')))
+    return configs
+
+
+def _check_async(configs):
+    """Make sure no handler would be served in a forked child."""
+    for config in configs:
+        if config.type == 'dgram': # served by the IO loop itself
+            continue
+        for klass, args, kwargs in config.get_targets():
+            if (getattr(klass, 'ISOLATED', False) or
+                not hasattr(klass, 'handle_async')):
+                raise ValueError(
+                    '%s is served in forked children, run the server in '
+                    'the process mode' % klass.__name__)
+
+
+class EmbeddedServer(object):
+    """Cynic server run by another program.
+
+    handlers - {name: options} dict, see get_handler_configs
+    engine - 'async' or 'fork', the latter needs the process mode
+    mode - 'thread' runs the IO loop in a daemon thread, 'process' in
+           a forked process
+    loop_options - passed on to the engine, e.g. backlog or poller
+    """
+
+    def __init__(self, handlers, engine='async', mode='thread',
+                 **loop_options):
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine %r' % (engine,))
+        if mode not in MODES:
+            raise ValueError('Unknown mode %r' % (mode,))
+        if mode == 'thread' and engine != 'async':
+            raise ValueError('The thread mode needs the async engine')
+        self.handlers = handlers
+        self.engine = ENGINES[engine]
+        self.mode = mode
+        self.loop_options = loop_options
+        self.ports = None # {name: port} once started
+        self.ioloop = None
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        """Start serving and return {handler name: bound port}."""
+        if self.ports is not None:
+            raise RuntimeError('The server is already running')
+        if self.mode == 'thread':
+            self._start_thread()
+        else:
+            self._start_process()
+        return self.ports
+
+    def _start_thread(self):
+        configs = get_handler_configs(self.handlers)
+        _check_async(configs)
+        # binds the ports right here, so they are known on return
+        self.ioloop = self.engine(
+            configs, handle_signals=False, **self.loop_options)
+        self.ports = self.ioloop.get_ports()
+        self.thread = threading.Thread(
+            target=self.ioloop.run, name='cynic')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _start_process(self):
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0: # server
+            os.close(rfd)
+            try:
+                self._serve(wfd)
+            except:
+                logger.exception('Embedded server failed')
+                os._exit(1)
+            os._exit(0)
+
+        os.close(wfd)
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(rfd, 4096)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if not chunk:
+                break
+            chunks.append(chunk)
+        os.close(rfd)
+        result = json.loads(''.join(chunks) or '{"error": "server died"}')
+        if 'error' in result:
+            os.waitpid(pid, 0)
+            raise RuntimeError(
+                'Failed to start the server: %s' % result['error'])
+        self.pid = pid
+        self.ports = dict(
+            (str(name), port) for name, port in result['ports'].iteritems())
+
+    def _serve(self, wfd):
+        """Run the IO loop in the forked process, report ports to wfd."""
+        try:
+            # stop() terminates the process, the embedding program may
+            # have handlers of its own
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            configs = get_handler_configs(self.handlers)
+            ioloop = self.engine(configs, **self.loop_options)
+            result = {'ports': ioloop.get_ports()}
+        except Exception as e:
+            result = {'error': '%s: %s' % (type(e).__name__, e)}
+            ioloop = None
+        os.write(wfd, json.dumps(result))
+        os.close(wfd)
+        if ioloop is not None:
+            ioloop.run()
+
+    def stop(self):
+        """Stop serving, connections being served are closed."""
+        if self.ports is None:
+            return
+        if self.mode == 'thread':
+            self.ioloop.stop()
+            self.thread.join(STOP_TIMEOUT)
+            self.ioloop = self.thread = None
+        else:
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+                os.waitpid(self.pid, 0)
+            except OSError:
+                pass
+            self.pid = None
+        self.ports = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
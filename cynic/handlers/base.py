@@ -24,16 +24,41 @@
 
 __author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
 
+import re
+import socket
+import struct
+import types
+import StringIO
 from BaseHTTPServer import BaseHTTPRequestHandler
 
+from cynic import tasks
+from cynic.cache import payloads
 from cynic.utils import get_stream_logger # do not call at module level
 
+_CONTENT_LENGTH = re.compile(r'^content-length:[ \t]*(\d+)', re.I | re.M)
+_CHUNKED = re.compile(r'^transfer-encoding:.*chunked', re.I | re.M)
+
+# secs an idle persistent connection waits for the next request
+IDLE_TIMEOUT = 5
+# secs the 'delay' fault holds the response
+FAULT_DELAY = 30
+FAULTS = ('close', 'reset', 'delay', 'error')
+
 
 class BaseHandler(object):
-    """Base handler class for stream sockets."""
+    """Base handler class for stream sockets.
+
+    Subclasses implement ``handle_async`` which is either a generator
+    yielding cynic.tasks requests or a plain method that never blocks.
+    Handlers that only override ``handle`` are always served in a forked
+    child process.
+    """
 
     LOGGER_NAME = __name__
 
+    # serve the handler in a forked child even with the non-forking engine
+    ISOLATED = False
+
     def __init__(self, connection, client_address):
         """
         Args:
@@ -45,11 +70,40 @@ class BaseHandler(object):
         self.logger = get_stream_logger(self.LOGGER_NAME)
 
     def handle(self):
-        pass
+        handle_async = getattr(self, 'handle_async', None)
+        if handle_async is not None:
+            tasks.run(handle_async())
+
+
+class BaseDatagramHandler(object):
+    """Base handler class for datagram sockets.
+
+    A single instance serves all datagrams of a handler section in the
+    server process itself, with any engine. Subclasses implement
+    ``handle_datagrams`` that gets a batch of received (data, address)
+    and returns (delay, data, address) of the datagrams to send, delay
+    in secs, 0 sends right away. Addresses are opaque. The base class
+    swallows all datagrams.
+    """
+
+    LOGGER_NAME = __name__
+
+    def handle_datagrams(self, datagrams):
+        return []
 
 
 class BaseHTTPHandler(BaseHTTPRequestHandler):
-    """Base handler class for HTTP protocol."""
+    """Base handler class for HTTP protocol.
+
+    The request is read and the response is written through
+    cooperative tasks, so HTTP handlers run under both engines.
+    ``do_*`` methods may be generators to wait without blocking.
+
+    With max_requests other than 1 the connection is persistent
+    (HTTP/1.1) and pipelined requests are answered in order.
+    Handlers whose response has no Content-Length set
+    ``close_connection`` to end the connection after it.
+    """
 
     protocol_version = 'HTTP/1.0'
 
@@ -57,8 +111,16 @@ class BaseHTTPHandler(BaseHTTPRequestHandler):
     TEMPLATE = ''
     LOGGER_NAME = __name__
 
+    # serve the handler in a forked child even with the non-forking engine
+    ISOLATED = False
+
+    # limit for the request line and headers
+    MAX_REQUEST_SIZE = 65536
+
     def __init__(self, connection, client_address,
-                 datapath=None, content_type=None):
+                 datapath=None, content_type=None, sendfile=False,
+                 max_requests=1, idle_timeout=IDLE_TIMEOUT,
+                 fault_on=(), fault='reset', fault_delay=FAULT_DELAY):
         """
         Args:
             connection - connected socket returned by server's accept
@@ -66,19 +128,224 @@ class BaseHTTPHandler(BaseHTTPRequestHandler):
             datapath - file path to a data file that will be sent as
                        as a response body to the client
             content_type - HTTP response Content-Type header value
+            sendfile - send the data file with zero-copy sendfile(2)
+            max_requests - requests served on a connection, None for
+                           no limit. 1 is plain HTTP/1.0
+            idle_timeout - secs to wait for the next request on a
+                           persistent connection, None waits forever
+            fault_on - number or list of numbers of the requests on a
+                       connection (counting from 1) the fault applies to
+            fault - 'close' closes the connection without a response,
+                    'reset' resets it, 'delay' holds the response for
+                    fault_delay secs and 'error' answers 500
         """
         self.connection = self.request = connection
         self.client_address = client_address
         self.server = self
-        self.setup()
+        self.rfile = None
+        self.wfile = tasks.SocketWriter(connection)
+        self.raw_request = ''
+
+        if fault not in FAULTS:
+            raise ValueError('Unknown fault %r' % (fault,))
+        if isinstance(fault_on, (int, long)):
+            fault_on = (fault_on,)
+        self.max_requests = max_requests
+        self.idle_timeout = idle_timeout
+        self.fault_on = frozenset(fault_on)
+        self.fault = fault
+        self.fault_delay = fault_delay
+        self.keep_alive = max_requests != 1
+        if self.keep_alive:
+            self.protocol_version = 'HTTP/1.1'
+        self.request_number = 0
+        self.unread = '' # pipelined input not handled yet
 
-        self.data = open(datapath).read() if datapath is not None else ''
+        self.datapath = datapath
+        self.sendfile = sendfile
+        self.data = ''
+        if datapath is not None and not sendfile:
+            self.data = payloads.get(datapath)
         self.logger = get_stream_logger(self.LOGGER_NAME)
         if content_type is not None:
             self.CONTENT_TYPE = content_type
 
+    @classmethod
+    def prepare(cls, datapath=None, *args, **kwargs):
+        """Called once in the server process before serving connections.
+
+        Maps the data file, so children and workers share it.
+        """
+        if datapath is not None:
+            payloads.get(datapath)
+
+    def handle(self):
+        tasks.run(self.handle_async())
+
+    def handle_async(self):
+        """Handle the requests of the connection one after another."""
+        while True:
+            self.request_number += 1
+            timeout = None
+            if self.request_number > 1:
+                timeout = self.idle_timeout
+            try:
+                request = yield self.read_request(timeout)
+            except socket.error as e:
+                # the client may drop a persistent connection any time
+                if (self.request_number == 1 or
+                    e.args[0] not in tasks.PEER_GONE):
+                    raise
+                return
+            if not request:
+                return
+
+            yield self.handle_request(request)
+            if self.request_number == self.max_requests:
+                self.close_connection = 1
+            if self.close_connection:
+                return
+
+    def handle_request(self, request):
+        """Parse the raw request and call its ``do_*`` method."""
+        self.raw_request = request
+        self.rfile = StringIO.StringIO(request)
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+        elif self.parse_request():
+            if self.request_number in self.fault_on:
+                answer = yield self.inject_fault()
+                if not answer:
+                    return
+            mname = 'do_' + self.command
+            if not hasattr(self, mname):
+                self.send_error(501, 'Unsupported method (%r)' % self.command)
+            else:
+                result = getattr(self, mname)()
+                if isinstance(result, types.GeneratorType):
+                    yield result
+
+        yield self.wfile.drain()
+
+    def inject_fault(self):
+        """Apply the fault to the current request.
+
+        Returns True if the request is still to be answered.
+        """
+        self.logger.info(
+            'Injecting %r on request %d', self.fault, self.request_number)
+        if self.fault == 'delay':
+            yield tasks.Sleep(self.fault_delay)
+            raise tasks.Return(True)
+
+        self.close_connection = 1
+        if self.fault == 'error':
+            self.send_error(500, 'Injected fault')
+            yield self.wfile.drain()
+        elif self.fault == 'reset':
+            # cause RST to be sent on socket.close()
+            self.connection.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.connection.close()
+        raise tasks.Return(False)
+
+    def read_request(self, timeout=None):
+        """Read the request line, headers and the body if any.
+
+        Returns the raw request, which is empty if the client closed
+        the connection without sending anything or was idle for
+        timeout secs. Input past the request is kept for the next one.
+        """
+        data = self.unread
+        end = data.find('\r\n\r\n')
+        while end < 0:
+            # TLS may hold decrypted input the poller can't see
+            if timeout is not None and not tasks.pending(self.connection):
+                ready = yield tasks.Select([self.connection], (), timeout)
+                if not ready:
+                    self.log_message('Idle for %s secs, closing', timeout)
+                    raise tasks.Return('')
+            chunk = yield tasks.recv(self.connection, 8192)
+            if not chunk:
+                self.unread = ''
+                raise tasks.Return(data)
+            data += chunk
+            end = data.find('\r\n\r\n')
+            if end < 0 and len(data) > self.MAX_REQUEST_SIZE:
+                # let parse_request deal with the garbage
+                self.unread = ''
+                raise tasks.Return(data)
+
+        size = end + 4
+        if _CHUNKED.search(data, 0, end) is not None:
+            size, data = yield self.read_chunked(data, size)
+            self.unread = data[size:]
+            raise tasks.Return(data[:size])
+
+        match = _CONTENT_LENGTH.search(data, 0, end)
+        if match is not None:
+            size += int(match.group(1))
+            while len(data) < size:
+                chunk = yield tasks.recv(self.connection, size - len(data))
+                if not chunk:
+                    break
+                data += chunk
+
+        self.unread = data[size:]
+        raise tasks.Return(data[:size])
+
+    def read_chunked(self, data, start):
+        """Read a chunked request body that starts at the start offset.
+
+        Returns (end offset of the body, data). A body that can't be
+        parsed or is larger than MAX_REQUEST_SIZE ends at the end of
+        the data read and the connection is closed after the response.
+        """
+        pos = start
+        trailer = False # past the last chunk
+        while True:
+            eol = data.find('\r\n', pos)
+            if eol < 0:
+                if len(data) - start > self.MAX_REQUEST_SIZE:
+                    break
+                chunk = yield tasks.recv(self.connection, 8192)
+                if not chunk:
+                    raise tasks.Return((len(data), data))
+                data += chunk
+                continue
+
+            if data[pos - 2:pos] != '\r\n': # after the previous chunk
+                break
+            if trailer:
+                if eol == pos: # the empty line
+                    raise tasks.Return((eol + 2, data))
+                pos = eol + 2
+                continue
+
+            try:
+                length = int(data[pos:eol].split(';', 1)[0], 16)
+            except ValueError:
+                break
+            if length:
+                # the chunk and its CRLF
+                pos = eol + 2 + length + 2
+                if pos - start > self.MAX_REQUEST_SIZE:
+                    break
+            else:
+                trailer = True
+                pos = eol + 2
+
+        self.max_requests = self.request_number
+        raise tasks.Return((len(data), data))
+
     def do_GET(self):
         """HTTP GET request handler"""
+        if self.sendfile and self.datapath is not None:
+            return self.send_file(self.datapath)
         body = self.TEMPLATE
         if self.data:
             body = self.data
@@ -88,6 +355,28 @@ class BaseHTTPHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(body)
 
+    def send_file(self, path):
+        """Send the file as the response body with zero-copy sendfile.
+
+        Headers go out first, then the body is streamed from the page
+        cache without copying it through the process.
+        """
+        fileobj, size = payloads.get_file(path)
+        self.send_response(200)
+        self.send_header('Content-Length', size)
+        self.send_header('Content-Type', self.CONTENT_TYPE)
+        self.end_headers()
+        yield self.wfile.drain()
+        sent = yield tasks.sendfile(self.connection, fileobj, 0, size)
+        self.log_message('Sent %d of %d bytes of %s', sent, size, path)
+
+    def end_headers(self):
+        """Tell the client about the last response on the connection."""
+        if (self.keep_alive and not self.close_connection and
+            self.request_number == self.max_requests):
+            self.send_header('Connection', 'close')
+        BaseHTTPRequestHandler.end_headers(self)
+
     def log_message(self, format, *args):
         """Overridden method from the base class to use our logger."""
         self.logger.info(format % args)
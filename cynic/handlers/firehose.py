@@ -0,0 +1,197 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import os
+import random
+import socket
+import itertools
+
+from cynic import tasks
+from cynic.handlers.base import BaseHTTPHandler
+
+CHUNK_SIZE = 64 * 1024
+PATTERN = 'Cynic will try hard to cause injury to your system. '
+JSON_ITEM = '{"message": "Hello, World!"}'
+JSON_SEPARATOR = ', '
+
+CONTENT_TYPES = {
+    'pattern': 'text/plain',
+    'random': 'application/octet-stream',
+    'json': 'application/json',
+    }
+
+# preallocated chunks shared by all connections of the process,
+# key is (content, pattern, chunk_size)
+_buffers = {}
+
+
+def _get_buffer(content, pattern, chunk_size):
+    key = (content, pattern, chunk_size)
+    data = _buffers.get(key)
+    if data is None:
+        if content == 'random':
+            # twice the chunk size, so chunks can start at random offsets
+            data = os.urandom(chunk_size * 2)
+        else:
+            if content == 'json':
+                pattern = JSON_ITEM + JSON_SEPARATOR
+            # whole number of patterns, so chunks can follow each other
+            data = pattern * max(1, chunk_size // len(pattern))
+        _buffers[key] = data
+    return data
+
+
+def _repeat(data):
+    """Endless chunks of the buffer, never copied."""
+    chunk = buffer(data)
+    while True:
+        yield chunk
+
+
+def _random(data, chunk_size):
+    """Endless chunks starting at random offsets of the buffer."""
+    offsets = [random.randrange(chunk_size) for _ in range(64)]
+    for offset in itertools.cycle(offsets):
+        yield buffer(data, offset, chunk_size)
+
+
+def _limit(chunks, size):
+    """Stop the stream of chunks after size bytes."""
+    left = size
+    for chunk in chunks:
+        if left <= len(chunk):
+            if left:
+                yield buffer(chunk, 0, left)
+            return
+        left -= len(chunk)
+        yield chunk
+
+
+def _json(data, size):
+    """Valid JSON array of size bytes, or a never ending one if size is None.
+
+    Items are followed by whitespace padding to hit the exact size.
+    """
+    yield '['
+    if size is None:
+        for chunk in _repeat(data):
+            yield chunk
+        return
+
+    item, sep = JSON_ITEM, JSON_SEPARATOR
+    if size < len(item) + 2:
+        yield ' ' * max(0, size - 2) + ']'
+        return
+    count = (size - len(item) - 2) // (len(item) + len(sep))
+    for chunk in _limit(_repeat(data), count * (len(item) + len(sep))):
+        yield chunk
+    padding = size - 2 - len(item) - count * (len(item) + len(sep))
+    yield item + ' ' * padding + ']'
+
+
+class HTTPFirehoseResponse(BaseHTTPHandler):
+    """HTTP handler that streams a huge or never ending response body.
+
+    The body is generated on the fly from a preallocated buffer, so the
+    memory stays the same whatever the size of the response.
+    """
+
+    LOGGER_NAME = __name__
+
+    def __init__(self,
+                 connection,
+                 client_address,
+                 content='pattern',
+                 size=None,
+                 content_length=None,
+                 content_type=None,
+                 pattern=PATTERN,
+                 chunk_size=CHUNK_SIZE,
+                 **kwargs):
+        """
+        Args:
+            content - 'pattern' repeats the pattern, 'random' sends random
+                      bytes and 'json' sends a valid JSON array
+            size - number of body bytes to send, None sends forever
+            content_length - Content-Length header value, by default
+                             it's the size. Set it to a different value
+                             to declare a length that doesn't match
+            content_type - HTTP response Content-Type header value
+            pattern - the data repeated in the 'pattern' mode
+            chunk_size - size of the preallocated buffer
+        """
+        BaseHTTPHandler.__init__(
+            self, connection, client_address,
+            content_type=content_type or CONTENT_TYPES[content], **kwargs)
+        self.content = content
+        self.size = size
+        self.content_length = content_length
+        if content_length is None:
+            self.content_length = size
+        self.buffer = _get_buffer(content, pattern, chunk_size)
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def prepare(cls, content='pattern', size=None, content_length=None,
+                content_type=None, pattern=PATTERN, chunk_size=CHUNK_SIZE,
+                **kwargs):
+        # allocate the buffer before forking
+        _get_buffer(content, pattern, chunk_size)
+
+    def get_chunks(self):
+        """Return the pipeline of chunks that make up the body."""
+        if self.content == 'json':
+            return _json(self.buffer, self.size)
+        if self.content == 'random':
+            chunks = _random(self.buffer, self.chunk_size)
+        else:
+            chunks = _repeat(self.buffer)
+        if self.size is not None:
+            chunks = _limit(chunks, self.size)
+        return chunks
+
+    def do_GET(self):
+        self.send_response(200)
+        if self.content_length is not None:
+            self.send_header('Content-Length', self.content_length)
+        if self.keep_alive and (self.content_length is None or
+                                self.content_length != self.size):
+            # the body is delimited by the end of the connection
+            self.send_header('Connection', 'close')
+        self.send_header('Content-Type', self.CONTENT_TYPE)
+        self.end_headers()
+        yield self.wfile.drain()
+
+        sent = 0
+        try:
+            for chunk in self.get_chunks():
+                yield tasks.sendall(self.connection, chunk)
+                sent += len(chunk)
+        except socket.error as e:
+            if e.args[0] not in tasks.PEER_GONE:
+                raise
+        self.log_message('Sent %d bytes', sent)
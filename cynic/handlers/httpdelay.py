@@ -0,0 +1,55 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+from cynic.tasks import Sleep
+from cynic.handlers.base import BaseHTTPHandler
+
+
+class HTTPDelayedResponse(BaseHTTPHandler):
+    """HTTP handler that waits before sending the whole response."""
+
+    CONTENT_TYPE = 'application/json'
+
+    TEMPLATE = '{"message": "Hello, World!"}'
+
+    LOGGER_NAME = __name__
+
+    def __init__(self,
+                 connection,
+                 client_address,
+                 datapath=None,
+                 content_type='application/json',
+                 delay=30, # secs
+                 **kwargs):
+        BaseHTTPHandler.__init__(
+            self, connection, client_address, datapath, **kwargs)
+        self.CONTENT_TYPE = content_type
+        self.delay = delay
+
+    def do_GET(self):
+        yield Sleep(self.delay)
+        yield BaseHTTPHandler.do_GET(self)
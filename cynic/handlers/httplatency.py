@@ -0,0 +1,99 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+from cynic.tasks import Sleep
+from cynic.distributions import get_table
+from cynic.handlers.base import BaseHTTPHandler
+
+
+class HTTPLatencyResponse(BaseHTTPHandler):
+    """HTTP handler with delays drawn from latency distributions.
+
+    ttfb - distribution of the delay before the response is sent
+    chunk - distribution of the delay between chunks of the body
+
+    See cynic.distributions for the format of the distributions.
+    """
+
+    CONTENT_TYPE = 'application/json'
+
+    TEMPLATE = '{"message": "Hello, World!"}'
+
+    LOGGER_NAME = __name__
+
+    def __init__(self,
+                 connection,
+                 client_address,
+                 datapath=None,
+                 content_type='application/json',
+                 ttfb=None,
+                 chunk=None,
+                 chunk_size=1024, # bytes
+                 max_delay=None, # secs
+                 seed=None,
+                 **kwargs):
+        BaseHTTPHandler.__init__(
+            self, connection, client_address, datapath, **kwargs)
+        self.CONTENT_TYPE = content_type
+        self.ttfb = self.chunk = None
+        # tables are built by prepare, this is just a lookup
+        if ttfb is not None:
+            self.ttfb = get_table(ttfb, seed, max_delay)
+        if chunk is not None:
+            self.chunk = get_table(chunk, seed, max_delay)
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def prepare(cls, datapath=None, content_type=None, ttfb=None,
+                chunk=None, chunk_size=None, max_delay=None, seed=None,
+                **kwargs):
+        BaseHTTPHandler.prepare(datapath)
+        for spec in (ttfb, chunk):
+            if spec is not None:
+                get_table(spec, seed, max_delay)
+
+    def do_GET(self):
+        if self.ttfb is not None:
+            delay = self.ttfb.sample()
+            self.logger.info('Delaying the response for %.3f secs', delay)
+            yield Sleep(delay)
+
+        body = self.TEMPLATE
+        if self.data:
+            body = self.data
+        self.send_response(200)
+        self.send_header('Content-Length', len(body))
+        self.send_header('Content-Type', self.CONTENT_TYPE)
+        self.end_headers()
+        if self.chunk is None:
+            self.wfile.write(body)
+            return
+
+        for offset in xrange(0, len(body), self.chunk_size):
+            if offset:
+                yield Sleep(self.chunk.sample())
+            self.wfile.write(body[offset:offset + self.chunk_size])
+            yield self.wfile.drain()
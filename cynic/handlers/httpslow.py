@@ -24,8 +24,7 @@
 
 __author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
 
-import time
-
+from cynic.tasks import Sleep
 from cynic.handlers.base import BaseHTTPHandler
 
 
@@ -44,8 +43,9 @@ class HTTPSlowResponse(BaseHTTPHandler):
                  datapath=None,
                  content_type='application/json',
                  sleep_interval=30, # secs
-                 ):
-        BaseHTTPHandler.__init__(self, connection, client_address, datapath)
+                 **kwargs):
+        BaseHTTPHandler.__init__(
+            self, connection, client_address, datapath, **kwargs)
         self.CONTENT_TYPE = content_type
         self.sleep_interval = sleep_interval
 
@@ -60,5 +60,5 @@ class HTTPSlowResponse(BaseHTTPHandler):
         # send a byte of data every sleep_interval seconds
         for ch in body:
             self.wfile.write(ch)
-            self.wfile.flush()
-            time.sleep(self.sleep_interval)
+            yield self.wfile.drain()
+            yield Sleep(self.sleep_interval)
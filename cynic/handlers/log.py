@@ -24,13 +24,38 @@
 
 __author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
 
-import pickle
 import struct
 import logging
+import cPickle as pickle
 
+from cynic.tasks import recv
 from cynic.handlers.base import BaseHandler
 from cynic.utils import get_console_logger
 
+BUFFER_SIZE = 64 * 1024
+
+# console loggers by record name, shared by all connections of the process
+_loggers = {}
+
+
+def decode_records(data):
+    """Decode all complete length-prefixed pickled records in data.
+
+    Returns a list of record attribute dicts and the number of bytes
+    consumed, an incomplete trailing record is left for the next batch.
+    """
+    records = []
+    offset = 0
+    size = len(data)
+    while size - offset >= 4:
+        slen = struct.unpack_from('>L', data, offset)[0]
+        end = offset + 4 + slen
+        if end > size:
+            break
+        records.append(pickle.loads(data[offset + 4:end]))
+        offset = end
+    return records, offset
+
 
 # Based on LogRecordStreamHandler example from standard logging documentation
 class LogRecordHandler(BaseHandler):
@@ -40,28 +65,31 @@ class LogRecordHandler(BaseHandler):
     is configured locally.
     """
 
-    def handle(self):
+    def handle_async(self):
         """Handle multiple requests.
 
         Each request is expected to be a 4-byte length, followed by
-        the LogRecord in pickle format.
+        the LogRecord in pickle format. Records are read in big chunks
+        and decoded in batches.
         """
+        pending = ''
         while True:
-            chunk = self.connection.recv(4)
-            if len(chunk) < 4:
+            data = yield recv(self.connection, BUFFER_SIZE)
+            if not data:
                 break
-            slen = struct.unpack('>L', chunk)[0]
-            chunk = self.connection.recv(slen)
-            while len(chunk) < slen:
-                chunk = chunk + self.connection.recv(slen - len(chunk))
+            if pending:
+                data = pending + data
 
-            # unpickle
-            obj = pickle.loads(chunk)
+            records, consumed = decode_records(data)
+            pending = data[consumed:]
 
-            # log the record
-            record = logging.makeLogRecord(obj)
-            self.log_record(record)
+            for obj in records:
+                # log the record
+                record = logging.makeLogRecord(obj)
+                self.log_record(record)
 
     def log_record(self, record):
-        logger = get_console_logger(record.name)
+        logger = _loggers.get(record.name)
+        if logger is None:
+            logger = _loggers[record.name] = get_console_logger(record.name)
         logger.handle(record)
@@ -0,0 +1,55 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+from cynic.distributions import AliasTable
+
+
+class MixedResponse(object):
+    """Serves every connection with one of several handlers picked by weight.
+
+    It's not a handler itself: the server asks get_choices for the
+    handlers and picks one for every connection before forking or
+    spawning a task.
+
+    handlers - list of (weight, class[, args[, kwargs]]) tuples, class is
+               a handler class or its fully qualified dotted name
+    seed - seed of the choices for reproducible runs
+    """
+
+    LOGGER_NAME = __name__
+
+    @classmethod
+    def get_choices(cls, handlers, seed=None):
+        """Return a list of (class, args, kwargs) and an AliasTable."""
+        choices = []
+        weights = []
+        for entry in handlers:
+            weight, klass = entry[:2]
+            args = entry[2] if len(entry) > 2 else ()
+            kwargs = entry[3] if len(entry) > 3 else {}
+            weights.append(weight)
+            choices.append((klass, args, kwargs))
+        return choices, AliasTable(weights, seed)
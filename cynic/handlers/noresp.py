@@ -24,8 +24,7 @@
 
 __author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
 
-import time
-
+from cynic.tasks import Sleep
 from cynic.handlers.base import BaseHandler
 
 SLEEP_TIME = 24 * 60 * 60 # sleep for 24 hours
@@ -39,8 +38,8 @@ class NoResponse(BaseHandler):
 
     LOGGER_NAME = __name__
 
-    def handle(self):
+    def handle_async(self):
         self.logger.info(
             'Sleeping for the next 24 hours. No response will be sent.')
-        time.sleep(SLEEP_TIME)
+        yield Sleep(SLEEP_TIME)
 
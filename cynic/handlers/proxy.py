@@ -0,0 +1,339 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import os
+import time
+import errno
+import socket
+import struct
+import collections
+
+from cynic import utils
+from cynic.tasks import Select, Sleep, WOULD_BLOCK, connect
+from cynic.throttle import Throttled, throttle
+from cynic.distributions import get_table
+from cynic.handlers.base import BaseHandler
+
+CHUNK_SIZE = 65536 # bytes relayed at once
+MAX_IDLE = 30 # secs a pooled upstream connection is kept
+
+# relay buffers of finished connections, reused by the next ones
+_buffers = []
+# (host, port) -> UpstreamPool of this process
+_pools = {}
+
+
+def _is_alive(sock):
+    """Return False if a pooled connection was closed or refused."""
+    try:
+        return bool(sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT))
+    except socket.error as e:
+        return e.args[0] in WOULD_BLOCK
+
+
+class UpstreamPool(object):
+    """Upstream connections opened ahead of time.
+
+    Taking a connection starts opening its replacement without waiting
+    for it, so clients don't wait for the upstream's handshake.
+    """
+
+    def __init__(self, address, size, max_idle=MAX_IDLE):
+        self.address = address
+        self.size = size
+        self.max_idle = max_idle
+        self.pid = os.getpid()
+        self.idle = collections.deque() # (socket, opened)
+        self.fill()
+
+    def fill(self):
+        for _ in xrange(self.size - len(self.idle)):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(0)
+            code = sock.connect_ex(self.address)
+            if code not in (0, errno.EINPROGRESS):
+                sock.close()
+                break
+            self.idle.append((sock, time.time()))
+
+    def get(self):
+        """Return a connected (or still connecting) socket or None."""
+        now = time.time()
+        sock = None
+        while self.idle:
+            candidate, opened = self.idle.popleft()
+            if now - opened < self.max_idle and _is_alive(candidate):
+                sock = candidate
+                break
+            candidate.close()
+        self.fill()
+        return sock
+
+    def close(self):
+        for sock, opened in self.idle:
+            sock.close()
+        self.idle.clear()
+
+
+def get_pool(address, size):
+    """Return the pool of this process, creating it on the first call.
+
+    Prefork workers and forked children inherit the pool of their
+    parent, workers get pools of their own.
+    """
+    pool = _pools.get(address)
+    if pool is None or pool.pid != os.getpid():
+        pool = _pools[address] = UpstreamPool(address, size)
+    return pool
+
+
+class _Flow(object):
+    """One direction of the relay.
+
+    limit - number of bytes to relay at most
+    """
+
+    def __init__(self, src, dst, limit=None):
+        self.src = src
+        self.dst = dst
+        self.limit = limit
+        self.pending = 0 # bytes read, but not written yet
+        self.relayed = 0
+        self.eof = False
+        self.shut = False # dst has been shut down for writing
+
+    def read(self):
+        size = CHUNK_SIZE
+        if self.limit is not None:
+            size = min(size, self.limit - self.relayed - self.pending)
+            if size <= 0:
+                self.eof = True
+                return
+        try:
+            read = self._read(size)
+        except (socket.error, OSError) as e:
+            if e.args[0] in WOULD_BLOCK:
+                return
+            raise
+        if read:
+            self.pending += read
+        else:
+            self.eof = True
+
+    def write(self):
+        try:
+            written = self._write()
+        except (socket.error, OSError) as e:
+            if e.args[0] in WOULD_BLOCK:
+                return
+            raise
+        self.pending -= written
+        self.relayed += written
+
+
+class _SpliceFlow(_Flow):
+    """Moves data through a pipe without copying it to user space."""
+
+    def __init__(self, src, dst, limit=None):
+        _Flow.__init__(self, src, dst, limit)
+        self.pipe = os.pipe()
+
+    def _read(self, size):
+        return utils.splice(self.src.fileno(), self.pipe[1], size)
+
+    def _write(self):
+        return utils.splice(self.pipe[0], self.dst.fileno(), self.pending)
+
+    def close(self):
+        os.close(self.pipe[0])
+        os.close(self.pipe[1])
+
+
+class _BufferFlow(_Flow):
+    """Copies data through a reusable buffer."""
+
+    def __init__(self, src, dst, limit=None):
+        _Flow.__init__(self, src, dst, limit)
+        self.buffer = _buffers.pop() if _buffers else bytearray(CHUNK_SIZE)
+        self.data = None
+
+    def _read(self, size):
+        read = self.src.recv_into(self.buffer, size)
+        self.data = buffer(self.buffer, 0, read)
+        return read
+
+    def _write(self):
+        written = self.dst.send(self.data)
+        self.data = buffer(self.data, written)
+        return written
+
+    def close(self):
+        _buffers.append(self.buffer)
+
+
+class TCPProxy(BaseHandler):
+    """Relays bytes between the client and an upstream server.
+
+    With no faults set data is moved with splice(2) where available.
+    Faults:
+
+    latency - distribution of the delay added to every relayed chunk
+    upstream_rate - bandwidth limit towards the upstream, bytes per sec
+    truncate - end the stream after relaying that many bytes to the client
+    reset_after - reset the client connection after that many secs
+
+    The bandwidth towards the client is limited with the section's rate
+    option. See cynic.distributions for the format of the distributions.
+    """
+
+    LOGGER_NAME = __name__
+
+    def __init__(self,
+                 connection,
+                 client_address,
+                 upstream, # (host, port)
+                 pool_size=0,
+                 latency=None,
+                 upstream_rate=None,
+                 truncate=None, # bytes
+                 reset_after=None, # secs
+                 seed=None,
+                 upstream_sock=None, # from the pool, see prespawn
+                 ):
+        BaseHandler.__init__(self, connection, client_address)
+        self.upstream = upstream
+        self.upstream_sock = upstream_sock
+        self.latency = None
+        if latency is not None:
+            self.latency = get_table(latency, seed)
+        self.upstream_rate = upstream_rate
+        self.truncate = truncate
+        self.reset_after = reset_after
+
+    @classmethod
+    def prepare(cls, upstream, pool_size=0, latency=None, seed=None,
+                **kwargs):
+        if latency is not None:
+            get_table(latency, seed)
+
+    @classmethod
+    def prespawn(cls, upstream, pool_size=0, **kwargs):
+        """Hand a pooled upstream connection over to the handler."""
+        if not pool_size:
+            return {}
+        return {'upstream_sock': get_pool(upstream, pool_size).get()}
+
+    @classmethod
+    def close_inherited(cls):
+        """Close the server's pooled connections in a forked child."""
+        for pool in _pools.values():
+            pool.close()
+
+    def handle_async(self):
+        client = self.connection
+        client.setblocking(0)
+        upstream = self.upstream_sock
+        if upstream is None:
+            upstream = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            upstream.setblocking(0)
+        try:
+            yield connect(upstream, self.upstream)
+        except socket.error as e:
+            self.logger.error(
+                'Cannot connect to upstream %s:%d: %s',
+                self.upstream[0], self.upstream[1], e)
+            upstream.close()
+            return
+
+        upstream = throttle(upstream, self.upstream_rate)
+        # faults that need to see the data
+        copy = (
+            self.latency is not None or hasattr(client, 'limiter') or
+            hasattr(upstream, 'limiter'))
+        flow_class = _SpliceFlow
+        if copy or utils.splice is None:
+            flow_class = _BufferFlow
+        flows = [
+            flow_class(client, upstream),
+            flow_class(upstream, client, self.truncate),
+            ]
+        try:
+            yield self.relay(flows)
+        except (socket.error, OSError) as e:
+            self.logger.info('Connection broken: %s', e)
+        finally:
+            for flow in flows:
+                flow.close()
+            upstream.close()
+        self.logger.info(
+            'Relayed %d bytes to the upstream and %d bytes to the client',
+            flows[0].relayed, flows[1].relayed)
+
+    def relay(self, flows):
+        deadline = None
+        if self.reset_after is not None:
+            deadline = time.time() + self.reset_after
+
+        while not all(flow.eof and not flow.pending for flow in flows):
+            readers = [
+                flow.src for flow in flows
+                if not flow.eof and not flow.pending
+                ]
+            writers = [flow.dst for flow in flows if flow.pending]
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.time())
+            ready = yield Select(readers, writers, timeout)
+            if deadline is not None and time.time() >= deadline:
+                self.reset()
+                return
+
+            for flow in flows:
+                if flow.src in ready:
+                    flow.read()
+                    if flow.pending and self.latency is not None:
+                        delay = self.latency.sample()
+                        if delay:
+                            yield Sleep(delay)
+                if flow.pending:
+                    try:
+                        flow.write()
+                    except Throttled as e:
+                        yield Sleep(e.delay)
+                if flow.eof and not flow.pending and not flow.shut:
+                    # pass the end of the stream on
+                    flow.shut = True
+                    try:
+                        flow.dst.shutdown(socket.SHUT_WR)
+                    except socket.error:
+                        pass
+
+    def reset(self):
+        self.logger.info('Sending RST packet')
+        # cause RST to be sent on socket.close()
+        self.connection.setsockopt(
+            socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.connection.close()
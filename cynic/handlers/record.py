@@ -0,0 +1,97 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import socket
+
+from cynic import tasks
+from cynic.archive import Archive, make_key
+from cynic.handlers.base import BaseHTTPHandler
+
+# headers replaced in requests forwarded upstream
+_HOP_HEADERS = ('host:', 'connection:', 'keep-alive:', 'proxy-connection:')
+
+
+class HTTPRecordResponse(BaseHTTPHandler):
+    """Forwards requests to an upstream server recording the exchanges.
+
+    Every request and the upstream's raw response are appended to an
+    archive (see cynic.archive) that HTTPReplayResponse serves later.
+    """
+
+    LOGGER_NAME = __name__
+
+    def __init__(self,
+                 connection,
+                 client_address,
+                 upstream, # (host, port)
+                 archive, # path
+                 **kwargs):
+        BaseHTTPHandler.__init__(self, connection, client_address, **kwargs)
+        self.upstream = upstream
+        self.archive = Archive(archive)
+
+    def make_upstream_request(self):
+        """Return the raw request with headers fixed for the upstream."""
+        head, sep, body = self.raw_request.partition('\r\n\r\n')
+        lines = [
+            line for line in head.split('\r\n')
+            if not line.lower().startswith(_HOP_HEADERS)
+            ]
+        host, port = self.upstream
+        if port != 80:
+            host = '%s:%d' % (host, port)
+        lines.append('Host: %s' % host)
+        # read the response till the end of the connection
+        lines.append('Connection: close')
+        return '\r\n'.join(lines) + '\r\n\r\n' + body
+
+    def record(self):
+        body = self.rfile.read()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # block or not just like the client's connection
+        sock.settimeout(self.connection.gettimeout())
+        try:
+            yield tasks.connect(sock, self.upstream)
+            yield tasks.sendall(sock, self.make_upstream_request())
+            response = yield tasks.recv_all(sock)
+        except socket.error as e:
+            self.send_error(502, 'Upstream failed: %s' % e)
+            return
+        finally:
+            sock.close()
+
+        self.archive.append(
+            make_key(self.command, self.path, body),
+            self.raw_request, response)
+        self.logger.info(
+            'Recorded %s %s (%d bytes)', self.command, self.path,
+            len(response))
+        # the raw response is framed for a connection that ends after it
+        self.close_connection = 1
+        self.wfile.write(response)
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = do_PATCH = \
+             do_OPTIONS = record
@@ -0,0 +1,118 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import socket
+import struct
+
+from cynic.tasks import Sleep
+from cynic.archive import get_archive, make_key
+from cynic.distributions import get_table
+from cynic.handlers.base import BaseHTTPHandler
+
+
+class HTTPReplayResponse(BaseHTTPHandler):
+    """Serves responses recorded by HTTPRecordResponse.
+
+    Requests are matched by method, path and body. The response can be
+    delayed, sent slowly in chunks, truncated and followed by an RST:
+
+    delay - distribution of the delay before the response
+    chunk - distribution of the delay between chunk_size byte chunks
+    truncate - number of response bytes to send at most
+    reset - reset the connection after the response
+
+    See cynic.distributions for the format of the distributions.
+    """
+
+    LOGGER_NAME = __name__
+
+    def __init__(self,
+                 connection,
+                 client_address,
+                 archive, # path
+                 delay=None,
+                 chunk=None,
+                 chunk_size=1024, # bytes
+                 truncate=None, # bytes
+                 reset=False,
+                 seed=None,
+                 **kwargs):
+        BaseHTTPHandler.__init__(self, connection, client_address, **kwargs)
+        # loaded by prepare, this is just a lookup
+        self.archive = get_archive(archive)
+        self.delay = self.chunk = None
+        if delay is not None:
+            self.delay = get_table(delay, seed)
+        if chunk is not None:
+            self.chunk = get_table(chunk, seed)
+        self.chunk_size = chunk_size
+        self.truncate = truncate
+        self.reset = reset
+
+    @classmethod
+    def prepare(cls, archive, delay=None, chunk=None, seed=None, **kwargs):
+        get_archive(archive)
+        for spec in (delay, chunk):
+            if spec is not None:
+                get_table(spec, seed)
+
+    def replay(self):
+        key = make_key(self.command, self.path, self.rfile.read())
+        response = self.archive.lookup(key)
+        if response is None:
+            self.send_error(
+                404, 'No recording of %s %s' % (self.command, self.path))
+            return
+
+        if self.delay is not None:
+            yield Sleep(self.delay.sample())
+        if self.truncate is not None:
+            response = buffer(response, 0, self.truncate)
+        self.logger.info(
+            'Replaying %s %s (%d bytes)', self.command, self.path,
+            len(response))
+
+        # the raw response is framed for a connection that ends after it
+        self.close_connection = 1
+        if self.chunk is None:
+            self.wfile.write(response)
+        else:
+            for offset in xrange(0, len(response), self.chunk_size):
+                if offset:
+                    yield Sleep(self.chunk.sample())
+                self.wfile.write(buffer(response, offset, self.chunk_size))
+                yield self.wfile.drain()
+
+        if self.reset:
+            yield self.wfile.drain()
+            self.logger.info('Sending RST packet')
+            # cause RST to be sent on socket.close()
+            self.connection.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.connection.close()
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = do_PATCH = \
+             do_OPTIONS = replay
@@ -35,7 +35,7 @@ class RSTResponse(BaseHandler):
 
     LOGGER_NAME = __name__
 
-    def handle(self):
+    def handle_async(self):
         self.logger.info('Sending RST packet')
         sock = self.connection
         l_onoff = 1 # cause RST to be sent on socket.close()
@@ -26,6 +26,7 @@ __author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
 
 import os
 
+from cynic.tasks import sendall
 from cynic.handlers.base import BaseHandler
 
 NUM_BYTES = 7
@@ -35,8 +36,8 @@ class RandomDataResponse(BaseHandler):
 
     LOGGER_NAME = __name__
 
-    def handle(self):
+    def handle_async(self):
         data = os.urandom(NUM_BYTES)
         self.logger.info('Sending %d bytes from /dev/urandom' % NUM_BYTES)
-        self.connection.send(data)
+        yield sendall(self.connection, data)
 
@@ -0,0 +1,227 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import re
+import types
+import urlparse
+
+from cynic.utils import resolve
+from cynic.handlers.base import BaseHTTPHandler
+
+# 10mb, 512k, 1gib - binary multipliers
+_SIZE = re.compile(r'^(\d+)([kmg])i?b?$', re.I)
+_MULTIPLIERS = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_param(value):
+    """Convert a query string value to a number, a size or None.
+
+    Anything else is returned as is.
+    """
+    match = _SIZE.match(value)
+    if match is not None:
+        number, multiplier = match.groups()
+        return int(number) * _MULTIPLIERS[multiplier.lower()]
+    if value.lower() == 'none':
+        return None
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+class Route(object):
+    """A handler class and its arguments behind a path prefix.
+
+    params - names of the keyword arguments the query string may set
+    """
+
+    __slots__ = ('klass', 'args', 'kwargs', 'params', 'is_http')
+
+    def __init__(self, klass, args=(), kwargs=None, params=()):
+        if isinstance(klass, basestring):
+            klass = resolve(klass)
+        if not hasattr(klass, 'handle_async'):
+            raise ValueError(
+                '%s can not be routed to, it has no handle_async' %
+                klass.__name__)
+        self.klass = klass
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.params = frozenset(params)
+        self.is_http = issubclass(klass, BaseHTTPHandler)
+
+    def get_kwargs(self, query):
+        """Return the keyword arguments updated from the query string."""
+        kwargs = self.kwargs
+        if self.params and query:
+            kwargs = dict(kwargs)
+            for name, value in urlparse.parse_qsl(query):
+                if name in self.params:
+                    kwargs[name] = parse_param(value)
+        return kwargs
+
+
+class _Node(object):
+
+    __slots__ = ('children', 'routes')
+
+    def __init__(self):
+        self.children = {} # path segment -> _Node
+        self.routes = {} # method or '*' -> Route
+
+
+class RouteTable(object):
+    """Trie of path segments.
+
+    A lookup walks the segments of the path once, so it costs the same
+    however many routes there are. The longest matching prefix wins,
+    prefixes match whole segments: /slow matches /slow/1 but not /slower.
+    """
+
+    def __init__(self, routes=()):
+        self.root = _Node()
+        for entry in routes:
+            method, prefix = entry[:2]
+            self.add(method, prefix, Route(*entry[2:]))
+
+    def add(self, method, prefix, route):
+        node = self.root
+        for segment in _split(prefix):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _Node()
+            node = child
+        node.routes[method.upper()] = route
+
+    def lookup(self, method, path):
+        """Return the route of the request or None."""
+        node = self.root
+        found = node.routes.get(method) or node.routes.get('*')
+        for segment in _split(path):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            route = node.routes.get(method) or node.routes.get('*')
+            if route is not None:
+                found = route
+        return found
+
+    def __iter__(self):
+        """Iterate over all routes."""
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            for route in node.routes.itervalues():
+                yield route
+            nodes.extend(node.children.itervalues())
+
+
+def _split(path):
+    return [segment for segment in path.split('/') if segment]
+
+
+_tables = {}
+
+
+def get_table(routes):
+    """Return the compiled table of the routes building it on the first call.
+
+    Call it before forking, so children share the table.
+    """
+    key = repr(routes)
+    table = _tables.get(key)
+    if table is None:
+        table = _tables[key] = RouteTable(routes)
+    return table
+
+
+class HTTPRouter(BaseHTTPHandler):
+    """Serves many fault scenarios on one port, picked by the request.
+
+    routes - list of (method, prefix, class[, args[, kwargs[, params]]])
+             tuples. method is an HTTP method or '*' for any, prefix is
+             a path prefix like '/slow', class is a handler class or its
+             fully qualified dotted name and params lists the keyword
+             arguments the query string may override, e.g. size in
+             /json?size=10MB
+
+    The request is handed over to the handler of the longest matching
+    prefix, HTTP handlers answer it as if they had read it themselves.
+    Other handlers, like RSTResponse, get the connection. Requests that
+    match no route get 404.
+    """
+
+    LOGGER_NAME = __name__
+
+    def __init__(self, connection, client_address, routes, **kwargs):
+        BaseHTTPHandler.__init__(self, connection, client_address, **kwargs)
+        # compiled by prepare, this is just a lookup
+        self.table = get_table(routes)
+
+    @classmethod
+    def prepare(cls, routes, **kwargs):
+        get_table(routes)
+
+    @classmethod
+    def get_targets(cls, routes, **kwargs):
+        """Return (class, args, kwargs) of the routed handlers."""
+        return [
+            (route.klass, route.args, route.kwargs)
+            for route in get_table(routes)
+            ]
+
+    def route(self):
+        path, _, query = self.path.partition('?')
+        route = self.table.lookup(self.command, path)
+        if route is None:
+            self.send_error(404, 'No route for %s %s' % (self.command, path))
+            return
+
+        kwargs = route.get_kwargs(query)
+        if route.is_http:
+            # the connection is kept alive as configured for the router
+            kwargs = dict(kwargs, max_requests=self.max_requests)
+            handler = route.klass(
+                self.connection, self.client_address, *route.args, **kwargs)
+            handler.request_number = self.request_number
+            yield handler.handle_request(self.raw_request)
+            self.close_connection = handler.close_connection
+            return
+
+        # the handler takes the connection over
+        self.close_connection = 1
+        handler = route.klass(
+            self.connection, self.client_address, *route.args, **kwargs)
+        result = handler.handle_async()
+        if isinstance(result, types.GeneratorType):
+            yield result
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = do_PATCH = \
+             do_OPTIONS = route
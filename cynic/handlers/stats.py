@@ -0,0 +1,98 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import json
+import time
+
+from cynic import metrics
+from cynic.handlers.base import BaseHTTPHandler
+
+# (name, field, type, help) of the Prometheus metrics
+PROMETHEUS_METRICS = (
+    ('cynic_connections_accepted_total', 'accepted', 'counter',
+     'Connections accepted.'),
+    ('cynic_connections_closed_total', 'closed', 'counter',
+     'Connections served to the end.'),
+    ('cynic_connections_active', 'active', 'gauge',
+     'Connections being served.'),
+    ('cynic_sent_bytes_total', 'bytes_sent', 'counter',
+     'Bytes sent to clients of closed connections and in datagrams.'),
+    ('cynic_received_bytes_total', 'bytes_received', 'counter',
+     'Bytes received from clients of closed connections and in '
+     'datagrams.'),
+    ('cynic_connection_seconds_total', 'seconds', 'counter',
+     'Time spent serving closed connections.'),
+    ('cynic_connections_shed_total', 'shed', 'counter',
+     'Connections closed unserved over a concurrency cap.'),
+    ('cynic_datagrams_received_total', 'datagrams_received', 'counter',
+     'Datagrams received by datagram handlers.'),
+    ('cynic_datagrams_sent_total', 'datagrams_sent', 'counter',
+     'Datagrams sent by datagram handlers.'),
+    )
+
+
+class HTTPStatsResponse(BaseHTTPHandler):
+    """Serves the server's connection counters per handler.
+
+    JSON by default, the Prometheus text format on /metrics.
+    """
+
+    CONTENT_TYPE = 'application/json'
+
+    LOGGER_NAME = __name__
+
+    def do_GET(self):
+        table = metrics.table
+        if table is None:
+            self.send_error(503, 'Metrics are not available')
+            return
+
+        stats = table.snapshot()
+        if self.path.split('?')[0] == '/metrics':
+            content_type = 'text/plain; version=0.0.4'
+            body = self.format_prometheus(stats)
+        else:
+            content_type = self.CONTENT_TYPE
+            body = json.dumps({
+                'uptime': time.time() - table.started,
+                'handlers': stats,
+                }, indent=2, sort_keys=True)
+
+        self.send_response(200)
+        self.send_header('Content-Length', len(body))
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def format_prometheus(self, stats):
+        lines = []
+        for name, field, kind, help in PROMETHEUS_METRICS:
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for handler in sorted(stats):
+                lines.append('%s{handler="%s"} %s' % (
+                    name, handler, repr(float(stats[handler][field]))))
+        return '\n'.join(lines) + '\n'
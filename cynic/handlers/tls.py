@@ -0,0 +1,206 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import ssl
+import types
+import socket
+
+from cynic import tasks
+from cynic.tls import CERT_DIR, get_context
+from cynic.utils import resolve
+from cynic.throttle import ThrottledSocket
+from cynic.handlers.base import BaseHandler
+
+FAULTS = ('slow_handshake', 'truncated_handshake', 'no_close_notify')
+HANDSHAKE_DELAY = 30 # secs
+
+
+class TLSWrapper(BaseHandler):
+    """Serves another handler over TLS, optionally with TLS faults.
+
+    handler - handler class or its fully qualified dotted name, it
+              needs handle_async
+    args, kwargs - arguments of the handler
+    certificate - 'valid', 'expired' or 'mismatch', a certificate
+                  generated by Cynic (see cynic.tls)
+    certfile, keyfile - PEM files of a certificate of your own instead
+    fault - 'slow_handshake' waits handshake_delay secs before answering
+            the ClientHello, 'truncated_handshake' sends handshake_bytes
+            of the server's first flight (half of it by default) and
+            closes, 'no_close_notify' closes the connection without
+            the close_notify alert
+    """
+
+    LOGGER_NAME = __name__
+
+    def __init__(self, connection, client_address, handler, args=(),
+                 kwargs=None, certificate='valid', certfile=None,
+                 keyfile=None, fault=None, handshake_delay=HANDSHAKE_DELAY,
+                 handshake_bytes=None, cert_dir=CERT_DIR):
+        BaseHandler.__init__(self, connection, client_address)
+        if fault is not None and fault not in FAULTS:
+            raise ValueError('Unknown TLS fault %r' % (fault,))
+        if isinstance(handler, basestring):
+            handler = resolve(handler)
+        self.klass = handler
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.fault = fault
+        self.handshake_delay = handshake_delay
+        self.handshake_bytes = handshake_bytes
+        # built by prepare, this is just a lookup
+        self.context = get_context(certificate, certfile, keyfile, cert_dir)
+
+    @classmethod
+    def prepare(cls, handler, args=(), kwargs=None, certificate='valid',
+                certfile=None, keyfile=None, cert_dir=CERT_DIR, **options):
+        get_context(certificate, certfile, keyfile, cert_dir)
+
+    @classmethod
+    def get_targets(cls, handler, args=(), kwargs=None, **options):
+        """Return (class, args, kwargs) of the wrapped handler."""
+        if isinstance(handler, basestring):
+            handler = resolve(handler)
+        return [(handler, args, kwargs or {})]
+
+    def handle_async(self):
+        raw = self.connection
+        limiter = getattr(raw, 'limiter', None)
+        if limiter is not None: # throttle what TLS sends
+            raw = raw._sock
+
+        if self.fault == 'truncated_handshake':
+            yield self.truncate_handshake(raw)
+            return
+        if self.fault == 'slow_handshake':
+            yield tasks.ReadWait(raw) # the ClientHello is here
+            self.logger.info(
+                'Delaying the handshake for %s secs', self.handshake_delay)
+            yield tasks.Sleep(self.handshake_delay)
+
+        tls = self.context.wrap_socket(
+            raw, server_side=True, do_handshake_on_connect=False)
+        try:
+            established = yield self.handshake(tls)
+            if not established:
+                return
+
+            conn = tls
+            if limiter is not None:
+                conn = ThrottledSocket(tls, limiter)
+            handler = self.klass(
+                conn, self.client_address, *self.args, **self.kwargs)
+            result = handler.handle_async()
+            if isinstance(result, types.GeneratorType):
+                yield result
+
+            if self.fault == 'no_close_notify':
+                self.logger.info('Closing without close_notify')
+                return
+            yield self.close_notify(tls)
+        finally:
+            # HTTP handlers reference themselves, the socket would stay
+            # open until they're collected
+            tls.close()
+
+    def handshake(self, tls):
+        """Returns True once the handshake is done, False if it failed."""
+        while True:
+            try:
+                tls.do_handshake()
+            except ssl.SSLWantReadError:
+                yield tasks.ReadWait(tls)
+                continue
+            except ssl.SSLWantWriteError:
+                yield tasks.WriteWait(tls)
+                continue
+            except (ssl.SSLError, socket.error) as e:
+                # e.g. the client rejected the certificate
+                self.logger.info('TLS handshake failed: %s', e)
+                raise tasks.Return(False)
+            raise tasks.Return(True)
+
+    def close_notify(self, tls):
+        """Send close_notify, without waiting for the client's one."""
+        try:
+            tls.setblocking(0)
+        except socket.error: # closed by the handler
+            return
+        while True:
+            try:
+                tls.unwrap()
+            except ssl.SSLWantWriteError:
+                yield tasks.WriteWait(tls)
+                continue
+            except (ssl.SSLError, socket.error, ValueError):
+                # sent and waiting for the client's, or the client is gone
+                pass
+            return
+
+    def truncate_handshake(self, raw):
+        """Send the first bytes of the server's first flight and close.
+
+        The handshake runs over a socket pair standing in for a memory
+        BIO, so the flight can be cut anywhere.
+        """
+        inner, outer = [
+            socket.socket(_sock=sock) for sock in socket.socketpair()]
+        inner.setblocking(0)
+        outer.setblocking(0)
+        tls = self.context.wrap_socket(
+            inner, server_side=True, do_handshake_on_connect=False)
+        try:
+            while True:
+                hello = yield tasks.recv(raw, 16384)
+                if not hello:
+                    return
+                outer.sendall(hello)
+                try:
+                    tls.do_handshake()
+                except ssl.SSLWantReadError:
+                    pass
+                except ssl.SSLError as e:
+                    self.logger.info('TLS handshake failed: %s', e)
+                    return
+                try:
+                    flight = outer.recv(65536)
+                except socket.error as e:
+                    if e.args[0] in tasks.WOULD_BLOCK:
+                        continue # more of the ClientHello to come
+                    raise
+                break
+        finally:
+            for sock in (tls, inner, outer):
+                sock.close()
+
+        size = self.handshake_bytes
+        if size is None:
+            size = len(flight) // 2
+        self.logger.info(
+            'Truncating the handshake after %d of %d bytes',
+            size, len(flight))
+        yield tasks.sendall(raw, flight[:size])
@@ -0,0 +1,101 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import random
+
+from cynic.distributions import get_table
+from cynic.handlers.base import BaseDatagramHandler
+
+REORDER_DELAY = 0.05 # secs
+
+
+class UDPEchoResponse(BaseDatagramHandler):
+    """Echoes datagrams back through a lossy network.
+
+    Every datagram is dropped, duplicated, delayed or reordered by the
+    given probabilities, independently of the others:
+
+    drop - probability the datagram is lost
+    duplicate - probability it's sent twice
+    delay - probability it's delayed by a time drawn from latency
+    latency - distribution of the delays (see cynic.distributions)
+    reorder - probability it's held back for reorder_delay secs, so the
+              datagrams right after it overtake it
+    reply - False swallows the datagrams instead of echoing them,
+            e.g. for statsd or syslog clients that never read
+    """
+
+    LOGGER_NAME = __name__
+
+    def __init__(self, drop=0, duplicate=0, delay=0, latency=0.1,
+                 reorder=0, reorder_delay=REORDER_DELAY, reply=True,
+                 max_delay=None, seed=None):
+        for name, value in (('drop', drop), ('duplicate', duplicate),
+                            ('delay', delay), ('reorder', reorder)):
+            if not 0 <= value <= 1:
+                raise ValueError(
+                    'Probability %s must be between 0 and 1, got %r' % (
+                        name, value))
+        self.drop = drop
+        self.duplicate = duplicate
+        self.delay = delay
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.reply = reply
+        self.random = random.Random(seed).random
+        self.latency = None
+        if delay:
+            self.latency = get_table(latency, seed, max_delay)
+
+    @classmethod
+    def prepare(cls, drop=0, duplicate=0, delay=0, latency=0.1,
+                max_delay=None, seed=None, **kwargs):
+        if delay:
+            get_table(latency, seed, max_delay)
+
+    def handle_datagrams(self, datagrams):
+        if not self.reply:
+            return []
+        if not (self.drop or self.duplicate or self.delay or self.reorder):
+            return [(0, data, address) for data, address in datagrams]
+
+        rnd = self.random
+        drop, duplicate = self.drop, self.duplicate
+        delay, reorder = self.delay, self.reorder
+        result = []
+        for data, address in datagrams:
+            if drop and rnd() < drop:
+                continue
+            wait = 0
+            if delay and rnd() < delay:
+                wait = self.latency.sample()
+            if reorder and rnd() < reorder:
+                wait += self.reorder_delay
+            result.append((wait, data, address))
+            if duplicate and rnd() < duplicate:
+                result.append((wait, data, address))
+        return result
@@ -0,0 +1,209 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+"""Connection counters shared by all processes of the server.
+
+The table lives in shared memory created before any fork. Every row
+has a single writer, so counters are updated without locks:
+
+* every IO loop (the only one, or each prefork worker) owns a row per
+  handler with the totals of the connections it accepted
+* a forked child owns a slot, allocated by its IO loop, where it stores
+  the byte counts of its connection before exiting; the IO loop adds the
+  slot to its row when the child is reaped
+
+Readers (the stats handler) sum the rows of all IO loops.
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import time
+import multiprocessing
+
+from cynic.utils import get_tcp_bytes
+
+FIELDS = (
+    'accepted', 'closed', 'bytes_sent', 'bytes_received', 'seconds', 'shed',
+    'datagrams_received', 'datagrams_sent')
+(ACCEPTED, CLOSED, BYTES_SENT, BYTES_RECEIVED, SECONDS, SHED,
+ DATAGRAMS_RECEIVED, DATAGRAMS_SENT) = range(len(FIELDS))
+
+SLOTS = 1024 # children of one IO loop that can report bytes at once
+# handler sections that can be counted, reloads add sections to the table
+MAX_HANDLERS = 256
+
+
+class MetricsTable(object):
+
+    def __init__(self, names, writers=1, slots=SLOTS,
+                 max_handlers=MAX_HANDLERS):
+        self.names = list(names)
+        self.writers = writers
+        self.slots = slots
+        self.row_size = len(FIELDS)
+        self.started = time.time()
+        self.max_handlers = max(max_handlers, len(names))
+        rows = writers * self.max_handlers
+        self.counters = multiprocessing.RawArray(
+            'd', rows * self.row_size + writers * slots * 2)
+        self.slots_offset = rows * self.row_size
+        self.free_slots = {}
+
+    def get_row(self, writer, index):
+        """Return the offset of the row of a handler written by writer."""
+        return (writer * self.max_handlers + index) * self.row_size
+
+    def add(self, name):
+        """Return the row index of a handler adding the handler if new.
+
+        Every process adds the same names in the same order, so the
+        indexes match across prefork workers.
+        """
+        if name in self.names:
+            return self.names.index(name)
+        if len(self.names) == self.max_handlers:
+            raise ValueError(
+                'No room for handler %r, at most %d handlers can be '
+                'counted' % (name, self.max_handlers))
+        self.names.append(name)
+        return len(self.names) - 1
+
+    def reset(self, writer):
+        """Forget the counters of a writer, e.g. a respawned worker.
+
+        Totals are kept, only connections still counted as active are
+        closed.
+        """
+        counters = self.counters
+        for index in range(len(self.names)):
+            row = self.get_row(writer, index)
+            counters[row + CLOSED] = counters[row + ACCEPTED]
+        self.free_slots[writer] = range(self.slots - 1, -1, -1)
+
+    # IO loop side
+
+    def accepted(self, writer, index):
+        self.counters[self.get_row(writer, index) + ACCEPTED] += 1
+
+    def closed(self, writer, index, started, sent=0, received=0):
+        counters = self.counters
+        row = self.get_row(writer, index)
+        counters[row + CLOSED] += 1
+        counters[row + BYTES_SENT] += sent
+        counters[row + BYTES_RECEIVED] += received
+        counters[row + SECONDS] += time.time() - started
+
+    def shed(self, writer, index, started):
+        """Count a connection closed unserved over a concurrency cap."""
+        self.closed(writer, index, started)
+        self.counters[self.get_row(writer, index) + SHED] += 1
+
+    def received(self, writer, index, datagrams):
+        """Count a batch of (data, address) datagrams received."""
+        counters = self.counters
+        row = self.get_row(writer, index)
+        counters[row + DATAGRAMS_RECEIVED] += len(datagrams)
+        counters[row + BYTES_RECEIVED] += sum(
+            [len(data) for data, address in datagrams])
+
+    def sent(self, writer, index, datagrams):
+        counters = self.counters
+        row = self.get_row(writer, index)
+        counters[row + DATAGRAMS_SENT] += len(datagrams)
+        counters[row + BYTES_SENT] += sum(
+            [len(data) for data, address in datagrams])
+
+    def connection_closed(self, writer, index, started, sock):
+        """Count a connection served by the IO loop itself."""
+        sent = received = 0
+        counts = get_tcp_bytes(sock)
+        if counts is not None:
+            sent, received = counts
+        self.closed(writer, index, started, sent, received)
+
+    def acquire_slot(self, writer):
+        """Return a slot for a child to be forked or None."""
+        free = self.free_slots.get(writer)
+        if not free:
+            return None
+        slot = free.pop()
+        offset = self._get_slot(writer, slot)
+        self.counters[offset] = self.counters[offset + 1] = 0
+        return slot
+
+    def release_slot(self, writer, slot):
+        """Return (sent, received) stored by the exited child."""
+        self.free_slots[writer].append(slot)
+        offset = self._get_slot(writer, slot)
+        return self.counters[offset], self.counters[offset + 1]
+
+    def _get_slot(self, writer, slot):
+        return self.slots_offset + (writer * self.slots + slot) * 2
+
+    # child side
+
+    def report(self, writer, slot, sock):
+        """Store the byte counts of the child's connection."""
+        counts = get_tcp_bytes(sock)
+        if counts is not None:
+            offset = self._get_slot(writer, slot)
+            self.counters[offset], self.counters[offset + 1] = counts
+
+    # readers
+
+    def snapshot(self):
+        """Return {name: {field: value}} summed over all writers."""
+        counters = self.counters[:self.slots_offset]
+        stats = {}
+        for index, name in enumerate(self.names):
+            values = [0] * len(FIELDS)
+            for writer in range(self.writers):
+                row = self.get_row(writer, index)
+                for field in range(len(FIELDS)):
+                    values[field] += counters[row + field]
+            handler_stats = dict(zip(FIELDS, values))
+            handler_stats['active'] = (
+                handler_stats['accepted'] - handler_stats['closed'])
+            stats[name] = handler_stats
+        return stats
+
+
+# shared by the server and the stats handler
+table = None
+
+
+def setup(handler_configs, writers=1):
+    """Create the table for the handlers unless it's been created.
+
+    Must be called before the first fork. Assigns every handler config
+    its row index, handlers new to the table get new rows.
+    """
+    global table
+    if table is None:
+        table = MetricsTable(
+            [config.name for config in handler_configs], writers)
+    for config in handler_configs:
+        config.index = table.add(config.name)
+    return table
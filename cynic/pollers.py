@@ -0,0 +1,195 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+"""Readiness notification backends for the IO loops.
+
+All pollers share the same interface: ``register(fd, events)``,
+``unregister(fd)`` and ``poll(timeout)`` where timeout is in seconds
+(None blocks until an event) and the result is a list of (fd, events).
+Events are expressed with READ, WRITE and ERROR below.
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import errno
+import select
+
+READ = 0x001
+WRITE = 0x004
+ERROR = 0x008 | 0x010 # error or hang up
+
+
+def _is_eintr(e):
+    return e.args and e.args[0] == errno.EINTR
+
+
+class EpollPoller(object):
+    """Level-triggered epoll, O(1) in the number of watched descriptors."""
+
+    EDGE_TRIGGERED = False
+
+    def __init__(self):
+        self._epoll = select.epoll()
+        self._flags = 0
+        if self.EDGE_TRIGGERED:
+            self._flags = select.EPOLLET
+
+    def register(self, fd, events):
+        mask = self._flags
+        if events & READ:
+            mask |= select.EPOLLIN
+        if events & WRITE:
+            mask |= select.EPOLLOUT
+        self._epoll.register(fd, mask)
+
+    def unregister(self, fd):
+        self._epoll.unregister(fd)
+
+    def close(self):
+        self._epoll.close()
+
+    def poll(self, timeout=None):
+        if timeout is None:
+            timeout = -1
+        try:
+            events = self._epoll.poll(timeout)
+        except (IOError, select.error) as e:
+            if _is_eintr(e):
+                return []
+            raise
+        result = []
+        for fd, mask in events:
+            flag = 0
+            if mask & select.EPOLLIN:
+                flag |= READ
+            if mask & select.EPOLLOUT:
+                flag |= WRITE
+            if mask & (select.EPOLLERR | select.EPOLLHUP):
+                flag |= ERROR
+            result.append((fd, flag))
+        return result
+
+
+class EdgeEpollPoller(EpollPoller):
+    """Edge-triggered epoll.
+
+    An event is reported once per readiness change, so the loop must
+    consume everything (e.g. accept until EAGAIN) before it waits again.
+    """
+
+    EDGE_TRIGGERED = True
+
+
+class PollPoller(object):
+    """poll(2) based backend, rescans every descriptor on each call."""
+
+    def __init__(self):
+        self._poll = select.poll()
+
+    def register(self, fd, events):
+        mask = 0
+        if events & READ:
+            mask |= select.POLLIN
+        if events & WRITE:
+            mask |= select.POLLOUT
+        self._poll.register(fd, mask)
+
+    def unregister(self, fd):
+        self._poll.unregister(fd)
+
+    def close(self):
+        pass
+
+    def poll(self, timeout=None):
+        if timeout is not None:
+            timeout *= 1000 # msecs
+        try:
+            events = self._poll.poll(timeout)
+        except select.error as e:
+            if _is_eintr(e):
+                return []
+            raise
+        result = []
+        for fd, mask in events:
+            flag = 0
+            if mask & select.POLLIN:
+                flag |= READ
+            if mask & select.POLLOUT:
+                flag |= WRITE
+            if mask & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
+                flag |= ERROR
+            result.append((fd, flag))
+        return result
+
+
+class SelectPoller(object):
+    """select(2) based backend, limited to FD_SETSIZE descriptors."""
+
+    def __init__(self):
+        self._readers = set()
+        self._writers = set()
+
+    def register(self, fd, events):
+        if events & READ:
+            self._readers.add(fd)
+        if events & WRITE:
+            self._writers.add(fd)
+
+    def unregister(self, fd):
+        self._readers.discard(fd)
+        self._writers.discard(fd)
+
+    def close(self):
+        pass
+
+    def poll(self, timeout=None):
+        try:
+            readable, writable, failed = select.select(
+                self._readers, self._writers,
+                self._readers | self._writers, timeout)
+        except select.error as e:
+            if _is_eintr(e):
+                return []
+            raise
+        events = {}
+        for fd in readable:
+            events[fd] = events.get(fd, 0) | READ
+        for fd in writable:
+            events[fd] = events.get(fd, 0) | WRITE
+        for fd in failed:
+            events[fd] = events.get(fd, 0) | ERROR
+        return events.items()
+
+
+POLLERS = {}
+if hasattr(select, 'epoll'):
+    POLLERS['epoll'] = EpollPoller
+    POLLERS['epoll-et'] = EdgeEpollPoller
+if hasattr(select, 'poll'):
+    POLLERS['poll'] = PollPoller
+POLLERS['select'] = SelectPoller
+
+DEFAULT_POLLER = [
+    name for name in ('epoll', 'poll', 'select') if name in POLLERS][0]
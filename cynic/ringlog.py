@@ -0,0 +1,205 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+"""Shared memory log transport between forked children and the parent.
+
+The parent creates a LogRing (an anonymous shared mmap) before it forks
+and hands every child a lane of its own. The child is the only writer of
+the lane and the parent is the only reader, so records are passed without
+locks and without any system calls on the child's side: the child copies
+a fixed-layout record into the next slots and then bumps the lane's head,
+the parent periodically copies records out and bumps the tail. When the
+lane is full the record is dropped and counted.
+
+A record takes as many consecutive slots as it needs, up to
+MAX_RECORD_SLOTS, so tracebacks get through; longer messages are cut
+and end with TRUNCATED.
+
+Writes of the record and of the head are plain stores that the parent
+sees in program order on the platforms Cynic runs on (x86 and other TSO
+architectures).
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import mmap
+import struct
+import logging
+
+LANES = 256
+SLOTS = 32 # records per lane
+SLOT_SIZE = 256 # bytes
+MAX_NAME = 64
+MAX_RECORD_SLOTS = 16 # about 4KB per record with the SLOT_SIZE
+TRUNCATED = ' [truncated]'
+
+# head (records written), tail (records read), dropped, owner pid
+LANE_HEADER = struct.Struct('<IIII')
+# created, levelno, name length, message length
+RECORD_HEADER = struct.Struct('<dHHH')
+
+_MASK = 0xffffffff
+
+
+class LogRing(object):
+    """Lanes of single-producer single-consumer record rings."""
+
+    def __init__(self, lanes=LANES, slots=SLOTS, slot_size=SLOT_SIZE):
+        self.lanes = lanes
+        self.slots = slots
+        self.slot_size = slot_size
+        self.lane_size = LANE_HEADER.size + slots * slot_size
+        self.max_record = min(slots, MAX_RECORD_SLOTS) * slot_size
+        # anonymous mappings are MAP_SHARED, children write into our pages
+        self.mmap = mmap.mmap(-1, lanes * self.lane_size)
+        self.free = range(lanes - 1, -1, -1)
+        self.active = set()
+        self.dropped = 0 # by released lanes
+
+    # parent side
+
+    def acquire(self):
+        """Return a free lane for a child to be forked or None."""
+        if not self.free:
+            return None
+        lane = self.free.pop()
+        LANE_HEADER.pack_into(self.mmap, lane * self.lane_size, 0, 0, 0, 0)
+        self.active.add(lane)
+        return lane
+
+    def set_owner(self, lane, pid):
+        offset = lane * self.lane_size + 12
+        struct.pack_into('<I', self.mmap, offset, pid)
+
+    def release(self, lane):
+        """Drain the lane of a child that has exited and free it."""
+        if lane not in self.active:
+            return []
+        records = self.read(lane)
+        self.dropped += self.get_dropped(lane)
+        self.active.discard(lane)
+        self.free.append(lane)
+        return records
+
+    def get_dropped(self, lane):
+        return LANE_HEADER.unpack_from(self.mmap, lane * self.lane_size)[2]
+
+    def read(self, lane):
+        """Return new records of the lane as LogRecords."""
+        base = lane * self.lane_size
+        head, tail, dropped, pid = LANE_HEADER.unpack_from(self.mmap, base)
+        if head == tail:
+            return []
+
+        records = []
+        data = self.mmap
+        slot_size = self.slot_size
+        while tail != head:
+            offset = self._get_offset(base, tail)
+            created, levelno, name_len, msg_len = (
+                RECORD_HEADER.unpack_from(data, offset))
+            size = RECORD_HEADER.size + name_len + msg_len
+            count = -(-size // slot_size)
+            if count == 1:
+                record = data[offset:offset + size]
+            else:
+                chunks = []
+                for i in xrange(count):
+                    offset = self._get_offset(base, tail + i)
+                    chunks.append(data[offset:offset + slot_size])
+                record = ''.join(chunks)
+            offset = RECORD_HEADER.size
+            name = record[offset:offset + name_len]
+            offset += name_len
+            msg = record[offset:offset + msg_len]
+            record = logging.makeLogRecord(dict(
+                name=name, msg=msg, levelno=levelno,
+                levelname=logging.getLevelName(levelno),
+                created=created, msecs=(created - int(created)) * 1000,
+                process=pid,
+                ))
+            records.append(record)
+            tail = (tail + count) & _MASK
+
+        struct.pack_into('<I', self.mmap, base + 4, tail)
+        return records
+
+    def read_all(self):
+        records = []
+        for lane in self.active:
+            records.extend(self.read(lane))
+        return records
+
+    def _get_offset(self, base, number):
+        """Return the offset of the slot with the number in the lane."""
+        return base + LANE_HEADER.size + (number % self.slots) * self.slot_size
+
+    # child side
+
+    def write(self, lane, created, levelno, name, msg):
+        """Append a record to the lane, drop it if the lane is full."""
+        name = name[:MAX_NAME]
+        room = self.max_record - RECORD_HEADER.size - len(name)
+        if len(msg) > room:
+            msg = msg[:room - len(TRUNCATED)] + TRUNCATED
+        record = (
+            RECORD_HEADER.pack(created, levelno, len(name), len(msg)) +
+            name + msg)
+        slot_size = self.slot_size
+        count = -(-len(record) // slot_size)
+
+        base = lane * self.lane_size
+        head, tail, dropped, pid = LANE_HEADER.unpack_from(self.mmap, base)
+        if (head - tail) & _MASK > self.slots - count:
+            struct.pack_into('<I', self.mmap, base + 8, dropped + 1)
+            return False
+
+        for i in xrange(count):
+            chunk = record[i * slot_size:(i + 1) * slot_size]
+            offset = self._get_offset(base, head + i)
+            self.mmap[offset:offset + len(chunk)] = chunk
+        # publish the record
+        struct.pack_into('<I', self.mmap, base, (head + count) & _MASK)
+        return True
+
+
+class RingLogHandler(logging.Handler):
+    """Logging handler of a child that writes into its lane of the ring."""
+
+    def __init__(self, ring, lane):
+        logging.Handler.__init__(self)
+        self.ring = ring
+        self.lane = lane
+
+    def emit(self, record):
+        try:
+            # the message with the traceback if there is one
+            msg = self.format(record)
+            if isinstance(msg, unicode):
+                msg = msg.encode('utf-8')
+            self.ring.write(
+                self.lane, record.created, record.levelno, record.name, msg)
+        except Exception:
+            self.handleError(record)
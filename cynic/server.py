@@ -26,19 +26,52 @@ __author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
 
 import os
 import sys
+import time
+import fcntl
+import struct
+import functools
 import errno
 import socket
-import select
 import signal
+import logging
 import optparse
+import collections
+import multiprocessing
 import StringIO
 import ConfigParser
 
-from cynic.utils import LOG_UNIX_SOCKET, get_console_logger, get_stream_logger
+from cynic import cache
+from cynic import distributions
+from cynic import metrics
+from cynic import tasks
+from cynic.pollers import POLLERS, DEFAULT_POLLER, READ, WRITE
+from cynic.timers import TimerWheel
+from cynic.children import ChildTable, describe_status
+from cynic.datagrams import get_datagram_socket
+from cynic.ringlog import LogRing
+from cynic.throttle import TokenBucket, parse_rate, throttle
+from cynic.utils import (
+    LOG_UNIX_SOCKET,
+    get_console_logger,
+    get_stream_logger,
+    get_accept_queue,
+    get_listen_overflows,
+    set_log_lane,
+    resolve,
+    )
 
-READ_ONLY = select.POLLIN
-POLL_TIMEOUT = 500 # 0.5 sec
-BACKLOG = 5
+BACKLOG = 128 # default listen backlog, can be set per handler
+ACCEPT_BATCH = 64 # max connections accepted per listen socket wakeup
+OVERFLOW_LOG_INTERVAL = 10 # secs
+LOG_DRAIN_INTERVAL = 0.1 # secs between reads of the children's log ring
+LOG_TRANSPORTS = ('ring', 'socket')
+# what happens to connections over a concurrency cap
+OVERFLOW_ACTIONS = ('backlog', 'reset', 'queue')
+QUEUE_TIMEOUT = 10 # secs a connection may wait in the 'queue' overflow
+SOCKET_TYPES = ('stream', 'dgram')
+# secs children have to exit after SIGTERM before they get SIGKILL
+DRAIN_TIMEOUT = 5
+DRAIN_POLL_INTERVAL = 0.05 # secs
 
 DEFAULT_CONFIG = """\
 ############################################################
@@ -75,6 +108,27 @@ class = cynic.handlers.httpslow.HTTPSlowResponse
 host = 0.0.0.0
 port = 2003
 
+[handler:httpdelay]
+# waits 30 seconds and then sends the whole response.
+class = cynic.handlers.httpdelay.HTTPDelayedResponse
+#args = ('/tmp/test.json', 'application/json', 5)
+host = 0.0.0.0
+port = 2004
+
+[handler:firehose]
+# streams a never ending response body without Content-Length
+class = cynic.handlers.firehose.HTTPFirehoseResponse
+#kwargs = {'content': 'json', 'size': 10 * 1024 ** 3}
+host = 0.0.0.0
+port = 2005
+
+[handler:latency]
+# delays the response by a long-tailed random time
+class = cynic.handlers.httplatency.HTTPLatencyResponse
+kwargs = {'ttfb': ('lognormal', 0.2, 1), 'max_delay': 30}
+host = 0.0.0.0
+port = 2006
+
 
 ############################################################
 # Any TCP socket protocol                                  #
@@ -118,20 +172,8 @@ family = unix
 logger = get_console_logger('server')
 
 
-# taken from logging.config
-def _resolve(name):
-    """Resolve a dotted name to a global object."""
-    name = name.split('.')
-    used = name.pop(0)
-    found = __import__(used)
-    for n in name:
-        used = used + '.' + n
-        try:
-            found = getattr(found, n)
-        except AttributeError:
-            __import__(used)
-            found = getattr(found, n)
-    return found
+# (pid, status) of reaped children for the IO loop to pick up
+_reaped = collections.deque()
 
 
 def _reap_children(signum, frame):
@@ -142,6 +184,7 @@ def _reap_children(signum, frame):
             pid, status = os.waitpid(-1, os.WNOHANG)
             if pid == 0: # no more zombies
                 break
+            _reaped.append((pid, status))
         except:
             # Usually this would be OSError exception
             # with 'errno' attribute set to errno.ECHILD
@@ -149,6 +192,31 @@ def _reap_children(signum, frame):
             break
 
 
+# SIGHUPs received for the IO loop to pick up
+_reload_requests = collections.deque()
+
+
+def _request_reload(signum, frame):
+    """Ask the IO loop to reload the configuration file."""
+    _reload_requests.append(signum)
+
+
+def _reset(conn):
+    """Close the connection with an RST."""
+    conn.setsockopt(
+        socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    conn.close()
+
+
+def _prepare_handlers(handler_configs):
+    """Let handler classes set up shared state before serving."""
+    for config in handler_configs:
+        for klass, args, kwargs in config.get_targets():
+            prepare = getattr(klass, 'prepare', None)
+            if prepare is not None:
+                prepare(*args, **kwargs)
+
+
 def _load_config(fname):
     """Return an instance of ConfigParser."""
     config = ConfigParser.ConfigParser()
@@ -161,13 +229,112 @@ def _load_config(fname):
 
 
 class HandlerConfig(object):
-    def __init__(self, klass, args, host, port, family):
+    def __init__(self, klass, args, host, port, family, backlog=None,
+                 kwargs=None, rate=None, port_rate=None, name=None,
+                 max_connections=None, overflow=None, queue_timeout=None,
+                 type='stream'):
+        if type not in SOCKET_TYPES:
+            raise ValueError('Unknown socket type %r' % (type,))
         self.klass = klass
+        self.name = name or klass.__name__
+        self.index = None # row in the metrics table
         self.args = args
+        self.kwargs = kwargs or {}
         self.host = host
         self.port = port
         self.family = family
+        self.type = type
+        self.backlog = backlog # None means the server's default
         self.socket = None # set up by the server
+        # datagram sockets only, served by a single handler instance
+        self.datagrams = None # DatagramSocket wrapping the socket
+        self.handler = None
+        self.received = self.sent = 0 # datagrams
+        # bandwidth limits in bytes per second
+        self.rate = rate # per connection
+        self.port_rate = port_rate
+        self.port_bucket = None # all connections on the port
+        if port_rate:
+            # created before any fork, so it's shared by all processes
+            self.port_bucket = TokenBucket(port_rate, shared=True)
+        # accept statistics
+        self.accepted = 0
+        self.queue_full = 0 # wakeups that found the accept queue full
+        self.last_overflow_log = 0
+        # concurrency cap, None means the server's defaults
+        if overflow is not None and overflow not in OVERFLOW_ACTIONS:
+            raise ValueError('Unknown overflow action %r' % (overflow,))
+        self.max_connections = max_connections
+        self.overflow = overflow
+        self.queue_timeout = queue_timeout
+        self.active = 0 # connections being served
+        self.queued = 0 # connections waiting in the 'queue' overflow
+        self.shed = 0 # connections closed unserved over the cap
+        # handlers to pick from for every connection, see MixedResponse
+        self.choices = self.alias = None
+        get_choices = getattr(klass, 'get_choices', None)
+        if get_choices is not None:
+            choices, self.alias = get_choices(*args, **self.kwargs)
+            self.choices = []
+            for target, target_args, target_kwargs in choices:
+                if isinstance(target, basestring):
+                    target = resolve(target)
+                self.choices.append((target, target_args, target_kwargs))
+
+    def get_address(self):
+        """Return what identifies the listen socket of the handler."""
+        return self.family, self.type, self.host, self.port
+
+    def get_settings(self):
+        """Return everything but the address a reload may change."""
+        return (self.name, self.klass, self.args, self.kwargs,
+                self.backlog, self.rate, self.port_rate,
+                self.max_connections, self.overflow, self.queue_timeout)
+
+    def get_targets(self):
+        """Return (class, args, kwargs) of all handlers it may use.
+
+        Handlers that pass connections on to other handlers (see
+        HTTPRouter) list those with a get_targets classmethod.
+        """
+        targets = self.choices
+        if targets is None:
+            targets = [(self.klass, self.args, self.kwargs)]
+        result = []
+        for klass, args, kwargs in targets:
+            result.append((klass, args, kwargs))
+            get_targets = getattr(klass, 'get_targets', None)
+            if get_targets is not None:
+                result.extend(get_targets(*args, **kwargs))
+        return result
+
+    def choose(self):
+        """Return (class, args, kwargs) of the handler for a connection.
+
+        Called in the server process, so the choices made for forked
+        children follow the seed too. Handler classes with a prespawn
+        classmethod get the keyword arguments it returns in addition,
+        sockets among them are closed in the server process once they
+        have been handed over to a child.
+        """
+        if self.choices is None:
+            klass, args, kwargs = self.klass, self.args, self.kwargs
+        else:
+            klass, args, kwargs = self.choices[self.alias.choose()]
+        prespawn = getattr(klass, 'prespawn', None)
+        if prespawn is not None:
+            kwargs = dict(kwargs, **prespawn(*args, **kwargs))
+        return klass, args, kwargs
+
+    def make_handler(self, conn, client_address, choice=None):
+        """Return a new handler instance for the accepted connection."""
+        klass, args, kwargs = choice or self.choose()
+        conn = throttle(conn, self.rate, self.port_bucket)
+        return klass(conn, client_address, *args, **kwargs)
+
+    def make_datagram_handler(self):
+        """Return the handler instance serving a datagram socket."""
+        return self.klass(*self.args, **self.kwargs)
 
 
 def _get_handler_configs(config):
@@ -177,17 +344,42 @@ def _get_handler_configs(config):
             continue
 
         clsname = config.get(section, 'class')
-        klass = _resolve(clsname)
+        klass = resolve(clsname)
         host = config.get(section, 'host')
         port = config.getint(section, 'port')
         args = ()
         if config.has_option(section, 'args'):
             args = eval(config.get(section, 'args'), {})
+        kwargs = {}
+        if config.has_option(section, 'kwargs'):
+            kwargs = eval(config.get(section, 'kwargs'), {})
         if config.has_option(section, 'family'):
             family = config.get(section, 'family')
         else:
             family = 'inet'
-        hconfig = HandlerConfig(klass, args, host, port, family)
+        backlog = None
+        if config.has_option(section, 'backlog'):
+            backlog = config.getint(section, 'backlog')
+        rate = port_rate = None
+        if config.has_option(section, 'rate'):
+            rate = parse_rate(config.get(section, 'rate'))
+        if config.has_option(section, 'port_rate'):
+            port_rate = parse_rate(config.get(section, 'port_rate'))
+        max_connections = overflow = queue_timeout = None
+        if config.has_option(section, 'max_connections'):
+            max_connections = config.getint(section, 'max_connections')
+        if config.has_option(section, 'overflow'):
+            overflow = config.get(section, 'overflow')
+        if config.has_option(section, 'queue_timeout'):
+            queue_timeout = config.getfloat(section, 'queue_timeout')
+        sock_type = 'stream'
+        if config.has_option(section, 'type'):
+            sock_type = config.get(section, 'type')
+        hconfig = HandlerConfig(
+            klass, args, host, port, family,
+            backlog=backlog, kwargs=kwargs, rate=rate, port_rate=port_rate,
+            name=section[len('handler:'):], max_connections=max_connections,
+            overflow=overflow, queue_timeout=queue_timeout, type=sock_type)
         configs.append(hconfig)
 
     return configs
@@ -198,10 +390,52 @@ class IOLoop(object):
 
     Spawns 'crafty' children to handle client requests.
     """
-    def __init__(self, handler_configs):
+    def __init__(self, handler_configs, reuse_port=False,
+                 backlog=BACKLOG, accept_batch=ACCEPT_BATCH,
+                 poller=DEFAULT_POLLER, log_transport='ring', worker=0,
+                 config_path=None, handle_signals=True,
+                 max_connections=None, overflow='backlog',
+                 queue_timeout=QUEUE_TIMEOUT, max_child_lifetime=None,
+                 drain_timeout=DRAIN_TIMEOUT):
         self.handler_configs = handler_configs
+        # the INI file re-read on SIGHUP
+        self.config_path = config_path
+        # signal handlers can only be set in the main thread, a loop
+        # running in another thread can't reap children
+        self.handle_signals = handle_signals
+        # number of the prefork worker, selects our rows of the metrics
+        self.worker = worker
+        # let several processes bind the same inet ports
+        self.reuse_port = reuse_port
+        self.backlog = backlog
+        self.accept_batch = accept_batch
+        self.poller_name = poller
         self.fd2config = {}
         self.poller = None
+        self.timers = TimerWheel()
+        # listen sockets whose accept queue wasn't drained in one batch
+        self.pending_accepts = set()
+        # cap of the connections of all handlers and the defaults of
+        # the handlers' caps
+        self.max_connections = max_connections
+        self.overflow = overflow
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.paused = set() # handler configs left in the backlog
+        # conn fd -> [config, conn, address, timer, started], oldest first
+        self.queue = collections.OrderedDict()
+        self.running_queue = False
+        self.children = ChildTable()
+        self.forked = 0 # children forked so far
+        # secs a child may live before it's terminated, None for no limit
+        self.max_child_lifetime = max_child_lifetime
+        self.drain_timeout = drain_timeout
+        self.log_transport = log_transport
+        self.log_ring = None
+        self.draining_logs = False
+        self.refreshing_payloads = False
+        self.stopped = False
+        self.waker = None # pipe that wakes the loop up to stop it
         self._setup()
 
     def _get_address(self, hconfig):
@@ -226,98 +460,963 @@ class IOLoop(object):
                 pass
 
     def _setup(self):
-        signal.signal(signal.SIGCHLD, _reap_children)
+        if self.handle_signals:
+            signal.signal(signal.SIGCHLD, _reap_children)
+            signal.signal(signal.SIGHUP, _request_reload)
 
-        self.poller = poller = select.poll()
+        self.poller = POLLERS[self.poller_name]()
+        self.waker = os.pipe()
+        for fd in self.waker:
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.poller.register(self.waker[0], READ)
+        self.listen_overflows = get_listen_overflows()
+
+        self._prepare(self.handler_configs)
+        self.metrics.reset(self.worker)
+        if self.log_transport == 'ring':
+            # children write their records here, must exist before forking
+            self.log_ring = LogRing()
+            self.child_logger = get_console_logger('children')
+        self._schedule_refresh()
 
         for config in self.handler_configs:
-            server = socket.socket(
-                self._get_family(config), socket.SOCK_STREAM)
-            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server.setblocking(0)
+            self._listen(config)
 
-            logger.info(
-                'Starting %-20r on port %s',
-                config.klass.__name__, config.port or config.host
-                )
+    def _prepare(self, handler_configs):
+        """Set up the shared state of handlers, before they're served."""
+        _prepare_handlers(handler_configs)
+        self.metrics = metrics.setup(handler_configs)
 
-            self.fd2config[server.fileno()] = config
+    def _listen(self, config):
+        """Open the listen socket of the handler."""
+        sock_type = socket.SOCK_STREAM
+        if config.type == 'dgram':
+            sock_type = socket.SOCK_DGRAM
+        server = socket.socket(self._get_family(config), sock_type)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port and config.family == 'inet':
+            server.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server.setblocking(0)
 
-            # this is only for Unix socket
-            self._unlink_file(config)
+        # this is only for Unix socket
+        self._unlink_file(config)
 
+        try:
             server.bind(self._get_address(config))
+            if config.type == 'stream':
+                server.listen(config.backlog or self.backlog)
+        except socket.error:
+            server.close()
+            raise
+
+        # save the listen socket for further use
+        config.socket = server
+        if config.type == 'dgram':
+            config.datagrams = get_datagram_socket(server)
+            config.handler = config.make_datagram_handler()
+        self.fd2config[server.fileno()] = config
 
-            server.listen(BACKLOG)
+        logger.info(
+            'Starting %-20r on port %s',
+            config.klass.__name__, self._get_port(config)
+            )
 
-            # save the listen socket for further use
-            config.socket = server
+        self.poller.register(server.fileno(), READ)
 
-            poller.register(server, READ_ONLY)
+    def _get_port(self, config):
+        """Return the bound port, the path of a Unix socket."""
+        if config.family == 'unix':
+            return config.host
+        return config.socket.getsockname()[1]
 
+    def get_ports(self):
+        """Return {handler name: bound port} of the handlers.
 
-    def run(self):
+        Handlers configured with port 0 listen on a port picked by the
+        kernel. Unix sockets have their paths instead.
+        """
+        return dict(
+            (config.name, self._get_port(config))
+            for config in self.handler_configs)
+
+    def stop(self):
+        """Stop the loop, safe to call from another thread."""
+        self.stopped = True
+        try:
+            os.write(self.waker[1], '\0')
+        except OSError as e:
+            if e.errno != errno.EAGAIN: # the loop is being woken already
+                raise
+
+    def _stop_listening(self, config):
+        """Close the listen socket of a removed handler.
+
+        Connections already in the accept queue are served first,
+        connections being served finish as usual.
+        """
+        logger.info(
+            'Stopping %-20r on port %s',
+            config.klass.__name__, config.port or config.host)
+        while self._accept(config):
+            pass
+        fd = config.socket.fileno()
+        if config in self.paused:
+            self.paused.discard(config)
+        else:
+            self.poller.unregister(fd)
+        del self.fd2config[fd]
+        self.pending_accepts.discard(config)
+        if config.datagrams is not None:
+            # delayed replies are dropped
+            config.datagrams.close()
+        config.socket.close()
+        self._unlink_file(config)
+
+    def _take_over(self, old, new):
+        """Let the changed handler config serve the old listen socket."""
+        logger.info(
+            'Reconfiguring %-20r on port %s',
+            new.klass.__name__, new.port or new.host)
+        new.socket = old.socket
+        self.fd2config[new.socket.fileno()] = new
+        if new.type == 'dgram':
+            new.datagrams = old.datagrams
+            new.handler = new.make_datagram_handler()
+            new.received, new.sent = old.received, old.sent
+        elif new.backlog != old.backlog:
+            new.socket.listen(new.backlog or self.backlog)
+        new.accepted = old.accepted
+        new.queue_full = old.queue_full
+        if old in self.pending_accepts:
+            self.pending_accepts.discard(old)
+            self.pending_accepts.add(new)
+        if old in self.paused:
+            # the new config counts its connections from zero
+            self.paused.discard(old)
+            self.poller.register(new.socket.fileno(), READ)
+            self.pending_accepts.add(new)
+
+    def reload(self):
+        """Re-read the configuration file and apply the differences.
+
+        Listen sockets of addresses still in use are kept, so clients
+        don't notice the reload. Connections being served finish with
+        the configuration they started with.
+        """
+        if self.config_path is None:
+            logger.warning('No configuration file to reload')
+            return
         try:
-            child_pids = []
+            configs = _get_handler_configs(_load_config(self.config_path))
+            # all of them, so metrics rows match those of other workers
+            self._prepare(configs)
+            if self.reuse_port and self.worker:
+                # served by the first prefork worker only
+                configs = [
+                    config for config in configs if config.family != 'unix'
+                    ]
+        except Exception:
+            logger.exception(
+                'Failed to reload %s, keeping the running configuration',
+                self.config_path)
+            return
+
+        running = dict(
+            (config.get_address(), config) for config in self.handler_configs)
+        handler_configs = []
+        for config in configs:
+            old = running.pop(config.get_address(), None)
+            if old is None:
+                try:
+                    self._listen(config)
+                except socket.error as e:
+                    logger.error(
+                        'Failed to start %r on port %s: %s',
+                        config.klass.__name__, config.port or config.host, e)
+                    continue
+            elif old.get_settings() == config.get_settings():
+                config = old
+            else:
+                self._take_over(old, config)
+            handler_configs.append(config)
+        for config in running.itervalues():
+            self._stop_listening(config)
+        self.handler_configs = handler_configs
+        self._schedule_refresh()
+        logger.info('Reloaded %s', self.config_path)
+
+    def _schedule_refresh(self):
+        if cache.payloads and not self.refreshing_payloads:
+            self.refreshing_payloads = True
+            self.timers.add(cache.CHECK_INTERVAL, self._refresh_payloads)
+
+    def _accept(self, handler_config):
+        """Drain the accept queue handing connections over to a handler.
+
+        Stops when the queue is empty or after accept_batch connections
+        to give other listen sockets a chance. Returns True in the latter
+        case, edge-triggered pollers won't report the socket again then.
+        """
+        if handler_config.type == 'dgram':
+            # nothing to accept, datagrams are served right away
+            return self._receive(handler_config)
+        # socket is ready to accept a connection
+        socket = handler_config.socket
+        self._check_overflow(handler_config)
+        for _ in xrange(self.accept_batch):
+            action = self._get_overflow(handler_config)
+            if action == 'backlog':
+                self._pause(handler_config)
+                return False
+            try:
+                conn, client_address = socket.accept()
+            except IOError as e:
+                code, msg = e.args
+                if code == errno.EINTR:
+                    continue
+                elif code in (errno.EAGAIN, errno.EWOULDBLOCK,
+                              errno.ECONNABORTED):
+                    return False
+                elif code in (errno.EMFILE, errno.ENFILE):
+                    logger.error('Out of file descriptors: %s', msg)
+                    return False
+                else:
+                    raise
+
+            handler_config.accepted += 1
+            self.metrics.accepted(self.worker, handler_config.index)
+            if action is not None:
+                self._overflow(action, handler_config, conn, client_address)
+                continue
+            self._acquire(handler_config)
+            self._spawn(handler_config, conn, client_address)
+
+        return True
+
+    def _receive(self, handler_config):
+        """Serve the datagrams waiting on the socket of a handler.
+
+        Stops after accept_batch batches, like _accept does.
+        """
+        datagrams = handler_config.datagrams
+        for _ in xrange(self.accept_batch):
+            received = datagrams.recv()
+            if not received:
+                return False
+            handler_config.received += len(received)
+            self.metrics.received(
+                self.worker, handler_config.index, received)
+            try:
+                replies = handler_config.handler.handle_datagrams(received)
+            except Exception:
+                logger.exception('Exception when handling datagrams')
+                continue
+            self._reply(handler_config, replies)
+        return True
+
+    def _reply(self, handler_config, replies):
+        """Send the replies now or when their delay is up.
+
+        Delayed replies due on the same tick of the timer wheel go out
+        in one batch.
+        """
+        now = []
+        later = {}
+        tick = self.timers.tick
+        for delay, data, address in replies:
+            if delay <= 0:
+                now.append((data, address))
+            else:
+                later.setdefault(int(delay / tick), []).append(
+                    (data, address))
+        if now:
+            self._send_datagrams(handler_config, now)
+        for ticks, datagrams in later.iteritems():
+            self.timers.add(
+                ticks * tick, functools.partial(
+                    self._send_datagrams, handler_config, datagrams))
+
+    def _send_datagrams(self, handler_config, datagrams):
+        sent = handler_config.datagrams.send(datagrams)
+        handler_config.sent += sent
+        if sent:
+            self.metrics.sent(
+                self.worker, handler_config.index, datagrams[:sent])
+
+    def _get_overflow(self, handler_config):
+        """Return the overflow action if a cap is reached, None if not."""
+        limit = handler_config.max_connections
+        if limit is not None and handler_config.active >= limit:
+            return handler_config.overflow or self.overflow
+        limit = self.max_connections
+        if limit is not None and self.active >= limit:
+            return self.overflow
+        return None
+
+    def _acquire(self, handler_config):
+        handler_config.active += 1
+        self.active += 1
+
+    def _release(self, handler_config):
+        """Account for a finished connection and let waiting ones in."""
+        handler_config.active -= 1
+        self.active -= 1
+        if self.queue:
+            self._run_queue()
+        if self.paused:
+            for config in list(self.paused):
+                if self._get_overflow(config) is None:
+                    self.paused.discard(config)
+                    self.poller.register(config.socket.fileno(), READ)
+                    # edge-triggered pollers won't report queued ones
+                    self.pending_accepts.add(config)
+
+    def _overflow(self, action, handler_config, conn, client_address):
+        """Deal with a connection accepted over a concurrency cap."""
+        limit = handler_config.backlog or self.backlog
+        if action == 'queue' and handler_config.queued < limit:
+            timeout = handler_config.queue_timeout
+            if timeout is None:
+                timeout = self.queue_timeout
+            fd = conn.fileno()
+            timer = self.timers.add(
+                timeout, functools.partial(self._expire_queued, fd))
+            handler_config.queued += 1
+            self.queue[fd] = [
+                handler_config, conn, client_address, timer, time.time()]
+        else:
+            self._shed(handler_config, conn, time.time())
+
+    def _shed(self, handler_config, conn, started):
+        handler_config.shed += 1
+        self.metrics.shed(self.worker, handler_config.index, started)
+        _reset(conn)
+
+    def _expire_queued(self, fd):
+        """Shed a connection that waited in the queue for too long."""
+        handler_config, conn, _, _, started = self.queue.pop(fd)
+        handler_config.queued -= 1
+        self._shed(handler_config, conn, started)
+
+    def _run_queue(self):
+        """Serve queued connections while there's room, oldest first."""
+        if self.running_queue:
+            # a handler that finished right away released its room from
+            # within _spawn, the loop below takes it
+            return
+        self.running_queue = True
+        try:
+            served = True
+            while served:
+                served = False
+                for fd, entry in self.queue.items():
+                    handler_config, conn, client_address, timer = entry[:4]
+                    if self._get_overflow(handler_config) is not None:
+                        if self.max_connections is not None and (
+                            self.active >= self.max_connections):
+                            break
+                        continue
+                    del self.queue[fd]
+                    self.timers.cancel(timer)
+                    handler_config.queued -= 1
+                    self._acquire(handler_config)
+                    self._spawn(handler_config, conn, client_address)
+                    served = True
+        finally:
+            self.running_queue = False
+
+    def _pause(self, handler_config):
+        """Leave new connections in the kernel's backlog for now."""
+        if handler_config not in self.paused:
+            self.paused.add(handler_config)
+            self.poller.unregister(handler_config.socket.fileno())
+        self.pending_accepts.discard(handler_config)
+
+    def _check_overflow(self, handler_config):
+        """Count wakeups that find the accept queue full.
+
+        The kernel drops (or resets) new connections while the queue
+        is full, so clients see failures Cynic never meant to inject.
+        """
+        queue = get_accept_queue(handler_config.socket)
+        if queue is None:
+            return
+        length, limit = queue
+        if length < limit:
+            return
+        handler_config.queue_full += 1
+        now = time.time()
+        if now - handler_config.last_overflow_log >= OVERFLOW_LOG_INTERVAL:
+            handler_config.last_overflow_log = now
+            logger.warning(
+                'Accept queue of %r on port %s is full (%d), '
+                'connections are being dropped. Consider a bigger backlog',
+                handler_config.klass.__name__, handler_config.port, limit)
+
+    def _report(self):
+        """Log accept statistics."""
+        for config in self.handler_configs:
+            if config.type == 'dgram':
+                logger.info(
+                    '%-20r received %d datagrams, sent %d datagrams',
+                    config.klass.__name__, config.received, config.sent)
+                continue
+            logger.info(
+                '%-20r accepted %d connections, accept queue was full '
+                '%d times, shed %d connections',
+                config.klass.__name__, config.accepted, config.queue_full,
+                config.shed)
+        overflows = get_listen_overflows()
+        if overflows is not None and self.listen_overflows is not None:
+            logger.info(
+                'Listen queue overflows (system wide): %d',
+                overflows - self.listen_overflows)
+        if self.log_ring is not None:
+            dropped = self.log_ring.dropped + sum(
+                self.log_ring.get_dropped(lane)
+                for lane in self.log_ring.active)
+            logger.info('Log records dropped by children: %d', dropped)
+        children = self.children
+        if children.reaped:
+            logger.info(
+                'Children exited: %d (%s), crashed %d, terminated over the '
+                'max lifetime %d, lifetime mean %.3f secs, max %.3f secs',
+                children.reaped,
+                ', '.join('%s: %d' % item
+                          for item in sorted(children.statuses.items())),
+                children.crashed, children.expired,
+                children.mean_lifetime(), children.max_lifetime)
+
+    def _spawn(self, handler_config, conn, client_address, choice=None):
+        """Spawn a child that will handle the request (connection)."""
+        if choice is None:
+            choice = handler_config.choose()
+        lane = None
+        if self.log_ring is not None:
+            # without a free lane the child falls back to the log socket
+            lane = self.log_ring.acquire()
+        slot = self.metrics.acquire_slot(self.worker)
+        self.forked += 1
+        pid = os.fork()
+        if pid == 0: # child
+            self._close_inherited()
+            distributions.set_stream(self.worker, self.forked)
+            if lane is not None:
+                set_log_lane(self.log_ring, lane)
+            # run a handler
+            klass = choice[0]
+            handler = handler_config.make_handler(
+                conn, client_address, choice)
+            try:
+                handler.handle()
+            except KeyboardInterrupt:
+                pass
+            except:
+                log = get_console_logger(klass.__name__)
+                log.exception('Exception when handling a request')
+            if slot is not None:
+                self.metrics.report(self.worker, slot, conn)
+            # off we go
+            os._exit(0)
+        else:
+            # this is parent
+            for value in choice[2].itervalues():
+                if isinstance(value, socket.socket):
+                    value.close()
+            child = self.children.add(pid, handler_config, slot, lane)
+            if self.max_child_lifetime is not None:
+                child.timer = self.timers.add(
+                    self.max_child_lifetime,
+                    functools.partial(self._expire_child, pid))
+            if lane is not None:
+                self.log_ring.set_owner(lane, pid)
+                if not self.draining_logs:
+                    self.draining_logs = True
+                    self.timers.add(LOG_DRAIN_INTERVAL, self._drain_logs)
+            # close unused connected socket
+            conn.close()
+
+    def _refresh_payloads(self):
+        """Pick up changed payload files for the children to come."""
+        cache.payloads.refresh()
+        self.refreshing_payloads = False
+        self._schedule_refresh()
+
+    def _log_records(self, records):
+        for record in records:
+            # handled by a logger of our own: loggers named after the
+            # handlers must stay without handlers for the children to come
+            self.child_logger.handle(record)
+
+    def _drain_logs(self):
+        """Output the records children have written into the log ring."""
+        self._log_records(self.log_ring.read_all())
+        if self.log_ring.active:
+            self.timers.add(LOG_DRAIN_INTERVAL, self._drain_logs)
+        else:
+            self.draining_logs = False
+
+    def _collect_children(self):
+        """Release resources of the children reaped since the last call."""
+        while _reaped:
+            pid, status = _reaped.popleft()
+            child = self.children.remove(pid, status)
+            if child is None:
+                continue
+            if status and not child.signalled:
+                logger.warning(
+                    'Child %d of %r %s after %.3f secs', pid,
+                    child.config.name, describe_status(status),
+                    time.time() - child.started)
+            if child.timer is not None:
+                self.timers.cancel(child.timer)
+            config = child.config
+            self._release(config)
+            sent = received = 0
+            if child.slot is not None:
+                sent, received = self.metrics.release_slot(
+                    self.worker, child.slot)
+            self.metrics.closed(
+                self.worker, config.index, child.started, sent, received)
+            if child.lane is not None:
+                self._log_records(self.log_ring.release(child.lane))
+
+    def _wait_children(self, block=False):
+        """Reap our children without waiting for SIGCHLD.
+
+        Only our own pids are waited for, the process may have
+        children of its own when it embeds the server.
+        """
+        options = 0 if block else os.WNOHANG
+        for pid in self.children:
             while True:
                 try:
-                    events = self.poller.poll(POLL_TIMEOUT)
-                except select.error as e:
-                    code, msg = e.args
-                    if code == errno.EINTR:
+                    reaped, status = os.waitpid(pid, options)
+                except OSError as e:
+                    if e.errno == errno.EINTR:
                         continue
-                    else:
-                        raise
+                    # ECHILD, the SIGCHLD handler has reaped it already
+                    break
+                if reaped:
+                    _reaped.append((reaped, status))
+                break
+
+    def _expire_child(self, pid):
+        """Terminate a child that outlived max_child_lifetime.
+
+        The child is killed if it's still there drain_timeout secs later.
+        """
+        child = self.children.get(pid)
+        if child is None:
+            return
+        child.timer = None
+        if child.signalled:
+            self.children.signal(pid, signal.SIGKILL)
+            return
+        logger.info(
+            'Child %d of %r outlived %s secs, terminating',
+            pid, child.config.name, self.max_child_lifetime)
+        self.children.expired += 1
+        if self.children.signal(pid, signal.SIGTERM):
+            child.timer = self.timers.add(
+                self.drain_timeout, functools.partial(self._expire_child, pid))
+
+    def _drain_children(self):
+        """Terminate the children and wait for them to exit.
+
+        Children still running after drain_timeout secs are killed.
+        """
+        children = self.children
+        for pid in children:
+            children.signal(pid, signal.SIGTERM)
+        deadline = time.time() + self.drain_timeout
+        while True:
+            self._wait_children()
+            self._collect_children()
+            if not children or time.time() >= deadline:
+                break
+            time.sleep(DRAIN_POLL_INTERVAL)
+        if not children:
+            return
+        logger.warning(
+            'Killing %d children still running after %s secs',
+            len(children), self.drain_timeout)
+        for pid in children:
+            children.signal(pid, signal.SIGKILL)
+        self._wait_children(block=True)
+        self._collect_children()
+
+    def _close_inherited(self):
+        """Close the parent's sockets in a freshly forked child."""
+        for config in self.fd2config.values():
+            config.socket.close()
+        for fd in self.waker:
+            os.close(fd)
+        for entry in self.queue.itervalues():
+            entry[1].close()
+        # and whatever else handlers keep open in the server process
+        closed = set()
+        for config in self.handler_configs:
+            for klass, args, kwargs in config.get_targets():
+                close_inherited = getattr(klass, 'close_inherited', None)
+                if close_inherited is not None and klass not in closed:
+                    closed.add(klass)
+                    close_inherited()
+
+    def _shutdown(self):
+        # nothing waiting is let in while the children drain
+        self.paused.clear()
+        for entry in self.queue.itervalues():
+            entry[1].close()
+        self.queue.clear()
+        self._drain_children()
+        if self.log_ring is not None:
+            self._log_records(self.log_ring.read_all())
+        self._report()
+        # the process may go on, e.g. a test suite that embeds the server
+        for config in self.fd2config.values():
+            config.socket.close()
+            self._unlink_file(config)
+        self.fd2config.clear()
+        for fd in self.waker:
+            os.close(fd)
+        self.poller.close()
 
+    def _get_timeout(self):
+        """Return secs to wait for events, None to wait for the first one.
+
+        The wait is driven by the next timer deadline, there's no
+        periodic wakeup.
+        """
+        if self.pending_accepts:
+            return 0
+        deadline = self.timers.next_deadline()
+        if deadline is None:
+            return None
+        return max(0, deadline - time.time())
+
+    def _handle_event(self, fd, flag):
+        if fd == self.waker[0]:
+            self._drain_waker()
+            return
+        # retrieve the actual socket and handler class
+        # from its file descriptor
+        handler_config = self.fd2config.get(fd)
+        # we're interested only in READ events
+        if handler_config is not None and flag & READ:
+            if self._accept(handler_config):
+                self.pending_accepts.add(handler_config)
+
+    def _drain_waker(self):
+        try:
+            while os.read(self.waker[0], 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _run_pending_accepts(self):
+        pending, self.pending_accepts = self.pending_accepts, set()
+        for handler_config in pending:
+            if self._accept(handler_config):
+                self.pending_accepts.add(handler_config)
+
+    def _run_timers(self):
+        for callback in self.timers.expire():
+            callback()
+
+    def run(self):
+        try:
+            while not self.stopped:
+                events = self.poller.poll(self._get_timeout())
+                self._collect_children()
+                if _reload_requests and self.handle_signals:
+                    _reload_requests.clear()
+                    self.reload()
+                self._run_pending_accepts()
                 for fd, flag in events:
-                    # we're interested only in READ events
-                    if not flag & READ_ONLY:
+                    self._handle_event(fd, flag)
+                self._run_timers()
+        except KeyboardInterrupt:
+            pass
+        self._shutdown()
+
+
+class AsyncIOLoop(IOLoop):
+    """Non-forking IO loop.
+
+    Serves connections as cooperative tasks (see cynic.tasks) in a single
+    process. Handlers without ``handle_async`` or with ``ISOLATED`` set
+    are still served in forked children.
+    """
+    def __init__(self, handler_configs, **kwargs):
+        self.tasks = set()
+        self.waiting = {} # fd -> task waiting for IO on it
+        # task -> ({fd: socket}, timer) of tasks waiting on several sockets
+        self.selecting = {}
+        IOLoop.__init__(self, handler_configs, **kwargs)
+
+    def _prepare(self, handler_configs):
+        IOLoop._prepare(self, handler_configs)
+        # handlers log right to the console as they live in this process
+        for config in handler_configs:
+            for klass, args, kwargs in config.get_targets():
+                name = klass.LOGGER_NAME
+                if not logging.getLogger(name).handlers:
+                    get_console_logger(name)
+
+    def _spawn(self, handler_config, conn, client_address):
+        choice = handler_config.choose()
+        klass = choice[0]
+        if (getattr(klass, 'ISOLATED', False) or
+            not hasattr(klass, 'handle_async')):
+            IOLoop._spawn(self, handler_config, conn, client_address, choice)
+            return
+
+        conn.setblocking(0)
+        started = time.time()
+        try:
+            handler = handler_config.make_handler(
+                conn, client_address, choice)
+            gen = handler.handle_async()
+        except Exception:
+            logger.exception('Exception when handling a request')
+            gen = None
+
+        if gen is None: # handler has finished already
+            self.metrics.connection_closed(
+                self.worker, handler_config.index, started, conn)
+            conn.close()
+            self._release(handler_config)
+            return
+
+        task = tasks.Task(gen, conn, (handler_config, started))
+        self.tasks.add(task)
+        self._step(task)
+
+    def _step(self, task, value=None):
+        """Resume the task and act on the request it yields."""
+        try:
+            request = task.step(value)
+        except Exception:
+            logger.exception('Exception when handling a request')
+            request = None
+
+        if request is None:
+            self.tasks.discard(task)
+            config, started = task.context
+            self.metrics.connection_closed(
+                self.worker, config.index, started, task.connection)
+            task.connection.close()
+            self._release(config)
+        elif isinstance(request, tasks.Sleep):
+            self.timers.add(request.seconds, task)
+        elif isinstance(request, tasks.ReadWait):
+            self._wait(task, request.sock, READ)
+        elif isinstance(request, tasks.WriteWait):
+            self._wait(task, request.sock, WRITE)
+        elif isinstance(request, tasks.Select):
+            self._select(task, request)
+        else:
+            raise TypeError('Unknown task request %r' % request)
+
+    def _wait(self, task, sock, eventmask):
+        fd = sock.fileno()
+        self.waiting[fd] = task
+        self.poller.register(fd, eventmask)
+
+    def _select(self, task, request):
+        masks = {}
+        socks = {}
+        for sock in request.readers:
+            fd = sock.fileno()
+            masks[fd] = masks.get(fd, 0) | READ
+            socks[fd] = sock
+        for sock in request.writers:
+            fd = sock.fileno()
+            masks[fd] = masks.get(fd, 0) | WRITE
+            socks[fd] = sock
+        for fd, eventmask in masks.iteritems():
+            self.waiting[fd] = task
+            self.poller.register(fd, eventmask)
+        timer = None
+        if request.timeout is not None:
+            timer = self.timers.add(request.timeout, task)
+        self.selecting[task] = (socks, timer)
+
+    def _end_select(self, task):
+        """Stop waiting for the rest of the task's sockets."""
+        socks, timer = self.selecting.pop(task)
+        for fd in socks:
+            if self.waiting.pop(fd, None) is not None:
+                self.poller.unregister(fd)
+        if timer is not None:
+            self.timers.cancel(timer)
+        return socks
+
+    def _handle_event(self, fd, flag):
+        if fd in self.fd2config or fd == self.waker[0]:
+            IOLoop._handle_event(self, fd, flag)
+            return
+
+        # connection is ready (or failed), resume its task
+        task = self.waiting.pop(fd, None)
+        if task is not None:
+            self.poller.unregister(fd)
+            if task in self.selecting:
+                socks = self._end_select(task)
+                self._step(task, [socks[fd]])
+            else:
+                self._step(task)
+
+    def _run_timers(self):
+        for value in self.timers.expire():
+            if isinstance(value, tasks.Task):
+                if value in self.selecting: # timed out
+                    self._end_select(value)
+                    self._step(value, [])
+                else:
+                    self._step(value)
+            else:
+                value()
+
+    def _close_inherited(self):
+        IOLoop._close_inherited(self)
+        for task in self.tasks:
+            task.connection.close()
+
+    def _shutdown(self):
+        IOLoop._shutdown(self)
+        for task in self.tasks:
+            task.connection.close()
+
+
+class PreforkServer(object):
+    """Supervisor of long-lived worker processes.
+
+    Every worker runs its own IO loop and binds the inet handler ports
+    with SO_REUSEPORT, so the kernel spreads incoming connections between
+    the workers and each of them accepts on its own. Unix sockets can't
+    be shared that way and are served by the first worker only.
+
+    The supervisor itself doesn't serve anything, it only respawns
+    workers that exit.
+    """
+    # don't respawn a crashing worker more often than that (secs)
+    RESPAWN_DELAY = 1
+
+    def __init__(self, handler_configs, engine=IOLoop, workers=None,
+                 **loop_options):
+        self.handler_configs = handler_configs
+        self.engine = engine
+        self.workers = workers or multiprocessing.cpu_count()
+        # passed on to the engine of every worker
+        self.loop_options = loop_options
+        self.worker_pids = {} # pid -> (worker number, start time)
+
+    def _spawn_worker(self, number):
+        pid = os.fork()
+        if pid == 0: # worker
+            distributions.set_stream(number)
+            configs = [
+                config for config in self.handler_configs
+                if config.family != 'unix' or number == 0
+                ]
+            try:
+                ioloop = self.engine(
+                    configs, reuse_port=True, worker=number,
+                    **self.loop_options)
+                ioloop.run()
+            except KeyboardInterrupt:
+                pass
+            except:
+                logger.exception('Worker %d failed', number)
+                os._exit(1)
+            os._exit(0)
+        else:
+            self.worker_pids[pid] = (number, time.time())
+            logger.info('Started worker %d (pid %d)', number, pid)
+
+    def _shutdown(self):
+        for pid in self.worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in self.worker_pids:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+    def reload(self):
+        """Re-read the configuration for the workers to come.
+
+        Running workers are sent SIGHUP to reload it themselves.
+        """
+        path = self.loop_options.get('config_path')
+        if path is None:
+            logger.warning('No configuration file to reload')
+            return
+        try:
+            configs = _get_handler_configs(_load_config(path))
+            _prepare_handlers(configs)
+            metrics.setup(configs, self.workers)
+        except Exception:
+            logger.exception(
+                'Failed to reload %s, keeping the running configuration',
+                path)
+            return
+        self.handler_configs = configs
+        for pid in self.worker_pids:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except OSError:
+                pass
+
+    def run(self):
+        logger.info('Starting %d workers', self.workers)
+        # map payloads once, workers inherit the mappings
+        _prepare_handlers(self.handler_configs)
+        # workers share the counters
+        metrics.setup(self.handler_configs, self.workers)
+        # stop the whole pool when the supervisor is terminated
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        signal.signal(signal.SIGHUP, _request_reload)
+        try:
+            for number in range(self.workers):
+                self._spawn_worker(number)
+
+            while True:
+                if _reload_requests:
+                    _reload_requests.clear()
+                    self.reload()
+                try:
+                    pid, status = os.wait()
+                except OSError as e:
+                    if e.errno == errno.EINTR:
                         continue
+                    raise
 
-                    # retrieve the actual socket and handler class
-                    # from its file descriptor
-                    handler_config = self.fd2config[fd]
-
-                    # socket is ready to accept a connection
-                    socket = handler_config.socket
-                    try:
-                        conn, client_address = socket.accept()
-                    except IOError as e:
-                        code, msg = e.args
-                        if code == errno.EINTR:
-                            continue
-                        else:
-                            raise
-
-                    # spawn a child that will handle the request (connection)
-                    pid = os.fork()
-                    if pid == 0: # child
-                        for config in self.fd2config.values():
-                            config.socket.close()
-                        # run a handler
-                        klass = handler_config.klass
-                        handler = klass(
-                            conn, client_address, *handler_config.args)
-                        try:
-                            handler.handle()
-                        except KeyboardInterrupt:
-                            pass
-                        except:
-                            log = get_console_logger(klass.__name__)
-                            log.exception('Exception when handling a request')
-                        # off we go
-                        os._exit(0)
-                    else:
-                        # this is parent
-                        child_pids.append(pid)
-                        # close unused connected socket
-                        conn.close()
+                if pid not in self.worker_pids:
+                    continue
+                number, started = self.worker_pids.pop(pid)
+                logger.warning(
+                    'Worker %d (pid %d) exited (%s)',
+                    number, pid, describe_status(status))
+                if time.time() - started < self.RESPAWN_DELAY:
+                    time.sleep(self.RESPAWN_DELAY)
+                self._spawn_worker(number)
         except KeyboardInterrupt:
-            for pid in child_pids:
-                try:
-                    os.kill(pid, signal.SIGTERM)
-                except:
-                    pass
+            self._shutdown()
+
+
+ENGINES = {
+    'fork': IOLoop,
+    'async': AsyncIOLoop,
+    }
 
 
 def main():
@@ -335,6 +1434,114 @@ def main():
         '-d', '--dump', dest='dump', action='store_true',
         default=False, help='Dump default configuration to STDOUT'
         )
+    parser.add_option(
+        '-e', '--engine', dest='engine', type='choice',
+        choices=sorted(ENGINES), default='fork',
+        help=(
+            'Event loop engine: "fork" serves every connection in a forked '
+            'child process, "async" serves connections as coroutines in '
+            'one process. Default is "fork".'
+            )
+        )
+    parser.add_option(
+        '-p', '--prefork', dest='prefork', action='store_true',
+        default=False,
+        help=(
+            'Run a pool of long-lived worker processes, each accepting '
+            'connections on its own with SO_REUSEPORT listen sockets'
+            )
+        )
+    parser.add_option(
+        '-w', '--workers', dest='workers', type='int',
+        help=(
+            'Number of worker processes in the prefork mode. '
+            'Default is the number of CPU cores.'
+            )
+        )
+    parser.add_option(
+        '--payload-cache', dest='payload_cache', type='int',
+        default=cache.CACHE_SIZE // (1024 * 1024),
+        help=(
+            'Maximum total size in megabytes of the memory-mapped payload '
+            'files (handler "args" data files). Default is %d.'
+            % (cache.CACHE_SIZE // (1024 * 1024))
+            )
+        )
+    parser.add_option(
+        '--poller', dest='poller', type='choice',
+        choices=sorted(POLLERS), default=DEFAULT_POLLER,
+        help=(
+            'Readiness notification backend of the IO loop: %s. '
+            'Default is "%s".' % (', '.join(sorted(POLLERS)), DEFAULT_POLLER)
+            )
+        )
+    parser.add_option(
+        '-b', '--backlog', dest='backlog', type='int', default=BACKLOG,
+        help=(
+            'Listen backlog for handlers that do not set the "backlog" '
+            'option in their section. Default is %d.' % BACKLOG
+            )
+        )
+    parser.add_option(
+        '--log-transport', dest='log_transport', type='choice',
+        choices=LOG_TRANSPORTS, default='ring',
+        help=(
+            'How children pass log records to the parent: "ring" writes '
+            'them into shared memory the parent reads, "socket" sends them '
+            'to the "unixlog" handler. Default is "ring".'
+            )
+        )
+    parser.add_option(
+        '--max-connections', dest='max_connections', type='int',
+        help=(
+            'Maximum number of connections served at once by all handlers '
+            '(per worker in the prefork mode). Handlers set their own cap '
+            'with the "max_connections" option. No limit by default.'
+            )
+        )
+    parser.add_option(
+        '--overflow', dest='overflow', type='choice',
+        choices=OVERFLOW_ACTIONS, default='backlog',
+        help=(
+            'What happens to connections over a cap: "backlog" leaves them '
+            'in the listen backlog, "reset" accepts and resets them, '
+            '"queue" accepts them and serves them when there is room or '
+            'resets them after --queue-timeout. Handlers set their own '
+            'with the "overflow" option. Default is "backlog".'
+            )
+        )
+    parser.add_option(
+        '--queue-timeout', dest='queue_timeout', type='float',
+        default=QUEUE_TIMEOUT,
+        help=(
+            'Seconds a connection may wait in the "queue" overflow. '
+            'Default is %d.' % QUEUE_TIMEOUT
+            )
+        )
+    parser.add_option(
+        '--max-child-lifetime', dest='max_child_lifetime', type='float',
+        help=(
+            'Seconds a forked child may serve its connection before it is '
+            'terminated. No limit by default.'
+            )
+        )
+    parser.add_option(
+        '--drain-timeout', dest='drain_timeout', type='float',
+        default=DRAIN_TIMEOUT,
+        help=(
+            'Seconds children have to exit after SIGTERM, on shutdown or '
+            'over --max-child-lifetime, before they are killed with '
+            'SIGKILL. Default is %d.' % DRAIN_TIMEOUT
+            )
+        )
+    parser.add_option(
+        '--accept-batch', dest='accept_batch', type='int',
+        default=ACCEPT_BATCH,
+        help=(
+            'Maximum number of connections accepted from one listen socket '
+            'per loop iteration. Default is %d.' % ACCEPT_BATCH
+            )
+        )
 
     options, args = parser.parse_args()
 
@@ -346,8 +1553,26 @@ def main():
     if path is None:
         path = StringIO.StringIO(DEFAULT_CONFIG)
 
+    cache.payloads.max_size = options.payload_cache * 1024 * 1024
+
     config = _load_config(path)
     handlers = _get_handler_configs(config)
-    ioloop = IOLoop(handlers)
-    ioloop.run()
-
+    engine = ENGINES[options.engine]
+    loop_options = dict(
+        backlog=options.backlog,
+        accept_batch=options.accept_batch,
+        poller=options.poller,
+        log_transport=options.log_transport,
+        config_path=options.config_path,
+        max_connections=options.max_connections,
+        overflow=options.overflow,
+        queue_timeout=options.queue_timeout,
+        max_child_lifetime=options.max_child_lifetime,
+        drain_timeout=options.drain_timeout,
+        )
+    if options.prefork:
+        server = PreforkServer(
+            handlers, engine, options.workers, **loop_options)
+    else:
+        server = engine(handlers, **loop_options)
+    server.run()
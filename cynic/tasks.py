@@ -0,0 +1,374 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+"""Cooperative tasks.
+
+A handler's ``handle_async`` method is a generator that yields
+requests (``Sleep``, ``ReadWait``, ``WriteWait``, ``Select``) or nested
+generators.
+The non-forking engine multiplexes many such tasks in one process and
+a forked child simply drives a single task to completion with ``run``.
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import os
+import sys
+import mmap
+import time
+import errno
+import select
+import socket
+import types
+# raised by non-blocking TLS sockets instead of EAGAIN, a read may have
+# to wait for the socket to become writable and the other way round
+from ssl import SSLWantReadError, SSLWantWriteError
+
+from cynic import utils
+from cynic.throttle import Throttled
+
+WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+PEER_GONE = (errno.EPIPE, errno.ECONNRESET)
+
+
+class Return(Exception):
+    """Raised by a nested generator to pass a value to its caller."""
+
+    def __init__(self, value=None):
+        Exception.__init__(self)
+        self.value = value
+
+
+class Sleep(object):
+    """Suspend the task for the given number of seconds."""
+
+    __slots__ = ('seconds',)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class ReadWait(object):
+    """Suspend the task until the socket becomes readable."""
+
+    __slots__ = ('sock',)
+
+    def __init__(self, sock):
+        self.sock = sock
+
+
+class WriteWait(object):
+    """Suspend the task until the socket becomes writable."""
+
+    __slots__ = ('sock',)
+
+    def __init__(self, sock):
+        self.sock = sock
+
+
+class Select(object):
+    """Suspend the task until any of the sockets is ready or timeout.
+
+    The task is resumed with the list of ready sockets, which is empty
+    if the timeout (secs, None waits forever) expired.
+    """
+
+    __slots__ = ('readers', 'writers', 'timeout')
+
+    def __init__(self, readers=(), writers=(), timeout=None):
+        self.readers = readers
+        self.writers = writers
+        self.timeout = timeout
+
+
+class Task(object):
+    """Trampoline that runs a stack of nested generators."""
+
+    # keep a suspended connection cheap, there may be tens of thousands
+    __slots__ = ('stack', 'connection', 'context')
+
+    def __init__(self, gen, connection=None, context=None):
+        self.stack = [gen]
+        self.connection = connection
+        self.context = context # the engine's bookkeeping
+
+    def step(self, value=None):
+        """Run the task until it yields a request.
+
+        Returns the request or None when the task is finished.
+        Exceptions not handled by the task propagate to the caller.
+        """
+        exc_info = None
+        stack = self.stack
+        while stack:
+            gen = stack[-1]
+            try:
+                if exc_info is not None:
+                    request = gen.throw(*exc_info)
+                else:
+                    request = gen.send(value)
+            except Return as e:
+                stack.pop()
+                value, exc_info = e.value, None
+                continue
+            except StopIteration:
+                stack.pop()
+                value, exc_info = None, None
+                continue
+            except Exception:
+                stack.pop()
+                if not stack:
+                    raise
+                value, exc_info = None, sys.exc_info()
+                continue
+
+            exc_info = None
+            if request is None:
+                # allows 'yield handler_method()' that may not be a generator
+                value = None
+                continue
+            if isinstance(request, types.GeneratorType):
+                stack.append(request)
+                value = None
+                continue
+
+            return request
+
+        return None
+
+
+def run(gen):
+    """Drive a task to completion blocking the calling process.
+
+    Used by forked children where there is nothing else to multiplex.
+    ``gen`` may also be None for handlers that finished synchronously.
+    """
+    if gen is None:
+        return
+    task = Task(gen)
+    request = task.step()
+    while request is not None:
+        value = None
+        if isinstance(request, Sleep):
+            time.sleep(request.seconds)
+        elif isinstance(request, ReadWait):
+            select.select([request.sock], [], [])
+        elif isinstance(request, WriteWait):
+            select.select([], [request.sock], [])
+        elif isinstance(request, Select):
+            value = _select(request)
+        request = task.step(value)
+
+
+def _select(request):
+    while True:
+        try:
+            readable, writable, _ = select.select(
+                request.readers, request.writers, [], request.timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        return readable + writable
+
+
+def sendall(sock, data):
+    """Send all data yielding to other tasks when the socket is full."""
+    view = buffer(data)
+    while view:
+        try:
+            sent = sock.send(view)
+        except Throttled as e:
+            yield Sleep(e.delay)
+            continue
+        except SSLWantReadError:
+            yield ReadWait(sock)
+            continue
+        except SSLWantWriteError:
+            yield WriteWait(sock)
+            continue
+        except socket.error as e:
+            if e.args[0] in WOULD_BLOCK:
+                yield WriteWait(sock)
+                continue
+            raise
+        view = buffer(view, sent)
+
+
+def is_tls(sock):
+    """True for TLS sockets, throttled or not."""
+    return getattr(sock, '_sslobj', None) is not None
+
+
+def pending(sock):
+    """Return the number of bytes TLS has decrypted but not returned."""
+    if is_tls(sock):
+        return sock.pending()
+    return 0
+
+
+def sendfile(sock, fileobj, offset, count):
+    """Send count bytes of the file starting at offset.
+
+    Uses zero-copy sendfile(2) where available and falls back to sending
+    a memory map of the file. Returns the number of bytes sent, which is
+    less than count if the peer has gone away.
+    """
+    # TLS has to encrypt the data in the process
+    if utils.sendfile is None or is_tls(sock):
+        data = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        yield sendall(sock, buffer(data, offset, count))
+        raise Return(count)
+
+    out_fd = sock.fileno()
+    in_fd = fileobj.fileno()
+    limiter = getattr(sock, 'limiter', None)
+    sent = 0
+    while sent < count:
+        size = count - sent
+        if limiter is not None:
+            try:
+                size = limiter.grant(size)
+            except Throttled as e:
+                yield Sleep(e.delay)
+                continue
+        try:
+            n = utils.sendfile(out_fd, in_fd, offset + sent, size)
+        except (OSError, IOError) as e:
+            n = 0
+            if e.errno in WOULD_BLOCK:
+                yield WriteWait(sock)
+            elif e.errno == errno.EINTR:
+                pass
+            elif e.errno in PEER_GONE:
+                break
+            else:
+                raise
+        else:
+            if n == 0: # the file got truncated
+                break
+            sent += n
+        finally:
+            if limiter is not None and n < size:
+                limiter.refund(size - n)
+    raise Return(sent)
+
+
+def connect(sock, address):
+    """Connect the socket yielding until the connection is established."""
+    code = sock.connect_ex(address)
+    if code in (errno.EINPROGRESS, errno.EALREADY) + WOULD_BLOCK:
+        yield WriteWait(sock)
+        code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    if code not in (0, errno.EISCONN):
+        raise socket.error(code, os.strerror(code))
+
+
+def recv(sock, bufsize):
+    """Receive up to bufsize bytes yielding until some data arrive."""
+    while True:
+        try:
+            data = sock.recv(bufsize)
+        except SSLWantReadError:
+            yield ReadWait(sock)
+            continue
+        except SSLWantWriteError:
+            yield WriteWait(sock)
+            continue
+        except socket.error as e:
+            if e.args[0] in WOULD_BLOCK:
+                yield ReadWait(sock)
+                continue
+            raise
+        raise Return(data)
+
+
+def recv_exactly(sock, size):
+    """Receive exactly size bytes, less only if the peer closed."""
+    chunks = []
+    left = size
+    while left:
+        data = yield recv(sock, left)
+        if not data:
+            break
+        chunks.append(data)
+        left -= len(data)
+    raise Return(''.join(chunks))
+
+
+def recv_all(sock, bufsize=65536):
+    """Receive until the peer closes the connection."""
+    chunks = []
+    while True:
+        data = yield recv(sock, bufsize)
+        if not data:
+            break
+        chunks.append(data)
+    raise Return(''.join(chunks))
+
+
+class SocketWriter(object):
+    """File-like object that buffers writes to a socket.
+
+    Stands in for the ``wfile`` of HTTP handlers. ``write`` never blocks,
+    ``drain`` is a generator that sends the buffered data.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = []
+
+    def write(self, data):
+        self.buffer.append(data)
+
+    def flush(self):
+        """Send as much of the buffered data as possible without waiting.
+
+        On a blocking socket everything is sent, just like the regular
+        file object returned by socket.makefile.
+        """
+        while self.buffer:
+            data = self.buffer[0]
+            try:
+                sent = self.sock.send(data)
+            except (Throttled, SSLWantReadError, SSLWantWriteError):
+                return
+            except socket.error as e:
+                if e.args[0] in WOULD_BLOCK:
+                    return
+                raise
+            if sent < len(data):
+                self.buffer[0] = buffer(data, sent)
+            else:
+                self.buffer.pop(0)
+
+    def drain(self):
+        """Send all the buffered data."""
+        while self.buffer:
+            data = self.buffer.pop(0)
+            yield sendall(self.sock, data)
+
+    def close(self):
+        pass
+
@@ -0,0 +1,147 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import unittest
+
+from cynic.embed import EmbeddedServer
+from cynic.tests import connect, read_all
+
+JSON = 'cynic.handlers.httpjson.HTTPJsonResponse'
+GET = 'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+
+def chunked(*chunks):
+    body = ''.join('%x\r\n%s\r\n' % (len(chunk), chunk) for chunk in chunks)
+    return (
+        'POST / HTTP/1.1\r\nHost: localhost\r\n'
+        'Transfer-Encoding: chunked\r\n\r\n' + body + '0\r\n\r\n')
+
+
+class KeepAliveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmbeddedServer({
+            'json': {'class': JSON, 'kwargs': {'max_requests': 3}},
+            'get': {'class': JSON, 'kwargs': {'max_requests': None}},
+            })
+        self.ports = self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def request(self, data, port='json'):
+        sock = connect(self.ports[port])
+        sock.sendall(data)
+        return read_all(sock)
+
+    def test_pipelined(self):
+        response = self.request(GET * 3)
+        self.assertEqual(response.count('HTTP/1.1 200 OK'), 3)
+        # the last one tells the client the connection ends
+        self.assertEqual(response.count('Connection: close'), 1)
+        self.assertTrue(response.rstrip().endswith('}'))
+
+    def test_pipelined_in_pieces(self):
+        sock = connect(self.ports['json'])
+        data = GET * 3
+        for i in range(0, len(data), 7):
+            sock.sendall(data[i:i + 7])
+        self.assertEqual(read_all(sock).count('HTTP/1.1 200 OK'), 3)
+
+    def test_chunked(self):
+        # a body that looks like a request isn't taken for one
+        body = chunked('GET /inner HTTP/1.1\r\n\r\n', 'abc')
+        response = self.request(body + GET + GET)
+        # POST isn't supported, the error ends the connection
+        self.assertIn('501', response)
+        self.assertNotIn('200 OK', response)
+
+        body = chunked('GET /inner HTTP/1.1\r\n\r\n', 'abc')
+        body = body.replace('POST', 'GET', 1)
+        response = self.request(body + GET + GET)
+        self.assertEqual(response.count('HTTP/1.1 200 OK'), 3)
+
+    def test_chunked_trailer(self):
+        body = chunked('abc').replace('POST', 'GET', 1)
+        body = body[:-2] + 'X-Checksum: 1\r\n\r\n'
+        response = self.request(body + GET + GET)
+        self.assertEqual(response.count('HTTP/1.1 200 OK'), 3)
+
+    def test_bad_chunked(self):
+        head = 'GET / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+        for body in ('zz\r\n', '3\r\nabcXY0\r\n\r\n', 'ffffffff\r\nabc'):
+            response = self.request(head + body + GET, 'get')
+            # answered, then the connection is closed
+            self.assertEqual(response.count('200 OK'), 1)
+            self.assertIn('Connection: close', response)
+
+
+class RouterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EmbeddedServer({'router': {
+            'class': 'cynic.handlers.router.HTTPRouter',
+            'kwargs': {'max_requests': None, 'routes': [
+                ('GET', '/json', JSON),
+                ('GET', '/html', 'cynic.handlers.httphtml.HTTPHtmlResponse'),
+                ('*', '/reset', 'cynic.handlers.reset.RSTResponse'),
+                ]},
+            }})
+        self.port = self.server.start()['router']
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get(self, path, method='GET'):
+        sock = connect(self.port)
+        sock.sendall('%s %s HTTP/1.1\r\nHost: localhost\r\n'
+                     'Connection: close\r\n\r\n' % (method, path))
+        return read_all(sock)
+
+    def test_dispatch(self):
+        self.assertIn('application/json', self.get('/json'))
+        self.assertIn('application/json', self.get('/json/orders?id=1'))
+        self.assertIn('text/html', self.get('/html'))
+
+    def test_any_method(self):
+        self.assertIsNone(self.get('/reset', 'DELETE'))
+
+    def test_not_found(self):
+        for path in ('/', '/jsonp', '/other/json'):
+            self.assertIn('404', self.get(path).split('\r\n', 1)[0])
+        self.assertIn('404', self.get('/json', 'POST').split('\r\n', 1)[0])
+
+    def test_keep_alive(self):
+        sock = connect(self.port)
+        request = 'GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n'
+        sock.sendall(request % '/json' + request % '/html')
+        sock.sendall('GET /json HTTP/1.1\r\nConnection: close\r\n\r\n')
+        response = read_all(sock)
+        self.assertEqual(response.count('HTTP/1.1 200 OK'), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
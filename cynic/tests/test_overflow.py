@@ -0,0 +1,117 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import socket
+import unittest
+
+from cynic.embed import EmbeddedServer
+from cynic.tests import connect, read_all, wait_for
+
+GET = 'GET / HTTP/1.0\r\n\r\n'
+
+
+def capped(overflow, **options):
+    """One connection at a time to a JSON handler, then the overflow."""
+    options = dict(
+        options, max_connections=1, overflow=overflow,
+        **{'class': 'cynic.handlers.httpjson.HTTPJsonResponse'})
+    return EmbeddedServer({'json': options})
+
+
+class OverflowTestCase(unittest.TestCase):
+
+    def test_reset(self):
+        with capped('reset') as server:
+            held = connect(server.ports['json'])
+            wait_for(lambda: server.ioloop.active == 1)
+            self.assertIsNone(read_all(connect(server.ports['json'])))
+            held.sendall(GET)
+            self.assertIn('200 OK', read_all(held))
+            config, = server.ioloop.handler_configs
+            self.assertEqual(config.shed, 1)
+
+    def test_backlog(self):
+        with capped('backlog') as server:
+            held = connect(server.ports['json'])
+            wait_for(lambda: server.ioloop.active == 1)
+            waiting = connect(server.ports['json'], timeout=0.3)
+            waiting.sendall(GET)
+            # left in the listen backlog, not accepted yet
+            self.assertRaises(socket.timeout, waiting.recv, 1)
+            config, = server.ioloop.handler_configs
+            self.assertEqual(config.accepted, 1)
+
+            held.sendall(GET)
+            self.assertIn('200 OK', read_all(held))
+            waiting.settimeout(5)
+            self.assertIn('200 OK', read_all(waiting))
+
+    def test_queue(self):
+        with capped('queue') as server:
+            held = connect(server.ports['json'])
+            waiting = connect(server.ports['json'])
+            waiting.sendall(GET)
+            wait_for(lambda: len(server.ioloop.queue) == 1)
+            held.sendall(GET)
+            self.assertIn('200 OK', read_all(held))
+            self.assertIn('200 OK', read_all(waiting))
+            self.assertEqual(len(server.ioloop.queue), 0)
+
+    def test_queue_timeout(self):
+        with capped('queue', queue_timeout=0.1) as server:
+            held = connect(server.ports['json'])
+            waiting = connect(server.ports['json'])
+            wait_for(lambda: len(server.ioloop.queue) == 1)
+            self.assertIsNone(read_all(waiting))
+            self.assertEqual(len(server.ioloop.queue), 0)
+            held.sendall(GET)
+            self.assertIn('200 OK', read_all(held))
+
+    def test_queued_handlers_finishing_right_away(self):
+        # RSTResponse finishes within _spawn, releasing the room while
+        # the queue is being served
+        server = EmbeddedServer({
+            'json': {'class': 'cynic.handlers.httpjson.HTTPJsonResponse'},
+            'reset': {'class': 'cynic.handlers.reset.RSTResponse'},
+            }, max_connections=1, overflow='queue')
+        with server:
+            held = connect(server.ports['json'])
+            queued = [connect(server.ports['reset']) for _ in range(3)]
+            wait_for(lambda: len(server.ioloop.queue) == 3)
+            held.sendall(GET)
+            self.assertIn('200 OK', read_all(held))
+            for sock in queued:
+                self.assertIsNone(read_all(sock))
+
+            self.assertTrue(server.thread.is_alive())
+            sock = connect(server.ports['json'])
+            sock.sendall(GET)
+            self.assertIn('200 OK', read_all(sock))
+            self.assertEqual(len(server.ioloop.queue), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import random
+import unittest
+
+from cynic.timers import TimerWheel
+
+NOW = 1000.0
+
+
+class TimerWheelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # a small wheel, so timers go around it more than once
+        self.wheel = TimerWheel(tick=0.01, size=16, now=NOW)
+
+    def expire_every_tick(self, ticks):
+        """Return [(tick, values)] for the ticks with expired timers."""
+        result = []
+        for tick in xrange(1, ticks + 1):
+            values = self.wheel.expire(now=NOW + tick * 0.01 + 0.001)
+            if values:
+                result.append((tick, sorted(values)))
+        return result
+
+    def test_expire_in_order(self):
+        delays = [0.5, 0.01, 0.2, 0.05, 0.2, 1.0]
+        for number, delay in enumerate(delays):
+            self.wheel.add(delay, number, now=NOW)
+        self.assertEqual(len(self.wheel), 6)
+        self.assertEqual(self.expire_every_tick(200), [
+            (2, [1]), (6, [3]), (21, [2, 4]), (51, [0]), (101, [5])])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertIsNone(self.wheel.next_deadline())
+
+    def test_expire_after_pause(self):
+        for number in range(10):
+            self.wheel.add(number * 0.1, number, now=NOW)
+        self.assertEqual(sorted(self.wheel.expire(now=NOW + 0.55)),
+                         [0, 1, 2, 3, 4, 5])
+        self.assertEqual(sorted(self.wheel.expire(now=NOW + 60)),
+                         [6, 7, 8, 9])
+
+    def test_cancel(self):
+        timers = [self.wheel.add(0.1, number, now=NOW)
+                  for number in range(4)]
+        self.wheel.cancel(timers[1])
+        self.wheel.cancel(timers[1])
+        self.assertEqual(len(self.wheel), 3)
+        self.assertEqual(sorted(self.wheel.expire(now=NOW + 1)), [0, 2, 3])
+        # cancelling an expired timer does nothing
+        self.wheel.cancel(timers[0])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_next_deadline(self):
+        self.assertIsNone(self.wheel.next_deadline())
+        late = self.wheel.add(2.0, 'late', now=NOW)
+        self.assertAlmostEqual(self.wheel.next_deadline(), NOW + 2.01)
+        early = self.wheel.add(0.1, 'early', now=NOW)
+        self.assertAlmostEqual(self.wheel.next_deadline(), NOW + 0.11)
+        self.wheel.cancel(early)
+        self.assertAlmostEqual(self.wheel.next_deadline(), NOW + 2.01)
+        self.wheel.cancel(late)
+        self.assertIsNone(self.wheel.next_deadline())
+
+    def test_next_deadline_matches_earliest_timer(self):
+        rnd = random.Random(1)
+        now = NOW
+        timers = {}
+        for step in xrange(2000):
+            action = rnd.random()
+            if action < 0.3:
+                timer = self.wheel.add(rnd.random() * 0.5, step, now=now)
+                timers[step] = timer
+            elif action < 0.4 and timers:
+                self.wheel.cancel(timers.pop(rnd.choice(timers.keys())))
+            else:
+                now += rnd.random() * 0.03
+                for value in self.wheel.expire(now=now):
+                    del timers[value]
+            if timers:
+                earliest = min(timer.expires for timer in timers.values())
+                self.assertAlmostEqual(
+                    self.wheel.next_deadline(), earliest * self.wheel.tick)
+            else:
+                self.assertIsNone(self.wheel.next_deadline())
+
+
+if __name__ == '__main__':
+    unittest.main()
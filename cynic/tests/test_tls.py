@@ -0,0 +1,120 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import ssl
+import time
+import shutil
+import tempfile
+import unittest
+from distutils.spawn import find_executable
+
+from cynic import tls
+from cynic.embed import EmbeddedServer
+from cynic.tests import connect
+
+JSON = 'cynic.handlers.httpjson.HTTPJsonResponse'
+GET = 'GET / HTTP/1.0\r\n\r\n'
+
+
+@unittest.skipUnless(find_executable('openssl'), 'openssl is not installed')
+class TLSWrapperTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cert_dir = tempfile.mkdtemp()
+        handlers = {}
+        for name, kwargs in (
+            ('valid', {}),
+            ('expired', {'certificate': 'expired'}),
+            ('mismatch', {'certificate': 'mismatch'}),
+            ('slow', {'fault': 'slow_handshake', 'handshake_delay': 0.3}),
+            ('truncated', {'fault': 'truncated_handshake'}),
+            ('no_close_notify', {'fault': 'no_close_notify'}),
+            ):
+            kwargs = dict(kwargs, handler=JSON, cert_dir=cls.cert_dir)
+            handlers[name] = {
+                'class': 'cynic.handlers.tls.TLSWrapper', 'kwargs': kwargs}
+        cls.server = EmbeddedServer(handlers)
+        cls.ports = cls.server.start()
+
+        cls.context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        cls.context.verify_mode = ssl.CERT_REQUIRED
+        cls.context.check_hostname = True
+        cls.context.load_verify_locations(tls.get_ca(cls.cert_dir)[0])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.cert_dir)
+
+    def connect(self, name):
+        return self.context.wrap_socket(
+            connect(self.ports[name]), server_hostname='localhost',
+            suppress_ragged_eofs=False)
+
+    def get(self, sock):
+        sock.sendall(GET)
+        response = ''
+        while True:
+            data = sock.recv(8192)
+            if not data:
+                return response
+            response += data
+
+    def test_valid(self):
+        response = self.get(self.connect('valid'))
+        self.assertIn('200 OK', response)
+        self.assertIn('Hello, World!', response)
+
+    def test_expired(self):
+        with self.assertRaises(ssl.SSLError) as cm:
+            self.connect('expired')
+        self.assertIn('CERTIFICATE_VERIFY_FAILED', str(cm.exception))
+
+    def test_mismatch(self):
+        self.assertRaises(ssl.CertificateError, self.connect, 'mismatch')
+
+    def test_slow_handshake(self):
+        started = time.time()
+        sock = self.connect('slow')
+        self.assertGreaterEqual(time.time() - started, 0.3)
+        self.assertIn('200 OK', self.get(sock))
+
+    def test_truncated_handshake(self):
+        self.assertRaises(ssl.SSLError, self.connect, 'truncated')
+
+    def test_no_close_notify(self):
+        sock = self.connect('no_close_notify')
+        sock.sendall(GET)
+        response = ''
+        with self.assertRaises(ssl.SSLError):
+            while True:
+                response += sock.recv(8192)
+        self.assertIn('200 OK', response)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import socket
+import unittest
+
+from cynic import datagrams
+from cynic.embed import EmbeddedServer
+from cynic.tests import wait_for
+
+HAVE_MMSG = (
+    datagrams._recvmmsg is not None and datagrams._sendmmsg is not None)
+
+
+def udp_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(2)
+    return sock
+
+
+def receive(sock, count):
+    result = []
+    for _ in xrange(count):
+        try:
+            result.append(sock.recv(65535))
+        except socket.timeout:
+            break
+    return result
+
+
+@unittest.skipUnless(HAVE_MMSG, 'recvmmsg and sendmmsg are not available')
+class MMsgDatagramSocketTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = udp_socket()
+        self.server = datagrams.get_datagram_socket(udp_socket(), batch=8)
+        self.address = self.server.socket.getsockname()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_batches(self):
+        self.assertIsInstance(self.server, datagrams.MMsgDatagramSocket)
+        sent = ['datagram %d' % number * (number + 1) for number in range(20)]
+        for data in sent:
+            self.client.sendto(data, self.address)
+
+        received = []
+        wait_for(lambda: received.extend(self.server.recv()) or
+                 len(received) == 20)
+        self.assertEqual([data for data, address in received], sent)
+
+        # replies go to the opaque addresses of the datagrams
+        replies = [(data.upper(), address) for data, address in received]
+        self.assertEqual(self.server.send(replies[:12]), 12)
+        self.assertEqual(self.server.send(replies[12:]), 8)
+        self.assertEqual(
+            receive(self.client, 20), [data.upper() for data in sent])
+
+    def test_empty_and_large(self):
+        for data in ('', 'x' * 60000):
+            self.client.sendto(data, self.address)
+        received = []
+        wait_for(lambda: received.extend(self.server.recv()) or
+                 len(received) == 2)
+        self.assertEqual([data for data, address in received],
+                         ['', 'x' * 60000])
+        self.assertEqual(self.server.send(received), 2)
+        self.assertEqual(receive(self.client, 2), ['', 'x' * 60000])
+
+
+class UDPEchoTestCase(unittest.TestCase):
+
+    def start(self, **kwargs):
+        server = EmbeddedServer({'echo': {
+            'class': 'cynic.handlers.udp.UDPEchoResponse',
+            'kwargs': kwargs, 'type': 'dgram'}})
+        self.address = ('127.0.0.1', server.start()['echo'])
+        self.addCleanup(server.stop)
+        return server
+
+    def echo(self, count, replies=None, timeout=2):
+        """Send count datagrams and return up to replies replies."""
+        client = udp_socket()
+        client.settimeout(timeout)
+        self.addCleanup(client.close)
+        for number in range(count):
+            client.sendto(str(number), self.address)
+        return receive(client, replies or count)
+
+    def test_echo(self):
+        server = self.start()
+        if HAVE_MMSG:
+            config, = server.ioloop.handler_configs
+            self.assertIsInstance(
+                config.datagrams, datagrams.MMsgDatagramSocket)
+        self.assertEqual(self.echo(50), [str(number) for number in range(50)])
+
+    def test_faults(self):
+        self.start(drop=0.5, seed=1)
+        replies = self.echo(200, timeout=0.3)
+        self.assertTrue(50 < len(replies) < 150, len(replies))
+
+        self.start(duplicate=1)
+        self.assertEqual(self.echo(5, 10), ['0', '0', '1', '1', '2', '2',
+                                        '3', '3', '4', '4'])
+
+    def test_no_reply(self):
+        self.start(reply=False)
+        client = udp_socket()
+        client.settimeout(0.2)
+        self.addCleanup(client.close)
+        client.sendto('ping', self.address)
+        self.assertEqual(receive(client, 1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
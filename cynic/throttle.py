@@ -0,0 +1,199 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+"""Token bucket bandwidth throttling.
+
+A throttled connection is wrapped in ThrottledSocket, which grants every
+``send`` only as many bytes as its buckets allow and raises Throttled
+with the time to wait otherwise. The cynic.tasks write helpers turn that
+into a Sleep, so any handler's write path is throttled transparently.
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import re
+import time
+import multiprocessing
+
+# sends are batched into chunks of about 1/QUANTUM_DIVISOR of a second
+# worth of data, but not less than MIN_QUANTUM bytes
+QUANTUM_DIVISOR = 20
+MIN_QUANTUM = 512
+MAX_QUANTUM = 64 * 1024
+
+_RATE = re.compile(r'^\s*([\d.]+)\s*([kmg]?)(bit|b)?\s*$', re.I)
+_MULTIPLIERS = {'': 1, 'k': 10 ** 3, 'm': 10 ** 6, 'g': 10 ** 9}
+
+
+def parse_rate(value):
+    """Return the rate in bytes per second.
+
+    Accepts plain numbers of bytes per second, bits per second with the
+    'bit' suffix (56kbit, 2mbit) and bytes per second with the 'b' suffix
+    (512kb, 10mb). Multipliers are decimal.
+    """
+    match = _RATE.match(value)
+    if match is None:
+        raise ValueError('Invalid rate %r' % value)
+    number, multiplier, unit = match.groups()
+    rate = float(number) * _MULTIPLIERS[multiplier.lower()]
+    if unit and unit.lower() == 'bit':
+        rate /= 8
+    return rate
+
+
+def get_quantum(rate):
+    return int(min(MAX_QUANTUM, max(MIN_QUANTUM, rate / QUANTUM_DIVISOR)))
+
+
+class Throttled(Exception):
+    """Raised by ThrottledSocket when the data has to wait."""
+
+    def __init__(self, delay):
+        Exception.__init__(self, delay)
+        self.delay = delay
+
+
+class TokenBucket(object):
+    """Token bucket of rate bytes per second.
+
+    With shared=True the state lives in shared memory protected by a
+    process-shared lock, so the bucket created before fork limits the
+    aggregate bandwidth of all children and workers.
+    """
+
+    def __init__(self, rate, burst=None, shared=False):
+        self.rate = float(rate)
+        self.burst = burst or get_quantum(rate)
+        if shared:
+            self.state = multiprocessing.RawArray('d', 2)
+            self.lock = multiprocessing.Lock()
+        else:
+            self.state = [0.0, 0.0]
+            self.lock = None
+        self.state[0] = self.burst # tokens
+        self.state[1] = time.time() # last refill
+
+    def _refill(self, now):
+        state = self.state
+        state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+        state[1] = now
+
+    def available(self, now):
+        if self.lock is None:
+            self._refill(now)
+            return self.state[0]
+        with self.lock:
+            self._refill(now)
+            return self.state[0]
+
+    def consume(self, size):
+        """Take size tokens out, may go into debt if shared."""
+        if self.lock is None:
+            self.state[0] -= size
+        else:
+            with self.lock:
+                self.state[0] -= size
+
+    def get_delay(self, size, now):
+        """Return secs until size tokens are available."""
+        return max(0, (size - self.available(now)) / self.rate)
+
+
+class Limiter(object):
+    """Grants sends allowed by all of its token buckets."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.quantum = min(bucket.burst for bucket in buckets)
+
+    def grant(self, size):
+        """Return the number of bytes that can be sent now.
+
+        Raises Throttled if less than a quantum (or size if smaller)
+        can be sent, so data goes out in efficient chunks.
+        """
+        now = time.time()
+        wanted = min(size, self.quantum)
+        available = min(bucket.available(now) for bucket in self.buckets)
+        if available < wanted:
+            raise Throttled(max(
+                bucket.get_delay(wanted, now) for bucket in self.buckets))
+        granted = min(size, int(available))
+        for bucket in self.buckets:
+            bucket.consume(granted)
+        return granted
+
+    def refund(self, size):
+        for bucket in self.buckets:
+            bucket.consume(-size)
+
+
+class ThrottledSocket(object):
+    """Socket wrapper that limits the bandwidth of send.
+
+    Everything else is delegated to the wrapped socket.
+    """
+
+    def __init__(self, sock, limiter):
+        self._sock = sock
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def send(self, data, flags=0):
+        granted = self.limiter.grant(len(data))
+        sent = self._sock.send(buffer(data, 0, granted), flags)
+        if sent < granted:
+            self.limiter.refund(granted - sent)
+        return sent
+
+    def sendall(self, data, flags=0):
+        # blocking flavour for code outside of tasks
+        view = buffer(data)
+        while view:
+            try:
+                sent = self.send(view, flags)
+            except Throttled as e:
+                time.sleep(e.delay)
+                continue
+            view = buffer(view, sent)
+
+
+def throttle(sock, rate=None, port_bucket=None):
+    """Wrap the connection in a ThrottledSocket if any limit is set.
+
+    rate - per connection limit in bytes per second
+    port_bucket - shared TokenBucket of all connections on the port
+    """
+    buckets = []
+    if rate:
+        buckets.append(TokenBucket(rate))
+    if port_bucket is not None:
+        buckets.append(port_bucket)
+    if not buckets:
+        return sock
+    return ThrottledSocket(sock, Limiter(buckets))
@@ -0,0 +1,158 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import time
+
+TICK = 0.01 # secs
+WHEEL_SIZE = 4096 # slots, one revolution is about 41 secs with the TICK
+
+
+class Timer(object):
+    """A single scheduled timer."""
+
+    __slots__ = ('expires', 'value', 'cancelled')
+
+    def __init__(self, expires, value):
+        self.expires = expires # absolute tick number
+        self.value = value
+        self.cancelled = False
+
+
+class TimerWheel(object):
+    """Hashed timing wheel.
+
+    Timers are hashed into slots by the tick they expire on, so adding
+    and cancelling a timer costs O(1) no matter how many timers are
+    pending, and every tick only looks at a single slot. Timers that are
+    more than one revolution away simply stay in their slot until the
+    wheel comes around again at the right tick.
+    """
+
+    def __init__(self, tick=TICK, size=WHEEL_SIZE, now=None):
+        self.tick = tick
+        self.size = size
+        self.slots = [None] * size
+        if now is None:
+            now = time.time()
+        self.current = int(now / tick) # last processed tick
+        self.count = 0
+        # no pending timer expires before this tick
+        self.next_tick = self.current + 1
+
+    def __len__(self):
+        return self.count
+
+    def add(self, delay, value, now=None):
+        """Schedule value to be expired in delay seconds.
+
+        Returns the Timer that can be passed to cancel.
+        """
+        if now is None:
+            now = time.time()
+        expires = max(int((now + delay) / self.tick) + 1, self.current + 1)
+        timer = Timer(expires, value)
+        if expires < self.next_tick:
+            self.next_tick = expires
+        index = expires % self.size
+        slot = self.slots[index]
+        if slot is None:
+            slot = self.slots[index] = []
+        slot.append(timer)
+        self.count += 1
+        return timer
+
+    def cancel(self, timer):
+        """Cancel the timer. It is dropped lazily when its slot comes up."""
+        if not timer.cancelled:
+            timer.cancelled = True
+            timer.value = None
+            self.count -= 1
+
+    def expire(self, now=None):
+        """Return values of all timers that are due by now."""
+        if now is None:
+            now = time.time()
+        target = int(now / self.tick)
+        if target <= self.current:
+            return []
+
+        expired = []
+        slots = self.slots
+        # after a long pause every slot is visited just once
+        start = max(self.current + 1, target - self.size + 1)
+        for tick in xrange(start, target + 1):
+            index = tick % self.size
+            slot = slots[index]
+            if slot is None:
+                continue
+            pending = []
+            for timer in slot:
+                if timer.cancelled:
+                    continue
+                if timer.expires <= target:
+                    expired.append(timer.value)
+                    timer.value = None
+                    # cancelling an expired timer is a no-op
+                    timer.cancelled = True
+                else:
+                    pending.append(timer)
+            slots[index] = pending or None
+
+        self.current = target
+        self.count -= len(expired)
+        return expired
+
+    def next_deadline(self):
+        """Return the time the earliest pending timer expires or None.
+
+        The scan resumes from the earliest tick that may still have a
+        timer, so ticks known to be empty are not looked at again and
+        sparse timers don't cost a pass over the wheel on every call.
+        """
+        if not self.count:
+            return None
+        slots = self.slots
+        size = self.size
+        start = max(self.next_tick, self.current + 1)
+        earliest = None
+        for tick in xrange(start, start + size):
+            slot = slots[tick % size]
+            if slot is None:
+                continue
+            for timer in slot:
+                if timer.cancelled:
+                    continue
+                if timer.expires == tick:
+                    self.next_tick = tick
+                    return tick * self.tick
+                if earliest is None or timer.expires < earliest:
+                    earliest = timer.expires
+        if earliest is None:
+            return None
+        # all timers are more than a revolution away
+        self.next_tick = earliest
+        return earliest * self.tick
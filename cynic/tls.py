@@ -0,0 +1,152 @@
+###############################################################################
+#
+# Copyright (c) 2012 Ruslan Spivak
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+###############################################################################
+
+"""TLS contexts and locally generated certificates.
+
+A context is built once per set of arguments, before any fork, and
+shared by all connections of the handlers using it. Forked children
+and prefork workers inherit its session ticket keys, so clients resume
+their sessions whichever process serves them and handshakes stay cheap
+under connection churn.
+
+Certificates are generated with the openssl command line tool into a
+directory that outlives the server. They're signed by a local CA,
+ca.pem in the directory, that clients under test can be told to trust,
+so only the faulty certificates fail verification:
+
+'valid' - for localhost and 127.0.0.1
+'expired' - for localhost and 127.0.0.1, expired a day ago
+'mismatch' - for wrong.host.invalid
+"""
+
+__author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
+
+import os
+import ssl
+import random
+import tempfile
+import subprocess
+
+CERT_DIR = os.path.join(tempfile.gettempdir(), 'cynic-tls')
+CA_DAYS = 3650
+KEY_TYPE = 'rsa:2048'
+
+# kind -> (common name, subjectAltName, days valid)
+CERTIFICATES = {
+    'valid': ('localhost', 'DNS:localhost,IP:127.0.0.1', 365),
+    'expired': ('localhost', 'DNS:localhost,IP:127.0.0.1', -1),
+    'mismatch': ('wrong.host.invalid', 'DNS:wrong.host.invalid', 365),
+    }
+
+_contexts = {}
+
+
+def _openssl(*args):
+    try:
+        process = subprocess.Popen(
+            ('openssl',) + args,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+        raise RuntimeError(
+            'The openssl command line tool is needed to generate '
+            'certificates: %s' % e)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError(
+            'openssl %s failed: %s' % (args[0], output.strip()))
+
+
+def get_ca(directory=CERT_DIR):
+    """Return (certfile, keyfile) of the local CA, generating it if new."""
+    certfile = os.path.join(directory, 'ca.pem')
+    keyfile = os.path.join(directory, 'ca.key')
+    if not os.path.exists(certfile):
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        _generate(certfile, keyfile, 'req', '-x509', '-days', str(CA_DAYS),
+                  '-subj', '/CN=Cynic test CA')
+    return certfile, keyfile
+
+
+def get_certificate(kind, directory=CERT_DIR):
+    """Return (certfile, keyfile) of a certificate, generating it if new."""
+    if kind not in CERTIFICATES:
+        raise ValueError('Unknown certificate %r' % (kind,))
+    ca_certfile, ca_keyfile = get_ca(directory)
+    certfile = os.path.join(directory, kind + '.pem')
+    keyfile = os.path.join(directory, kind + '.key')
+    if os.path.exists(certfile):
+        return certfile, keyfile
+
+    name, alt_names, days = CERTIFICATES[kind]
+    request = certfile + '.csr'
+    extensions = certfile + '.ext'
+    with open(extensions, 'w') as f:
+        f.write('subjectAltName=%s\n' % alt_names)
+    try:
+        _generate(request, keyfile, 'req', '-subj', '/CN=' + name)
+        # a negative number of days makes the certificate expired
+        _openssl(
+            'x509', '-req', '-in', request, '-CA', ca_certfile,
+            '-CAkey', ca_keyfile, '-set_serial', str(random.getrandbits(63)),
+            '-days', str(days), '-extfile', extensions,
+            '-out', certfile + '.tmp')
+        os.rename(certfile + '.tmp', certfile)
+    finally:
+        for path in (request, extensions):
+            if os.path.exists(path):
+                os.unlink(path)
+    return certfile, keyfile
+
+
+def _generate(outfile, keyfile, *args):
+    """Run openssl req generating a new key.
+
+    Files are renamed into place once complete, the certificate last,
+    so servers started at the same time never load half-written ones.
+    """
+    _openssl(*(args + (
+        '-newkey', KEY_TYPE, '-nodes', '-keyout', keyfile + '.tmp',
+        '-out', outfile + '.tmp')))
+    os.rename(keyfile + '.tmp', keyfile)
+    os.rename(outfile + '.tmp', outfile)
+
+
+def get_context(certificate='valid', certfile=None, keyfile=None,
+                directory=CERT_DIR):
+    """Return the server context for the certificate, built once.
+
+    certificate - kind of a generated certificate, see CERTIFICATES
+    certfile, keyfile - PEM files of a certificate of your own instead
+    """
+    key = certificate, certfile, keyfile, directory
+    context = _contexts.get(key)
+    if context is None:
+        if certfile is None:
+            certfile, keyfile = get_certificate(certificate, directory)
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+        context.load_cert_chain(certfile, keyfile)
+        _contexts[key] = context
+    return context
@@ -24,14 +24,23 @@
 
 __author__ = 'Ruslan Spivak <ruslan.spivak@gmail.com>'
 
+import os
+import struct
 import socket
 import logging
+import ctypes
+import ctypes.util
 from logging import handlers
 
 import logsna
 
+from cynic.ringlog import RingLogHandler
+
 LOG_UNIX_SOCKET = '/tmp/_cynic.sock'
 
+# (ring, lane) of the shared memory log transport assigned to this child
+_log_lane = None
+
 class LogUnixSocketHandler(handlers.SocketHandler):
     """Sends pickled log records over a Unix domain socket."""
 
@@ -48,14 +57,30 @@ class LogUnixSocketHandler(handlers.SocketHandler):
         return s
 
 
+def set_log_lane(ring, lane):
+    """Make this child's stream loggers write into the lane of the ring."""
+    global _log_lane
+    _log_lane = (ring, lane)
+
+
 def get_stream_logger(name, level=logging.DEBUG):
     """Logger for children that serve client connections.
 
-    It uses LogUnixSocketHandler to communicate with parent's
-    logging server.
+    It writes records into the child's lane of the parent's shared
+    memory ring (see cynic.ringlog) if one was assigned with set_log_lane,
+    otherwise it uses LogUnixSocketHandler to communicate with parent's
+    logging server. Loggers that already have handlers are
+    returned as is.
     """
     logger = logging.getLogger(name)
+    if logger.handlers:
+        # already set up by an earlier handler in this process
+        return logger
     logger.setLevel(level)
+    if _log_lane is not None:
+        ring, lane = _log_lane
+        logger.addHandler(RingLogHandler(ring, lane))
+        return logger
     socket_handler = LogUnixSocketHandler()
     # don't bother with a formatter, since a socket handler sends the event as
     # an unformatted pickle
@@ -64,7 +89,16 @@ def get_stream_logger(name, level=logging.DEBUG):
 
 
 def get_console_logger(name):
+    """Logger that outputs to the console.
+
+    The console handler is added only once no matter how many times
+    the function is called for the same name.
+    """
     logger = logging.getLogger(name)
+    for handler in logger.handlers:
+        if type(handler) is logging.StreamHandler:
+            return logger
+
     logger.setLevel(logging.DEBUG)
 
     # create console handler and set level to debug
@@ -81,3 +115,134 @@ def get_console_logger(name):
     logger.addHandler(ch)
 
     return logger
+
+
+# taken from logging.config
+def resolve(name):
+    """Resolve a dotted name to a global object."""
+    name = name.split('.')
+    used = name.pop(0)
+    found = __import__(used)
+    for n in name:
+        used = used + '.' + n
+        try:
+            found = getattr(found, n)
+        except AttributeError:
+            __import__(used)
+            found = getattr(found, n)
+    return found
+
+
+def get_accept_queue(sock):
+    """Return (length, limit) of the listen socket's accept queue.
+
+    Linux only, None if the information is not available.
+    """
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+    except (AttributeError, socket.error):
+        return None
+    # for listen sockets tcpi_unacked and tcpi_sacked hold the current
+    # and maximum lengths of the accept queue
+    unacked, sacked = struct.unpack_from('II', info, 24)
+    return unacked, sacked
+
+
+def get_tcp_bytes(sock):
+    """Return (bytes sent, bytes received) of a connection.
+
+    Bytes sent don't count retransmissions. Kernels older than 4.19
+    only report the bytes acknowledged by the peer. Linux only, None if
+    the information is not available.
+    """
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 216)
+    except (AttributeError, socket.error):
+        return None
+    if len(info) < 136:
+        return None
+    sent, received = struct.unpack_from('QQ', info, 120)
+    if len(info) >= 216:
+        sent, retransmitted = struct.unpack_from('QQ', info, 200)
+        sent -= retransmitted
+    return sent, received
+
+
+def get_listen_overflows():
+    """Return system wide number of listen queue overflows or None."""
+    try:
+        with open('/proc/net/netstat') as fin:
+            lines = fin.readlines()
+    except IOError:
+        return None
+    for names, values in zip(lines[::2], lines[1::2]):
+        if not names.startswith('TcpExt:'):
+            continue
+        stats = dict(zip(names.split()[1:], values.split()[1:]))
+        if 'ListenOverflows' in stats:
+            return int(stats['ListenOverflows'])
+    return None
+
+
+def _libc_sendfile():
+    """Return a sendfile(2) wrapper built with ctypes or None.
+
+    Python 2 has no os.sendfile, the wrapper has the same signature:
+    sendfile(out_fd, in_fd, offset, count) -> number of bytes sent.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.sendfile64
+    except (OSError, AttributeError, TypeError):
+        return None
+    func.argtypes = [
+        ctypes.c_int, ctypes.c_int,
+        ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t
+        ]
+    func.restype = ctypes.c_ssize_t
+
+    def sendfile(out_fd, in_fd, offset, count):
+        off = ctypes.c_int64(offset)
+        sent = func(out_fd, in_fd, ctypes.byref(off), count)
+        if sent < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        return sent
+
+    return sendfile
+
+# None when the platform doesn't support zero-copy sends
+sendfile = getattr(os, 'sendfile', None) or _libc_sendfile()
+
+SPLICE_F_MOVE = 1
+SPLICE_F_NONBLOCK = 2
+
+
+def _libc_splice():
+    """Return a splice(2) wrapper built with ctypes or None.
+
+    splice(fd_in, fd_out, count, flags) -> number of bytes moved, one
+    of the descriptors must be a pipe. Linux only.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = libc.splice
+    except (OSError, AttributeError, TypeError):
+        return None
+    func.argtypes = [
+        ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+        ctypes.c_size_t, ctypes.c_uint
+        ]
+    func.restype = ctypes.c_ssize_t
+
+    def splice(fd_in, fd_out, count, flags=SPLICE_F_MOVE | SPLICE_F_NONBLOCK):
+        moved = func(fd_in, None, fd_out, None, count, flags)
+        if moved < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        return moved
+
+    return splice
+
+# None when the platform can't move data between sockets in the kernel
+splice = _libc_splice()
@@ -55,6 +55,7 @@ setup(
     entry_points="""\
     [console_scripts]
     cynic = cynic.server:main
+    cynic-bench = cynic.bench:main
     """,
     classifiers=filter(None, classifiers.split('\n')),
     long_description=read('README.rst') + '\n\n' + read('CHANGES.rst'),